@@ -1,5 +1,8 @@
-from .clevertap import CleverTap
+from .clevertap import CleverTap, AsyncCleverTap
+from .producer import EventProducer
 
 __all__ = [
-    "CleverTap"
+    "CleverTap",
+    "AsyncCleverTap",
+    "EventProducer"
 ]
\ No newline at end of file
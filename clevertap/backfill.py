@@ -0,0 +1,88 @@
+"""
+Helpers for backfilling historical events: vectorized timestamp conversion and
+building event batches from a DataFrame. Kept out of `clevertap/__init__.py`
+so the client does not need pandas; import from `clevertap.backfill`.
+"""
+import numpy as np
+import pandas as pd
+from typing import List, Optional
+
+from .clevertap import CleverTapEvent, EVENTS_ADAPTER
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+def to_unix_many(values, tz_offset_hours: float = 0, format: str = DATETIME_FORMAT) -> np.ndarray:
+    """
+    Vectorized `CleverTap._to_unix`: converts a list, array or column of
+    datetime strings in local time (UTC + tz_offset_hours) to Unix timestamps
+    in one pass. Datetime columns are used as they are; timezone-aware ones
+    ignore tz_offset_hours. Raises ValueError if any value cannot be parsed.
+    """
+    series = values if isinstance(values, pd.Series) else pd.Series(values)
+    if not pd.api.types.is_datetime64_any_dtype(series):
+        series = pd.to_datetime(series, format=format)
+    if series.isna().any():
+        raise ValueError(f"Missing datetime at positions {np.flatnonzero(series.isna().to_numpy())[:10].tolist()}")
+    if series.dt.tz is not None:
+        # Already an instant in time, the offset is part of the value
+        series = series.dt.tz_convert(None)
+        tz_offset_hours = 0
+    seconds = series.to_numpy(dtype="datetime64[s]").astype(np.int64)
+    return seconds - int(round(tz_offset_hours * 3600))
+
+def _key_values(series: pd.Series) -> List[Optional[str]]:
+    # Identities as strings; missing values become None, not "nan"
+    if pd.api.types.is_float_dtype(series):
+        # Integer ids in a column with missing values are read as floats, 123.0 -> "123"
+        present = series.dropna()
+        if (present == present.round()).all():
+            series = series.astype("Int64")
+    return [None if pd.isna(value) else str(value) for value in series.astype(object)]
+
+def events_from_frame(df: pd.DataFrame,
+                      event_name: Optional[str] = None,
+                      event_name_column: str = "evtName",
+                      time_column: str = "datetime",
+                      identity_column: Optional[str] = "identity",
+                      object_id_column: Optional[str] = None,
+                      data_columns: Optional[List[str]] = None,
+                      tz_offset_hours: float = 0,
+                      format: str = DATETIME_FORMAT) -> List[CleverTapEvent]:
+    """
+    One CleverTapEvent per row of `df`, ready for `upload_events`.
+
+    The event name is `event_name` for every row, or read from
+    `event_name_column`. `ts` is converted from `time_column` with
+    to_unix_many, and evtData holds `data_columns` (by default every other
+    column), with missing values as null.
+
+    Events are keyed by `identity_column`, `object_id_column` (CleverTap's
+    objectId) or both; pass None to leave one out. A missing value leaves that
+    key unset for the row.
+    """
+    if identity_column is None and object_id_column is None:
+        raise ValueError("Pass identity_column or object_id_column")
+    ts = to_unix_many(df[time_column], tz_offset_hours=tz_offset_hours, format=format)
+    if event_name is not None:
+        names = [event_name] * len(df)
+    else:
+        names = df[event_name_column].astype(str).tolist()
+    identities = _key_values(df[identity_column]) if identity_column is not None else [None] * len(df)
+    object_ids = _key_values(df[object_id_column]) if object_id_column is not None else [None] * len(df)
+    if data_columns is None:
+        used = {time_column, identity_column, object_id_column} | (set() if event_name is not None else {event_name_column})
+        data_columns = [column for column in df.columns if column not in used]
+    data = df[data_columns]
+    evt_data = data.astype(object).where(data.notna(), None).to_dict(orient="records")
+
+    records = []
+    for name, timestamp, identity, object_id, values in zip(names, ts.tolist(), identities, object_ids, evt_data):
+        # "type" is set explicitly, fields left at their default are not uploaded
+        record = {"type": "event", "evtName": name, "ts": timestamp, "evtData": values}
+        if identity is not None:
+            record["identity"] = identity
+        if object_id is not None:
+            record["objectId"] = object_id
+        records.append(record)
+    # Validated here once; upload_events does not validate the models again
+    return EVENTS_ADAPTER.validate_python(records)
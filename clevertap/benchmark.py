@@ -0,0 +1,79 @@
+"""
+Per-event cost of validating and serializing CleverTap upload payloads.
+
+Compares, for --events events uploaded in batches of --batch events:
+  adapter_per_call   a new TypeAdapter per batch, then json.dumps of the raw dicts (the old path)
+  cached_adapter     the module-level adapter, then json.dumps of the raw dicts
+  validate_once      the module-level adapter, then the models serialized to JSON bytes (the upload path)
+  no_validation      json.dumps only, as with validate=False
+
+Usage: python clevertap/benchmark.py [--events 100000] [--batch 1000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import List
+
+# Run from the repository root or from this folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pydantic import TypeAdapter
+
+from clevertap.clevertap import CleverTapEvent, EVENTS_ADAPTER, encode_upload
+
+
+def make_events(count: int) -> List[dict]:
+    return [
+        {
+            "identity": f"user_{i % 5000}",
+            "evtName": "Product Viewed",
+            "ts": 1710000000 + i,
+            "evtData": {"Product Name": f"Product {i % 300}", "Category": "Electronics", "Price": i % 1000},
+        }
+        for i in range(count)
+    ]
+
+
+def adapter_per_call(batch):
+    TypeAdapter(List[CleverTapEvent]).validate_python(batch)
+    return json.dumps({"d": batch}).encode()
+
+
+def cached_adapter(batch):
+    EVENTS_ADAPTER.validate_python(batch)
+    return json.dumps({"d": batch}).encode()
+
+
+def validate_once(batch):
+    return encode_upload(EVENTS_ADAPTER.validate_python(batch))
+
+
+def no_validation(batch):
+    return json.dumps({"d": batch}).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=100_000)
+    parser.add_argument("--batch", type=int, default=1000, help="Events per upload call")
+    parser.add_argument("--repeat", type=int, default=3, help="Best of this many runs")
+    args = parser.parse_args()
+
+    events = make_events(args.events)
+    batches = [events[start:start + args.batch] for start in range(0, len(events), args.batch)]
+    print(f"{args.events} events in batches of {args.batch}")
+    print(f"{'path':>18} {'total ms':>10} {'us/event':>10}")
+    for path in (adapter_per_call, cached_adapter, validate_once, no_validation):
+        best = float("inf")
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            for batch in batches:
+                path(batch)
+            best = min(best, time.perf_counter() - start)
+        print(f"{path.__name__:>18} {best * 1000:>10.1f} {best / args.events * 1e6:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
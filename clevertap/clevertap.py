@@ -1,11 +1,27 @@
 import requests
+import httpx
+import asyncio
 import os
 import json
-from pydantic import BaseModel, ValidationError, TypeAdapter
+import time
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from pydantic import BaseModel, ConfigDict, ValidationError, TypeAdapter
 from datetime import datetime, timezone, timedelta
-from typing import Optional, List
+from typing import Optional, List, Tuple
+
+DEFAULT_BASE_URL = "https://sg1.api.clevertap.com/1"
+
+# CleverTap accepts at most 1000 records per upload request
+MAX_RECORDS_PER_UPLOAD = 1000
+
+# Responses worth retrying: rate limited or a temporary server error
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
 
 class CleverTapProfile(BaseModel):
+    # Fields the models do not declare are kept and uploaded as they are
+    model_config = ConfigDict(extra="allow")
+
     type: str = "profile"
     identity: Optional[str] = None
     objectId: Optional[str] = None
@@ -13,6 +29,8 @@ class CleverTapProfile(BaseModel):
     profileData: dict
 
 class CleverTapEvent(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
     type: str = "event"
     evtName: str
     ts: int
@@ -22,79 +40,290 @@ class CleverTapEvent(BaseModel):
     GPID: Optional[str] = None
     evtData: dict
 
-class CleverTap:
-    def __init__(self, clevertap_account_id:str=None, clevertap_passcode:str=None):
+# Building a TypeAdapter compiles a validator and serializer, so it is done once here
+PROFILES_ADAPTER = TypeAdapter(List[CleverTapProfile])
+EVENTS_ADAPTER = TypeAdapter(List[CleverTapEvent])
+ADAPTERS = {CleverTapProfile: PROFILES_ADAPTER, CleverTapEvent: EVENTS_ADAPTER}
+
+def encode_upload(records) -> bytes:
+    """
+    Body of one upload request. Validated models are serialized straight to
+    JSON bytes by pydantic; plain dicts (uploads with validate=False) go
+    through json.dumps. Models are written with the fields the caller set,
+    including those set to None, like the dicts they were validated from.
+    """
+    if records and isinstance(records[0], BaseModel):
+        return b'{"d":' + ADAPTERS[type(records[0])].dump_json(records, exclude_unset=True) + b'}'
+    return json.dumps({"d": records}).encode()
+
+def record_dict(record) -> dict:
+    # A record as it was uploaded, for reports
+    if isinstance(record, BaseModel):
+        return record.model_dump(mode="json", exclude_unset=True)
+    return record
+
+class BaseCleverTap:
+    """Credentials and payload validation shared by the sync and async clients."""
+
+    def __init__(self, clevertap_account_id:str=None, clevertap_passcode:str=None, base_url:str=None,
+                 chunk_size:int=MAX_RECORDS_PER_UPLOAD, max_retries:int=3, backoff:float=0.5):
         self.account_id = os.environ.get("CLEVERTAP_ACCOUNT_ID") if clevertap_account_id == None else clevertap_account_id
         self.passcode = os.environ.get("CLEVERTAP_PASSCODE") if clevertap_passcode == None else clevertap_passcode
-        self.base_url = "https://sg1.api.clevertap.com/1"
+        # CLEVERTAP_BASE_URL selects another region, or a local stub server when testing
+        self.base_url = base_url or os.environ.get("CLEVERTAP_BASE_URL", DEFAULT_BASE_URL)
         self.headers = {
             "X-CleverTap-Account-Id": self.account_id,
-            "X-CleverTap-Passcode": self.passcode
+            "X-CleverTap-Passcode": self.passcode,
+            "Content-Type": "application/json; charset=utf-8"
         }
+        # Lists are uploaded in chunks of `chunk_size` records; a chunk that fails on the
+        # network, with 429 or 5xx is sent again up to `max_retries` times, waiting
+        # backoff, 2 * backoff, 4 * backoff ... seconds in between
+        self.chunk_size = min(chunk_size, MAX_RECORDS_PER_UPLOAD)
+        self.max_retries = max_retries
+        self.backoff = backoff
 
-    def upload_user_profile(self, profiles):
+    # Each validation returns (models, None), or (None, the error response) if the payload is invalid.
+    # The models are what gets uploaded, so every record is validated only once.
+    def _validate_profile(self, profile):
         try:
-            profile = CleverTapProfile(**profiles)
+            return [CleverTapProfile.model_validate(profile)], None
         except ValidationError as e:
-            return e.json()
-        headers = self.headers
-        headers['Content-Type'] = "application/json; charset=utf-8"
-        url = f"{self.base_url}/upload"
-        data = {
-            "d": [profiles]
-        }
-        respones = requests.post(url, headers=headers, data=json.dumps(data))
-        res_data = json.loads(respones.content)
-        return res_data
-    
-    def upload_user_profiles(self, profiles):
+            return None, e.json()
+
+    def _validate_profiles(self, profiles):
         try:
-            profile = TypeAdapter(List[CleverTapProfile]).validate_python(profiles)
+            return PROFILES_ADAPTER.validate_python(profiles), None
         except ValidationError as e:
-            return e.json()
-        headers = self.headers
-        headers['Content-Type'] = "application/json; charset=utf-8"
-        url = f"{self.base_url}/upload"
-        data = {
-            "d": profiles
-        }
-        respones = requests.post(url, headers=headers, data=json.dumps(data))
-        res_data = json.loads(respones.content)
-        return res_data
-    
-    def upload_event(self, event):
+            return None, e.json()
+
+    def _validate_event(self, event):
         try:
-            event = CleverTapEvent(**event)
+            return [CleverTapEvent.model_validate(event)], None
         except ValidationError as e:
-            return e.json()
-        headers = self.headers
-        headers['Content-Type'] = "application/json; charset=utf-8"
-        url = f"{self.base_url}/upload"
-        data = {
-            "d": [event]
-        }
-        respones = requests.post(url, headers=headers, data=json.dumps(data))
-        res_data = json.loads(respones.content)
-        return res_data
-    
-    def upload_events(self, event_pack):
+            return None, e.json()
+
+    def _validate_events(self, event_pack):
         try:
-            events = TypeAdapter(List[CleverTapEvent]).validate_python(event_pack)
+            return EVENTS_ADAPTER.validate_python(event_pack), None
         except ValidationError as e:
-            return {"status": "error", "message": "Invalid event payload", "details": e.errors()}
+            return None, {"status": "error", "message": "Invalid event payload", "details": e.errors()}
+
+    def _chunks(self, records) -> List[Tuple[int, list]]:
+        # (index of the first record, records) of every upload request
+        return [(start, records[start:start + self.chunk_size]) for start in range(0, len(records), self.chunk_size)]
+
+    def _retry_delay(self, attempt, retry_after=None):
+        # Exponential backoff, or what a 429 response asks for if that is longer
+        delay = self.backoff * 2 ** attempt
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        return delay
+
+    @staticmethod
+    def _parse_response(status_code, content):
+        try:
+            return json.loads(content)
+        except ValueError:
+            return {"status": "fail", "code": status_code, "error": content[:500].decode(errors="replace")}
+
+    @staticmethod
+    def _report(chunks, responses):
+        """
+        Merge the responses of all chunks into one response in CleverTap's
+        shape. Every record that was not processed is listed in "unprocessed"
+        with its index in the uploaded list, the error and the record itself.
+        """
+        processed = 0
+        unprocessed = []
+        for (start, records), response in zip(chunks, responses):
+            failures = response.get("unprocessed") or []
+            if response.get("status") == "fail" and not failures:
+                # The whole chunk was rejected (or every retry failed)
+                unprocessed.extend({"index": start + i, "code": response.get("code"), "error": response.get("error"),
+                                    "record": record_dict(record)} for i, record in enumerate(records))
+                continue
+            # CleverTap echoes the failed records, find them in the chunk to get their index
+            positions = {}
+            for i, record in enumerate(records if failures else []):
+                positions.setdefault(json.dumps(record_dict(record), sort_keys=True, default=str), []).append(start + i)
+            for failure in failures:
+                matches = positions.get(json.dumps(failure.get("record"), sort_keys=True, default=str))
+                unprocessed.append({"index": matches.pop(0) if matches else None, "code": failure.get("code"),
+                                    "error": failure.get("error"), "record": failure.get("record")})
+            processed += len(records) - len(failures)
+        total = sum(len(records) for _, records in chunks)
+        if not unprocessed:
+            status = "success"
+        elif processed:
+            status = "partial"
+        else:
+            status = "fail"
+        return {"status": status, "processed": processed, "unprocessed": unprocessed, "chunks": len(chunks),
+                "total": total}
 
-        headers = self.headers
-        headers['Content-Type'] = "application/json; charset=utf-8"
-        url = f"{self.base_url}/upload"
-        data = {
-            "d": event_pack
-        }
-        respones = requests.post(url, headers=headers, data=json.dumps(data))
-        res_data = json.loads(respones.content)
-        return res_data
-    
     def _to_unix(self, dt_str, tz_offset_hours=0):
         tz = timezone(timedelta(hours=tz_offset_hours))
         dt = datetime.strptime(dt_str, "%Y-%m-%d %H:%M:%S")
         dt = dt.replace(tzinfo=tz)
-        return int(dt.timestamp())
\ No newline at end of file
+        return int(dt.timestamp())
+
+class CleverTap(BaseCleverTap):
+    def __init__(self, clevertap_account_id:str=None, clevertap_passcode:str=None, base_url:str=None,
+                 pool_size:int=10, timeout:float=30.0, workers:int=4, **upload_options):
+        super().__init__(clevertap_account_id, clevertap_passcode, base_url, **upload_options)
+        self.timeout = timeout
+        # Chunks of one upload are sent by up to `workers` threads at once
+        self.workers = workers
+        # One session for every upload, so connections are kept alive and reused
+        # instead of opening a new TCP/TLS connection per request
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _upload_chunk(self, records):
+        # One upload request, retried on network errors and retryable status codes
+        body = encode_upload(records)
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                response = self.session.post(f"{self.base_url}/upload", data=body, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return self._parse_response(response.status_code, response.content)
+                failure = {"status": "fail", "code": response.status_code, "error": response.text[:500]}
+                retry_after = response.headers.get("Retry-After")
+            except requests.RequestException as e:
+                failure = {"status": "fail", "code": None, "error": str(e)}
+            if attempt < self.max_retries:
+                time.sleep(self._retry_delay(attempt, retry_after))
+        return failure
+
+    def _upload_records(self, records):
+        chunks = self._chunks(records)
+        if len(chunks) <= 1:
+            responses = [self._upload_chunk(chunk) for _, chunk in chunks]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(chunks))) as pool:
+                responses = list(pool.map(self._upload_chunk, [chunk for _, chunk in chunks]))
+        return self._report(chunks, responses)
+
+    def upload_user_profile(self, profiles, validate=True):
+        records = [profiles]
+        if validate:
+            records, error = self._validate_profile(profiles)
+            if error is not None:
+                return error
+        return self._upload_chunk(records)
+
+    def upload_user_profiles(self, profiles, validate=True):
+        if validate:
+            profiles, error = self._validate_profiles(profiles)
+            if error is not None:
+                return error
+        return self._upload_records(profiles)
+
+    def upload_event(self, event, validate=True):
+        records = [event]
+        if validate:
+            records, error = self._validate_event(event)
+            if error is not None:
+                return error
+        return self._upload_chunk(records)
+
+    def upload_events(self, event_pack, validate=True):
+        if validate:
+            event_pack, error = self._validate_events(event_pack)
+            if error is not None:
+                return error
+        return self._upload_records(event_pack)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class AsyncCleverTap(BaseCleverTap):
+    """
+    Async client with the same upload methods as CleverTap. All uploads share
+    one pooled httpx.AsyncClient and at most `max_concurrency` requests are in
+    flight at once; the others wait for a free slot instead of opening more sockets.
+    """
+
+    def __init__(self, clevertap_account_id:str=None, clevertap_passcode:str=None, base_url:str=None,
+                 max_concurrency:int=10, timeout:float=30.0, **upload_options):
+        super().__init__(clevertap_account_id, clevertap_passcode, base_url, **upload_options)
+        self.client = httpx.AsyncClient(
+            headers=self.headers,
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+        )
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _upload_chunk(self, records):
+        # Same retries as CleverTap._upload_chunk; the backoff sleep does not hold a slot
+        body = encode_upload(records)
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                async with self.semaphore:
+                    response = await self.client.post(f"{self.base_url}/upload", content=body)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return self._parse_response(response.status_code, response.content)
+                failure = {"status": "fail", "code": response.status_code, "error": response.text[:500]}
+                retry_after = response.headers.get("Retry-After")
+            except httpx.HTTPError as e:
+                failure = {"status": "fail", "code": None, "error": str(e)}
+            if attempt < self.max_retries:
+                await asyncio.sleep(self._retry_delay(attempt, retry_after))
+        return failure
+
+    async def _upload_records(self, records):
+        # Every chunk is started at once, the semaphore limits how many are in flight
+        chunks = self._chunks(records)
+        responses = await asyncio.gather(*(self._upload_chunk(chunk) for _, chunk in chunks))
+        return self._report(chunks, responses)
+
+    async def upload_user_profile(self, profiles, validate=True):
+        records = [profiles]
+        if validate:
+            records, error = self._validate_profile(profiles)
+            if error is not None:
+                return error
+        return await self._upload_chunk(records)
+
+    async def upload_user_profiles(self, profiles, validate=True):
+        if validate:
+            profiles, error = self._validate_profiles(profiles)
+            if error is not None:
+                return error
+        return await self._upload_records(profiles)
+
+    async def upload_event(self, event, validate=True):
+        records = [event]
+        if validate:
+            records, error = self._validate_event(event)
+            if error is not None:
+                return error
+        return await self._upload_chunk(records)
+
+    async def upload_events(self, event_pack, validate=True):
+        if validate:
+            event_pack, error = self._validate_events(event_pack)
+            if error is not None:
+                return error
+        return await self._upload_records(event_pack)
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
@@ -0,0 +1,171 @@
+import asyncio
+import atexit
+import logging
+import queue
+import threading
+import time
+from typing import Callable, Optional
+
+from .clevertap import CleverTap, MAX_RECORDS_PER_UPLOAD, record_dict
+
+logger = logging.getLogger(__name__)
+
+# Put in the queue by close(): the worker uploads everything queued before it and stops
+_STOP = object()
+
+class _Flush:
+    # Put in the queue by flush(): the worker uploads its batch and sets `done`
+    def __init__(self):
+        self.done = threading.Event()
+
+class EventProducer:
+    """
+    Buffered event producer on top of CleverTap. `send` only validates and
+    enqueues the event; a background thread collects queued events into
+    batches of up to `batch_size` and uploads a batch once it is full or its
+    oldest event waited `max_latency` seconds. Batches larger than one upload
+    request are split into chunks and sent in parallel by the client.
+
+    The queue holds at most `max_queue` events. When it is full, `send`
+    blocks until the worker catches up (or returns False when `block=False`
+    or the timeout expires), so a burst cannot grow memory without bound.
+    Queued events are uploaded on `close()`, which also runs at interpreter exit.
+    """
+
+    def __init__(self, client: CleverTap = None, batch_size: int = MAX_RECORDS_PER_UPLOAD,
+                 max_latency: float = 1.0, max_queue: int = 10000, block: bool = True,
+                 on_result: Optional[Callable[[dict], None]] = None, validate: bool = True):
+        self.client = client or CleverTap()
+        # Trusted internal producers can skip validation, their dicts are uploaded as they are
+        self.validate = validate
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.block = block
+        # Called with the upload report of every batch, e.g. to store failed events
+        self.on_result = on_result
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.stats = {"queued": 0, "dropped": 0, "batches": 0, "sent": 0, "failed": 0}
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name="clevertap-producer", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def send(self, event, timeout: float = None) -> bool:
+        """Queue one event. Returns False if the queue stayed full (the event is dropped)."""
+        event = self._prepare(event)
+        try:
+            self.queue.put(event, block=self.block, timeout=timeout)
+        except queue.Full:
+            self._count("dropped")
+            return False
+        self._count("queued")
+        return True
+
+    async def send_async(self, event) -> bool:
+        # For coroutines: never blocks the event loop, waits in a thread only while the queue is full
+        event = self._prepare(event)
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            if not self.block:
+                self._count("dropped")
+                return False
+            await asyncio.to_thread(self.queue.put, event)
+        self._count("queued")
+        return True
+
+    def _prepare(self, event):
+        if self.closed:
+            raise RuntimeError("EventProducer is closed")
+        if not self.validate:
+            return event
+        # Invalid events are rejected here, so a batch never fails validation as a whole;
+        # the validated model is queued and serialized without checking it again
+        models, error = self.client._validate_event(event)
+        if error is not None:
+            raise ValueError(error)
+        return models[0]
+
+    def _count(self, name: str, amount: int = 1):
+        with self.lock:
+            self.stats[name] += amount
+
+    @property
+    def depth(self) -> int:
+        # Events waiting to be uploaded
+        return self.queue.qsize()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            if isinstance(item, _Flush):
+                item.done.set()
+                continue
+            batch = [item]
+            # The batch closes when it is full, its deadline passed, or on flush/stop
+            deadline = time.monotonic() + self.max_latency
+            marker = None
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP or isinstance(item, _Flush):
+                    marker = item
+                    break
+                batch.append(item)
+            self._upload(batch)
+            if marker is _STOP:
+                return
+            if marker is not None:
+                marker.done.set()
+
+    def _upload(self, batch):
+        # Events were validated by send() already
+        try:
+            report = self.client._upload_records(batch)
+        except Exception as e:
+            logger.exception("CleverTap upload of %d events failed", len(batch))
+            report = {"status": "fail", "processed": 0, "total": len(batch),
+                      "unprocessed": [{"index": i, "code": None, "error": str(e), "record": record_dict(event)}
+                                      for i, event in enumerate(batch)]}
+        with self.lock:
+            self.stats["batches"] += 1
+            self.stats["sent"] += report["processed"]
+            self.stats["failed"] += len(report["unprocessed"])
+        if report["unprocessed"]:
+            logger.warning("CleverTap rejected %d of %d events", len(report["unprocessed"]), len(batch))
+        if self.on_result is not None:
+            try:
+                self.on_result(report)
+            except Exception:
+                logger.exception("EventProducer on_result callback failed")
+
+    def flush(self, timeout: float = None) -> bool:
+        """Upload everything queued so far and wait for it. Returns False on timeout."""
+        if self.closed:
+            return True
+        marker = _Flush()
+        self.queue.put(marker)
+        return marker.done.wait(timeout)
+
+    def close(self, timeout: float = None):
+        """Upload the queued events and stop the worker; later sends raise RuntimeError."""
+        if self.closed:
+            return
+        self.closed = True
+        atexit.unregister(self.close)
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
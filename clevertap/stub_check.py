@@ -0,0 +1,147 @@
+"""
+Checks the CleverTap clients against a local stand-in of the upload API.
+
+A stub server (http.server, on a free local port) answers POST /1/upload like
+CleverTap does and records which connection every request came on and how
+many requests were being handled at once. Then:
+  sync_reuse         CleverTap sends --uploads single events one after another,
+                     all of them must arrive on one connection
+  sync_chunks        CleverTap uploads a long list in chunks with `workers` threads,
+                     no more connections than `workers` may be opened
+  async_concurrency  AsyncCleverTap uploads a long list and single events all at once,
+                     no more than --max-concurrency requests may be in flight
+
+Exits with status 1 if a check fails.
+
+Usage: python clevertap/stub_check.py [--uploads 20] [--max-concurrency 3]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Run from the repository root or from this folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from clevertap.clevertap import AsyncCleverTap, CleverTap
+
+
+class StubServer:
+    """CleverTap's upload endpoint, counting connections and requests in flight."""
+
+    def __init__(self, delay: float = 0.0):
+        # Every request is held this long, so concurrent requests overlap
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.reset()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep-alive, as CleverTap's servers do
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with stub.lock:
+                    stub.connections.add(self.client_address)
+                    stub.requests += 1
+                    stub.active += 1
+                    stub.peak = max(stub.peak, stub.active)
+                time.sleep(stub.delay)
+                with stub.lock:
+                    stub.active -= 1
+                data = json.dumps({"status": "success", "processed": len(body["d"]), "unprocessed": []}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/1"
+
+    def reset(self):
+        with self.lock:
+            self.connections = set()
+            self.requests = 0
+            self.active = 0
+            self.peak = 0
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def make_event(i: int) -> dict:
+    return {"identity": f"user_{i}", "ts": 1735689600 + i, "evtName": "Stub Check", "evtData": {"i": i}}
+
+
+def check(name: str, ok: bool, detail: str) -> bool:
+    print(f"{'OK' if ok else 'FAIL':>4} {name:<18} {detail}")
+    return ok
+
+
+def sync_reuse(stub: StubServer, uploads: int) -> bool:
+    stub.reset()
+    with CleverTap("account", "passcode", base_url=stub.base_url) as client:
+        for i in range(uploads):
+            response = client.upload_event(make_event(i))
+            assert response["status"] == "success", response
+    return check("sync_reuse", stub.requests == uploads and len(stub.connections) == 1,
+                 f"{stub.requests} requests on {len(stub.connections)} connection(s), expected 1")
+
+
+def sync_chunks(stub: StubServer, workers: int) -> bool:
+    stub.reset()
+    events = [make_event(i) for i in range(workers * 4 * 10)]
+    with CleverTap("account", "passcode", base_url=stub.base_url, workers=workers, chunk_size=10) as client:
+        response = client.upload_events(events)
+        assert response["status"] == "success" and response["processed"] == len(events), response
+    return check("sync_chunks", len(stub.connections) <= workers,
+                 f"{stub.requests} requests on {len(stub.connections)} connection(s), at most {workers} allowed")
+
+
+async def async_concurrency(stub: StubServer, uploads: int, max_concurrency: int) -> bool:
+    stub.reset()
+    events = [make_event(i) for i in range(uploads * 10)]
+    async with AsyncCleverTap("account", "passcode", base_url=stub.base_url,
+                              max_concurrency=max_concurrency, chunk_size=10) as client:
+        responses = await asyncio.gather(client.upload_events(events),
+                                         *(client.upload_event(make_event(i)) for i in range(uploads)))
+    assert all(response["status"] == "success" for response in responses), responses
+    return check("async_concurrency", stub.peak <= max_concurrency and len(stub.connections) <= max_concurrency,
+                 f"{stub.requests} requests, {stub.peak} at once on {len(stub.connections)} connection(s), "
+                 f"at most {max_concurrency} allowed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=20)
+    parser.add_argument("--max-concurrency", type=int, default=3)
+    parser.add_argument("--delay", type=float, default=0.02, help="Seconds the stub holds every request")
+    args = parser.parse_args()
+
+    stub = StubServer(delay=args.delay)
+    try:
+        results = [
+            sync_reuse(stub, args.uploads),
+            sync_chunks(stub, args.max_concurrency),
+            asyncio.run(async_concurrency(stub, args.uploads, args.max_concurrency)),
+        ]
+    finally:
+        stub.close()
+    sys.exit(0 if all(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
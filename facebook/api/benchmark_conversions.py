@@ -0,0 +1,107 @@
+"""
+Per-event cost of hashing Conversions API customer information.
+
+Compares, for --events events whose em/ph/fn/ln come from --customers customers:
+  per_row        every value of every event normalized and hashed on its own,
+                 with a character-by-character check for hashed values (the old validator)
+  column_cached  hash_user_data: a column at a time, distinct values once, LRU cached
+  sdk_events     per_row plus an SDK Event per event, normalized to JSON (the old request path)
+  prepare        build_events: column_cached plus building the JSON of every event
+
+Usage: python benchmark_conversions.py [--events 100000] [--customers 5000]
+"""
+import argparse
+import hashlib
+import os
+import re
+import sys
+import json
+import time
+
+# The repository root holds the observability package shared by all apps
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from facebook_business.adobjects.serverside.action_source import ActionSource
+from facebook_business.adobjects.serverside.custom_data import CustomData
+from facebook_business.adobjects.serverside.event import Event
+from facebook_business.adobjects.serverside.user_data import UserData
+
+from services.conversions import HASHED_FIELDS, build_events, hash_identifier, hash_user_data
+
+
+def make_events(count: int, customers: int):
+    return [
+        {
+            "event_name": "Purchase",
+            "event_time": 1735689600 + i,
+            "action_source": "physical_store",
+            "user_data": {"em": [f"Customer{i % customers}@Example.com"], "ph": [f"+66 81-{i % customers:07d}"],
+                          "fn": [f"First{i % customers}"], "ln": [f"Last{i % customers}"]},
+            "custom_data": {"currency": "THB", "value": float(i % 1000)},
+        }
+        for i in range(count)
+    ]
+
+
+def per_row(events):
+    hashed = []
+    for event in events:
+        row = {}
+        for field in HASHED_FIELDS:
+            values = []
+            for item in event["user_data"].get(field) or []:
+                item = item.strip().lower()
+                if field == "ph":
+                    item = re.sub(r"\D", "", item)
+                if len(item) == 64 and all(c in "0123456789abcdef" for c in item):
+                    values.append(item)
+                else:
+                    values.append(hashlib.sha256(item.encode()).hexdigest())
+            row[field] = values
+        hashed.append(row)
+    return hashed
+
+
+def sdk_events(events):
+    payloads = []
+    for event, hashed in zip(events, per_row(events)):
+        payloads.append(json.dumps(Event(
+            event_name=event["event_name"],
+            event_time=event["event_time"],
+            action_source=ActionSource(event["action_source"]),
+            user_data=UserData(emails=hashed["em"], phones=hashed["ph"], first_names=hashed["fn"], last_names=hashed["ln"]),
+            custom_data=CustomData(**event["custom_data"]),
+        ).normalize()))
+    return payloads
+
+
+def column_cached(events):
+    return hash_user_data(events)
+
+
+def prepare(events):
+    return build_events(events)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=100_000)
+    parser.add_argument("--customers", type=int, default=5000, help="Distinct customers among the events")
+    parser.add_argument("--repeat", type=int, default=3, help="Best of this many runs")
+    args = parser.parse_args()
+
+    events = make_events(args.events, args.customers)
+    print(f"{args.events} events from {args.customers} customers")
+    print(f"{'path':>14} {'total ms':>10} {'us/event':>10}")
+    for path in (per_row, column_cached, sdk_events, prepare):
+        best = float("inf")
+        for _ in range(args.repeat):
+            hash_identifier.cache_clear()
+            start = time.perf_counter()
+            path(events)
+            best = min(best, time.perf_counter() - start)
+        print(f"{path.__name__:>14} {best * 1000:>10.1f} {best / args.events * 1e6:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
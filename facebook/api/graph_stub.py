@@ -0,0 +1,113 @@
+"""
+A local stand-in of the Graph API's lead form endpoint, for checking the
+lead backfill and sync without a token or network access.
+
+GraphStub serves GET /<version>/<form_id>/leads from a list of leads, with
+the `time_created` GREATER_THAN / LESS_THAN filtering, `limit` and cursor
+paging of the real endpoint. Every `throttle_every`-th request is answered
+like a throttled call (error code 17 with X-Business-Use-Case-Usage at 100%),
+and every response carries the usage headers the RateLimiter reads.
+
+Point the client at it with FB_GRAPH_URL (read by get_facebook_api):
+
+    stub = GraphStub(make_leads(1000), throttle_every=7)
+    os.environ["FB_GRAPH_URL"] = stub.url
+"""
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+from urllib.parse import parse_qs, urlparse
+
+# Error code and message Meta returns for "User request limit reached"
+THROTTLE_ERROR = {"message": "User request limit reached", "type": "OAuthException", "code": 17}
+
+
+def make_leads(count: int, start: int, step: int = 60) -> List[dict]:
+    """`count` leads created `step` seconds apart from `start` (Unix seconds), as (id, created_time) dicts."""
+    return [{"id": f"lead_{i}", "created_time": start + i * step} for i in range(count)]
+
+
+class GraphStub:
+    """Serves the leads of any form id; counts requests, throttled ones and requests in flight."""
+
+    def __init__(self, leads: List[dict], throttle_every: Optional[int] = None, delay: float = 0.0):
+        self.leads = sorted(leads, key=lambda lead: lead["created_time"])
+        self.throttle_every = throttle_every
+        # Every request is held this long, so the backfill's windows overlap
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.active = 0
+        self.peak = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def send(self, code: int, body: dict, usage: int):
+                data = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("X-Business-Use-Case-Usage", json.dumps(
+                    {"1": [{"type": "LEAD_RETRIEVAL", "call_count": usage, "total_cputime": 1, "total_time": 1,
+                            "estimated_time_to_regain_access": 0}]}))
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                with stub.lock:
+                    stub.requests += 1
+                    number = stub.requests
+                    stub.active += 1
+                    stub.peak = max(stub.peak, stub.active)
+                try:
+                    time.sleep(stub.delay)
+                    if stub.throttle_every and number % stub.throttle_every == 0:
+                        with stub.lock:
+                            stub.throttled += 1
+                        return self.send(400, {"error": THROTTLE_ERROR}, 100)
+                    return self.send(200, stub.page(parse_qs(urlparse(self.path).query)), 10)
+                finally:
+                    with stub.lock:
+                        stub.active -= 1
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def page(self, query: dict) -> dict:
+        # One page of the leads matching the filters; the cursors are offsets into them
+        query = {key: values[0] for key, values in query.items()}
+        leads = self.leads
+        for condition in json.loads(query.get("filtering", "[]")):
+            value = int(condition["value"])
+            if condition["operator"] == "GREATER_THAN":
+                leads = [lead for lead in leads if lead["created_time"] > value]
+            elif condition["operator"] == "LESS_THAN":
+                leads = [lead for lead in leads if lead["created_time"] < value]
+        start = int(query.get("after") or 0)
+        limit = int(query.get("limit", 25))
+        data = [
+            {"id": lead["id"], "form_id": "stub_form", "ad_id": "stub_ad",
+             "created_time": datetime.fromtimestamp(lead["created_time"], timezone.utc).strftime("%Y-%m-%dT%H:%M:%S%z"),
+             "field_data": [{"name": "email", "values": [f"{lead['id']}@example.com"]}]}
+            for lead in leads[start:start + limit]
+        ]
+        paging = {"cursors": {"before": str(start), "after": str(start + len(data))}}
+        if start + limit < len(leads):
+            paging["next"] = f"{self.url}/next"
+        return {"data": data, "paging": paging}
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
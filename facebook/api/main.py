@@ -1,7 +1,13 @@
 from fastapi import FastAPI
 from dotenv import load_dotenv
 import os
+import sys
 import logging
+
+# The repository root holds the observability package shared by all apps
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
+from observability import instrument
 from routers.facebook import router as facebook_router
 from routers.google_sheet import router as google_sheet_router
 
@@ -22,6 +28,9 @@ app = FastAPI(
 app.include_router(facebook_router, prefix="/facebook", tags=["Facebook"])
 app.include_router(google_sheet_router, prefix="/google_sheet", tags=["Google Sheet"])
 
+# Latency, in-flight and payload size metrics at /metrics, plus the slow request log
+instrument(app)
+
 @app.get("/", tags=["System"])
 async def root():
     """
@@ -1,28 +1,29 @@
 from pygments.token import Literal
 from fastapi import Query
 from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, Field, field_validator, ConfigDict
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, Field, field_validator, ConfigDict, ValidationInfo
 import os
 from dotenv import load_dotenv
-from typing import Optional, List, Literal
+from typing import Optional, List, Literal, Iterator, Tuple
 from enum import Enum
 import logging
 import time
-import re
-import hashlib
 import json
+import base64
+import queue
+import threading
 from datetime import datetime, timedelta, timezone
 from facebook_business.api import FacebookAdsApi
 from facebook_business.adobjects.leadgenform import LeadgenForm
 from facebook_business.adobjects.lead import Lead
 from facebook_business.adobjects.adspixel import AdsPixel
-
-from facebook_business.adobjects.serverside.action_source import ActionSource
-from facebook_business.adobjects.serverside.custom_data import CustomData
-from facebook_business.adobjects.serverside.event import Event
-from facebook_business.adobjects.serverside.event_request import EventRequest
-from facebook_business.adobjects.serverside.user_data import UserData
+from observability import annotate
+from services.leads import (get_facebook_api, to_timestamp, lead_params, clean_lead, lead_pages,
+                            backfill_leads)
+from services.conversions import MAX_EVENTS_PER_REQUEST, hash_column, send_events
+from services.conversions_queue import QueueFull, get_conversions_queue
+from services.lead_sync import GoogleSheetSink, SyncInProgress, sync_leads
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -74,19 +75,11 @@ class UserDataModel(BaseModel):
 
     @field_validator("em", "ph", "fn", "ln", mode="before")
     @classmethod
-    def hash_sensitive_data(cls, v):
+    def hash_sensitive_data(cls, v, info: ValidationInfo):
         if v is None:
             return v
-        
-        hashed_list = []
-        for item in v:
-            item = item.strip().lower()
-            # Only hash if it's not already a 64-char hex string (already hashed)
-            if len(item) == 64 and all(c in "0123456789abcdef" for c in item):
-                hashed_list.append(item)
-            else:
-                hashed_list.append(hashlib.sha256(item.encode()).hexdigest())
-        return hashed_list
+        # Already hashed values are kept; the hashes are cached, see services/conversions.py
+        return [h for h in hash_column(info.field_name, v) if h is not None]
 
 class CustomData(BaseModel):
     value: Optional[float] = None
@@ -112,106 +105,225 @@ class FacebookCAPIPayload(BaseModel):
 router = APIRouter()
 
 #def zone
-def hash_data(value):
-    if pd.isna(value) or value == "":
-        return None
-    return hashlib.sha256(str(value).strip().lower().encode('utf-8')).hexdigest()
-
-def prepare_fb_payload(row: ServerEvent):
-    # Normalize and hash phone
-    # Remove all symbols and non-numeric characters using regex
-    clean_phone = re.sub(r'\D', '', str(row.user_data.ph))
-    # hashed_phone = hash_data(clean_phone)
-    
-    payload = Event(
-        event_name=row.event_name,
-        event_time=int(row.event_time),
-        user_data=UserData(
-            phones=[clean_phone],
-            lead_id=[row.user_data.lead_id]
-        ),
-        custom_data=CustomData(
-            currency=row.custom_data.currency,
-            value=float(row.custom_data.value)
-        ),
-        action_source=row.action_source
-    )
-    return payload
-
-#set up env
-access_token = os.environ.get("FB_TOKEN")
+def require_facebook_api():
+    try:
+        return get_facebook_api()
+    except RuntimeError:
+        logger.error("Facebook API not initialized.")
+        raise HTTPException(status_code=500, detail="Facebook API not initialized")
+
+def encode_lead_cursor(form_id: str, start_time: Optional[int], end_time: Optional[int], after: str) -> str:
+    # The Graph API cursor plus the query it belongs to, so it cannot be used for another form or window
+    payload = json.dumps({"form_id": form_id, "start_time": start_time, "end_time": end_time, "after": after})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_lead_cursor(token: str, form_id: str, start_time: Optional[int], end_time: Optional[int]) -> str:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        after = payload["after"]
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if (payload.get("form_id"), payload.get("start_time"), payload.get("end_time")) != (form_id, start_time, end_time):
+        raise HTTPException(status_code=400, detail="Cursor does not match the requested form and time window")
+    return after
+
+def stream_leads(form_id: str, start_time: Optional[int], end_time: Optional[int], params: dict) -> Iterator[bytes]:
+    """
+    NDJSON: one line per lead, written as soon as its Graph API page arrives.
+    After every page comes a {"cursor": ...} line; pass the last one received
+    as ?cursor= to continue after it. The final cursor line is {"cursor": null}.
+    """
+    try:
+        for page, after in lead_pages(form_id, params):
+            lines = [json.dumps(clean_lead(lead)) for lead in page]
+            token = encode_lead_cursor(form_id, start_time, end_time, after) if after else None
+            lines.append(json.dumps({"cursor": token}))
+            yield ("\n".join(lines) + "\n").encode()
+    except Exception as e:
+        # The status was already sent, report the error in the stream instead
+        logger.error(f"Error streaming leads: {e}")
+        yield (json.dumps({"error": "Error getting leads"}) + "\n").encode()
 
 @router.get("/leadgen/{form_id}")
 def leadgen(
     form_id: str,
     start_time: Optional[str] = Query(None, description="The start time of the lead gen, example: 2025-01-01 00:00:00"),
     end_time: Optional[str] = Query(None, description="The end time of the lead gen, example: 2025-01-01 23:59:59"),
-    limit: Optional[int] = Query(100, description="The number of leads to return"),
+    limit: Optional[int] = Query(100, description="The number of leads per Graph API page"),
+    stream: bool = Query(False, description="Stream the leads as NDJSON while the pages arrive, with resumable cursor lines"),
+    cursor: Optional[str] = Query(None, description="Cursor line from an earlier stream, continues after it"),
 ):
     logger.info("Leadgen endpoint called")
+    annotate(form_id=form_id, start_time=start_time, end_time=end_time, limit=limit, stream=stream)
 
-    fields = ['created_time', 'field_data', 'ad_id', 'form_id']
     #transform start_time and end_time to timestamp
-    start_time = int(time.mktime(time.strptime(start_time, "%Y-%m-%d %H:%M:%S")))
-    end_time = int(time.mktime(time.strptime(end_time, "%Y-%m-%d %H:%M:%S")))
-    params = {
-        'limit': limit,
-        'filtering': [
-            {'field': 'time_created', 'operator': 'GREATER_THAN', 'value': start_time},
-            {'field': 'time_created', 'operator': 'LESS_THAN', 'value': end_time}
-        ]
-    }
-    if access_token:
-        FacebookAdsApi.init(access_token=access_token)
-        logger.info("Facebook API Initialized.")
-    else:
-        logger.error("Facebook API not initialized.")
-        raise HTTPException(status_code=500, detail="Facebook API not initialized")
+    start_time = to_timestamp(start_time) if start_time else None
+    end_time = to_timestamp(end_time) if end_time else None
+    after = decode_lead_cursor(cursor, form_id, start_time, end_time) if cursor else None
+    params = lead_params(start_time, end_time, limit, after)
+    require_facebook_api()
+
+    if stream:
+        return StreamingResponse(stream_leads(form_id, start_time, end_time, params),
+                                 media_type="application/x-ndjson")
     try:
-        leadgen_form = LeadgenForm(form_id)
-        leads = leadgen_form.get_leads(fields=fields, params=params)
         all_cleaned_leads = []
-        for lead in leads:
-            dt_utc = datetime.strptime(lead['created_time'], "%Y-%m-%dT%H:%M:%S%z")
-            bangkok_time = dt_utc.astimezone(timezone(timedelta(hours=7))).strftime("%Y-%m-%d %H:%M:%S")
-            cleaned_lead = {
-                'created_time': bangkok_time,
-                'ad_id': lead.get('ad_id', None),
-                'form_id': lead.get('form_id', None),
-                'field_data': lead.get('field_data', None)
-            }
-            all_cleaned_leads.append(cleaned_lead)
-            
+        for page, _ in lead_pages(form_id, params):
+            all_cleaned_leads.extend(clean_lead(lead) for lead in page)
         return JSONResponse(content=all_cleaned_leads)
     except Exception as e:
         logger.error(f"Error getting leads: {e}")
         raise HTTPException(status_code=500, detail="Error getting leads")
 
 
+@router.get("/leadgen/{form_id}/backfill")
+def leadgen_backfill(
+    form_id: str,
+    start_time: str = Query(..., description="The start time of the backfill, example: 2025-01-01 00:00:00"),
+    end_time: str = Query(..., description="The end time of the backfill, example: 2025-06-30 23:59:59"),
+    window_hours: float = Query(24, gt=0, description="Length of the time windows fetched in parallel"),
+    workers: int = Query(4, ge=1, le=16, description="Windows fetched at the same time"),
+    limit: int = Query(100, description="The number of leads per Graph API page"),
+):
+    """
+    NDJSON of every lead (with its id) created in the range, fetched in
+    parallel time windows. Leads arrive in no particular order, each once;
+    the last line is {"stats": ...}, or {"error": ...} if the backfill failed.
+    """
+    annotate(form_id=form_id, start_time=start_time, end_time=end_time, window_hours=window_hours, workers=workers)
+    start, end = to_timestamp(start_time), to_timestamp(end_time)
+    require_facebook_api()
+
+    # Bounded, so the workers wait for a slow client instead of buffering everything
+    pages = queue.Queue(maxsize=64)
+    cancelled = threading.Event()
+
+    def offer(item):
+        while not cancelled.is_set():
+            try:
+                pages.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+        raise RuntimeError("Client disconnected")
+
+    def run():
+        try:
+            stats = backfill_leads(form_id, start, end, offer, window=int(window_hours * 3600),
+                                   workers=workers, limit=limit)
+            offer({"stats": stats})
+        except Exception as e:
+            logger.error(f"Error backfilling leads: {e}")
+            if not cancelled.is_set():
+                offer({"error": "Error getting leads"})
+        finally:
+            if not cancelled.is_set():
+                offer(None)
+
+    def stream():
+        threading.Thread(target=run, name=f"leadgen-backfill-{form_id}", daemon=True).start()
+        try:
+            while (item := pages.get()) is not None:
+                if isinstance(item, list):
+                    yield "".join(json.dumps(lead) + "\n" for lead in item).encode()
+                else:
+                    yield (json.dumps(item) + "\n").encode()
+        finally:
+            # Stops the backfill when the client goes away
+            cancelled.set()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@router.post("/leadgen/{form_id}/sync")
+def leadgen_sync(
+    form_id: str,
+    google_sheet_id: str = Query(..., description="The Google Sheet the new leads are appended to"),
+    work_sheet_id: str = Query(..., description="The worksheet id in that Google Sheet"),
+    start_time: Optional[str] = Query(None, description="Where the first sync of this form starts, example: 2025-01-01 00:00:00"),
+    limit: int = Query(100, description="The number of leads per Graph API page"),
+):
+    """
+    Append the leads created since the last sync of this form to the worksheet,
+    one row per lead with the lead id in the first column. Each lead is
+    appended once, also when a sync fails halfway and is run again.
+    """
+    annotate(form_id=form_id, google_sheet_id=google_sheet_id, start_time=start_time)
+    start = to_timestamp(start_time) if start_time else None
+    require_facebook_api()
+    try:
+        sink = GoogleSheetSink(google_sheet_id, work_sheet_id)
+    except Exception as e:
+        logger.error(f"Error opening worksheet: {e}")
+        raise HTTPException(status_code=500, detail="Error opening worksheet")
+    try:
+        result = sync_leads(form_id, sink, start_time=start, limit=limit)
+    except SyncInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        # Batches appended so far are recorded, the next sync continues after them
+        logger.error(f"Error syncing leads: {e}")
+        raise HTTPException(status_code=500, detail="Error syncing leads")
+    annotate(delivered=result["delivered"])
+    return JSONResponse(content=result)
+
 @router.get("/conversion_api/{pixel_id}/events")
 def conversion_api(
     pixel_id: str,
     events: List[ServerEvent],
-    test_event_code: str = None
+    test_event_code: str = None,
+    batch_size: int = Query(MAX_EVENTS_PER_REQUEST, ge=1, le=MAX_EVENTS_PER_REQUEST, description="Events per Conversions API request"),
+    workers: int = Query(4, ge=1, le=16, description="Requests sent at the same time"),
 ):
-    FB_ACCESS_TOKEN = os.getenv('FB_TOKEN')
-    if FB_ACCESS_TOKEN:
-        FacebookAdsApi.init(access_token=FB_ACCESS_TOKEN)
-        logger.info("Facebook API Initialized.")
-    else:
-        logger.error("Facebook API not initialized.")
-        raise HTTPException(status_code=500, detail="Facebook API not initialized")
+    """
+    Send the events in requests of up to `batch_size` events, several at once.
+    The response has a result per event (sent, failed or invalid, by index).
+    """
+    require_facebook_api()
+    annotate(pixel_id=pixel_id, events=len(events))
     try:
-        events_formated = [prepare_fb_payload(row) for row in events]
-        event_request = EventRequest(
-            events=events_formated,
-            pixel_id=pixel_id,
-            test_event_code = test_event_code
-        )
-        event_response = event_request.execute()
-        logger.info(event_response)
-        logger.info("Events created successfully!")
-        return JSONResponse(content={"message": "Events created successfully!"})
+        report = send_events(pixel_id, [event.model_dump(exclude_none=True) for event in events],
+                             test_event_code=test_event_code, batch_size=batch_size, workers=workers)
     except Exception as e:
         logger.error(f"Error creating events: {e}")
-        raise HTTPException(status_code=500, detail="Error creating events")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Error creating events")
+    annotate(sent=report["sent"], requests=report["requests"])
+    if report["status"] == "fail" and events:
+        logger.error("No events were sent")
+        return JSONResponse(status_code=500, content={"message": "Error creating events", **report})
+    logger.info(f"Sent {report['sent']} of {report['total']} events")
+    return JSONResponse(content={"message": "Events created successfully!", **report})
+
+@router.post("/conversion_api/{pixel_id}/events", status_code=202)
+def conversion_api_enqueue(
+    pixel_id: str,
+    events: List[ServerEvent],
+    test_event_code: str = None
+):
+    """
+    Accept the events and return right away; they are sent in the background
+    in batches per pixel, with retries. Events that keep failing go to the
+    dead-letter file, see /conversion_api/dead_letters/replay.
+    """
+    require_facebook_api()
+    annotate(pixel_id=pixel_id, events=len(events))
+    try:
+        depth = get_conversions_queue().enqueue(pixel_id, [event.model_dump(exclude_none=True) for event in events],
+                                                test_event_code)
+    except QueueFull as e:
+        logger.warning(f"Conversions API queue is full: {e}")
+        raise HTTPException(status_code=503, detail="Conversions API queue is full", headers={"Retry-After": "5"})
+    return JSONResponse(status_code=202, content={"message": "Events accepted", "accepted": len(events),
+                                                  "queue_depth": depth})
+
+@router.get("/conversion_api/queue")
+def conversion_api_queue():
+    """Counters of the background Conversions API queue; latency histograms are at /metrics."""
+    return JSONResponse(content=get_conversions_queue().stats())
+
+@router.post("/conversion_api/dead_letters/replay")
+def conversion_api_replay(
+    pixel_id: Optional[str] = Query(None, description="Only replay the events of this pixel"),
+):
+    require_facebook_api()
+    replayed = get_conversions_queue().replay_dead_letters(pixel_id)
+    return JSONResponse(content={"replayed": replayed})
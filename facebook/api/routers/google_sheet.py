@@ -9,8 +9,8 @@ import logging
 import time
 import json
 from datetime import datetime, timedelta, timezone
-import gspread
-from google.oauth2.service_account import Credentials
+from observability import annotate
+from services.google_sheet import get_gspread_client, open_worksheet, append_rows
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -19,30 +19,6 @@ load_dotenv()
 
 router = APIRouter()
 
-def get_gspread_client() -> gspread.Client:
-    # Define the scope
-    scope = [
-        'https://www.googleapis.com/auth/spreadsheets',
-        'https://www.googleapis.com/auth/drive'
-    ]
-    
-    # Get credentials from environment variable
-    creds_json = os.getenv('GOOGLE_SHEETS_CREDENTIALS')
-    
-    if not creds_json:
-        raise ValueError("GOOGLE_SHEETS_CREDENTIALS environment variable NOT found.")
-    
-    # If the env var is a path to a file, load it directly
-    if os.path.isfile(creds_json):
-        creds = Credentials.from_service_account_file(creds_json, scopes=scope)
-    else:
-        # Otherwise, assume it's the JSON content itself
-        info = json.loads(creds_json)
-        creds = Credentials.from_service_account_info(info, scopes=scope)
-        
-    client = gspread.authorize(creds)
-    return client
-
 @router.post("/{google_sheet_id}/{work_sheet_id}")
 def append_data(
     google_sheet_id: str,
@@ -58,9 +34,9 @@ def append_data(
             raise HTTPException(status_code=500, detail=str(e))
         
         try:
-            spreadsheet = gc.open_by_key(google_sheet_id)
-            worksheet = spreadsheet.get_worksheet_by_id(work_sheet_id)
-            worksheet.append_rows(values=data)
+            annotate(google_sheet_id=google_sheet_id, rows=len(data))
+            worksheet = open_worksheet(gc, google_sheet_id, work_sheet_id)
+            append_rows(worksheet, data)
             logger.info("Data appended successfully!")
             return JSONResponse(content={"message": "Data appended successfully!"})
         except Exception as e:
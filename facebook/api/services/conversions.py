@@ -0,0 +1,197 @@
+"""
+Sending Conversions API events in batches.
+
+Customer information (em, ph, fn, ln) is normalized and SHA-256 hashed one
+column at a time across all events, each distinct value once; an LRU cache
+keeps the hashes of identifiers seen before (the same customers come back in
+every upload). The events are split into EventRequests of up to
+MAX_EVENTS_PER_REQUEST, sent several at once, and every event gets a result.
+
+Events are dicts shaped like the router's ServerEvent
+(`event.model_dump(exclude_none=True)`):
+
+    {"event_name": "Purchase", "event_time": 1735689600, "action_source": "physical_store",
+     "user_data": {"em": ["john@example.com"], "ph": ["+66 81 234 5678"]},
+     "custom_data": {"currency": "THB", "value": 1290.0}}
+"""
+import re
+import json
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from facebook_business.adobjects.serverside.action_source import ActionSource
+from facebook_business.adobjects.serverside.event_request import EventRequest
+from facebook_business.exceptions import FacebookRequestError
+
+from services.leads import get_facebook_api, retryable
+from observability import upstream_call
+
+logger = logging.getLogger(__name__)
+
+# Meta accepts at most 1000 events per request
+MAX_EVENTS_PER_REQUEST = 1000
+HASH_CACHE_SIZE = 100_000
+
+# user_data keys hashed before sending
+HASHED_FIELDS = ("em", "ph", "fn", "ln")
+# Sent as they are
+PLAIN_FIELDS = ("client_ip_address", "client_user_agent", "fbc", "fbp")
+
+_SHA256 = re.compile(r"[0-9a-f]{64}")
+_NON_DIGITS = re.compile(r"\D")
+_NON_LETTERS = re.compile(r"[^a-z]")
+
+ACTION_SOURCES = {source.value for source in ActionSource}
+
+@lru_cache(maxsize=HASH_CACHE_SIZE)
+def hash_identifier(field: str, value: str) -> Optional[str]:
+    """Normalized, SHA-256 hashed `value` of a user_data field; None when it is empty."""
+    value = (value if isinstance(value, str) else str(value)).strip().lower()
+    # Already hashed, keep as it is
+    if len(value) == 64 and _SHA256.fullmatch(value):
+        return value
+    if field == "ph":
+        # Digits only, with the country code
+        value = _NON_DIGITS.sub("", value)
+    if not value:
+        return None
+    return hashlib.sha256(value.encode()).hexdigest()
+
+def hash_column(field: str, values: List[str]) -> List[Optional[str]]:
+    # Every distinct value is hashed once, repeated ones come from the cache
+    hashed = {value: hash_identifier(field, value) for value in set(values)}
+    return [hashed[value] for value in values]
+
+def hash_user_data(events: List[dict]) -> List[Dict[str, List[str]]]:
+    """The hashed em/ph/fn/ln lists of every event, computed a column at a time."""
+    # All values of each field in the batch, with the event they belong to
+    columns = {field: ([], []) for field in HASHED_FIELDS}
+    for i, event in enumerate(events):
+        user_data = event.get("user_data") or {}
+        for field, (owners, values) in columns.items():
+            for value in user_data.get(field) or ():
+                owners.append(i)
+                values.append(value)
+    hashed = [{} for _ in events]
+    for field, (owners, values) in columns.items():
+        for i, value in zip(owners, hash_column(field, values)):
+            if value is not None:
+                hashed[i].setdefault(field, []).append(value)
+    return hashed
+
+def event_payload(event: dict, hashed: Dict[str, List[str]]) -> dict:
+    """
+    The event as Meta expects it, like the SDK's Event.normalize() but without
+    building Event/UserData/CustomData objects: user data is hashed already.
+    """
+    action_source = event["action_source"]
+    if action_source not in ACTION_SOURCES:
+        raise ValueError(f"Invalid action_source: {action_source!r}")
+    payload = {"event_name": event["event_name"], "event_time": int(event["event_time"]), "action_source": action_source}
+    for key in ("event_id", "event_source_url"):
+        if event.get(key) is not None:
+            payload[key] = event[key]
+
+    user_data = event.get("user_data") or {}
+    normalized = dict(hashed)
+    if user_data.get("lead_id"):
+        normalized["lead_id"] = user_data["lead_id"][0]
+    for key in PLAIN_FIELDS:
+        if user_data.get(key):
+            normalized[key] = user_data[key]
+    payload["user_data"] = normalized
+
+    custom_data = {key: value for key, value in (event.get("custom_data") or {}).items() if value is not None}
+    if "currency" in custom_data:
+        currency = _NON_LETTERS.sub("", str(custom_data["currency"]).lower())
+        if len(currency) != 3:
+            raise ValueError(f"Invalid currency: {custom_data['currency']!r}")
+        custom_data["currency"] = currency
+    if custom_data:
+        payload["custom_data"] = custom_data
+    return payload
+
+def build_events(events: List[dict]) -> Tuple[List[Tuple[int, str]], List[dict]]:
+    """
+    The events normalized into the JSON Meta expects, with their index, plus
+    a result for each event that could not be built (missing or invalid fields).
+    """
+    hashed = hash_user_data(events)
+    built, invalid = [], []
+    for i, event in enumerate(events):
+        try:
+            # Invalid events are found here, before any request is sent
+            built.append((i, json.dumps(event_payload(event, hashed[i]))))
+        except (KeyError, TypeError, ValueError) as e:
+            invalid.append(event_result(i, event, "invalid", error=f"{type(e).__name__}: {e}"))
+    return built, invalid
+
+def event_result(index: int, event: dict, status: str, **details) -> dict:
+    return {"index": index, "event_id": event.get("event_id"), "status": status, **details}
+
+class PreparedEventRequest(EventRequest):
+    """EventRequest of events from build_events, which are JSON in Meta's format already."""
+
+    def normalize(self):
+        return self.events
+
+def send_batch(pixel_id: str, events: List[str], test_event_code: Optional[str] = None) -> dict:
+    get_facebook_api()
+    request = PreparedEventRequest(events=events, pixel_id=pixel_id, test_event_code=test_event_code)
+    try:
+        with upstream_call("facebook", "conversions_api"):
+            response = request.execute()
+    except FacebookRequestError as e:
+        body = e.body()
+        fbtrace_id = body.get("error", {}).get("fbtrace_id") if isinstance(body, dict) else None
+        return {"error": e.api_error_message(), "code": e.api_error_code(), "fbtrace_id": fbtrace_id,
+                "transient": retryable(e)}
+    except Exception as e:
+        # Connection errors and timeouts
+        return {"error": str(e), "code": None, "transient": True}
+    return {"events_received": response.events_received, "fbtrace_id": response.fbtrace_id,
+            "messages": response.messages}
+
+def send_events(pixel_id: str, events: List[dict], test_event_code: Optional[str] = None,
+                batch_size: int = MAX_EVENTS_PER_REQUEST, workers: int = 4) -> dict:
+    """
+    Send `events` to the pixel in EventRequests of up to `batch_size`
+    events, up to `workers` at once. Returns a report with one result per
+    event (in input order): "sent", "failed" (its request was rejected) or
+    "invalid" (not sent), and status success, partial or fail overall.
+    """
+    batch_size = max(1, min(batch_size, MAX_EVENTS_PER_REQUEST))
+    built, invalid = build_events(events)
+    batches = [built[start:start + batch_size] for start in range(0, len(built), batch_size)]
+
+    def send(batch):
+        return send_batch(pixel_id, [event for _, event in batch], test_event_code)
+
+    if len(batches) <= 1:
+        responses = [send(batch) for batch in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(batches))) as pool:
+            responses = list(pool.map(send, batches))
+
+    results = invalid
+    for batch, response in zip(batches, responses):
+        for i, _ in batch:
+            if "error" in response:
+                # Meta accepts or rejects a request as a whole
+                results.append(event_result(i, events[i], "failed", error=response["error"], code=response["code"],
+                                            fbtrace_id=response.get("fbtrace_id")))
+            else:
+                results.append(event_result(i, events[i], "sent", fbtrace_id=response["fbtrace_id"]))
+    results.sort(key=lambda result: result["index"])
+
+    sent = sum(result["status"] == "sent" for result in results)
+    if sent == len(events):
+        status = "success"
+    elif sent:
+        status = "partial"
+    else:
+        status = "fail"
+    return {"status": status, "total": len(events), "sent": sent, "requests": len(batches), "results": results}
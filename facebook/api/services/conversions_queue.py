@@ -0,0 +1,285 @@
+"""
+Accept-and-enqueue ingestion for the Conversions API.
+
+`enqueue` only stores the events in memory and returns. A background thread
+collects them per pixel (and test_event_code) into batches of up to
+MAX_EVENTS_PER_REQUEST, closing a batch once it is full or its oldest event
+waited `max_latency` seconds, and hands the batches to `workers` sending
+threads. A request that fails with a transient error (throttling, 5xx,
+connection errors) is retried with exponential backoff; events that are
+invalid, rejected, or still failing after `max_retries` are appended to the
+dead-letter file (NDJSON, one event per line), from where
+`replay_dead_letters` queues them again.
+
+Queue depth, batches in flight, send latency and the delay of events are in
+the shared metrics registry (/metrics), `stats()` has the counters.
+"""
+import os
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from services.conversions import MAX_EVENTS_PER_REQUEST, build_events, send_batch
+from observability import Gauge, Histogram, registry
+
+logger = logging.getLogger(__name__)
+
+DEAD_LETTER_PATH = os.getenv("CAPI_DEAD_LETTER_PATH", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "data", "conversions_dead_letters.ndjson"))
+
+# Sending includes the retries, so it can take minutes
+SEND_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+queue_depth = registry.register(Gauge("conversions_queue_depth", "Accepted events not sent or dead-lettered yet."))
+batches_in_flight = registry.register(Gauge("conversions_batches_in_flight", "Batches being sent, including retries."))
+send_duration = registry.register(Histogram("conversions_send_seconds",
+                                            "Time to send one batch, including retries.", SEND_BUCKETS))
+event_delay = registry.register(Histogram("conversions_event_delay_seconds",
+                                          "Time from accepting an event to Meta receiving it.", SEND_BUCKETS))
+
+# Put in the queue by close(): the worker sends what it collected and stops
+_STOP = object()
+
+class _Flush:
+    # Put in the queue by flush(): the worker sends what it collected and sets `done` once that was sent
+    def __init__(self):
+        self.done = threading.Event()
+
+class QueueFull(Exception):
+    pass
+
+class ConversionsQueue:
+    def __init__(self, batch_size: int = MAX_EVENTS_PER_REQUEST, max_latency: float = 1.0,
+                 max_queue: int = 100_000, workers: int = 4, max_retries: int = 5,
+                 backoff: float = 1.0, max_backoff: float = 60.0, dead_letter_path: str = DEAD_LETTER_PATH):
+        self.batch_size = max(1, min(batch_size, MAX_EVENTS_PER_REQUEST))
+        self.max_latency = max_latency
+        # At most this many events accepted and not finished; enqueue raises QueueFull beyond it
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.dead_letter_path = dead_letter_path
+        self.dead_letter_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.depth = 0
+        self.counts = {"accepted": 0, "rejected": 0, "batches": 0, "sent": 0, "retries": 0, "dead_lettered": 0}
+        self.queue = queue.Queue()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="conversions-sender")
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name="conversions-queue", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def enqueue(self, pixel_id: str, events: List[dict], test_event_code: Optional[str] = None) -> int:
+        """Queue events for a pixel and return the queue depth. Raises QueueFull if they do not fit."""
+        if self.closed:
+            raise RuntimeError("ConversionsQueue is closed")
+        with self.lock:
+            if self.depth + len(events) > self.max_queue:
+                self.counts["rejected"] += len(events)
+                raise QueueFull(f"{self.depth} events queued, {len(events)} more do not fit")
+            self.depth += len(events)
+            self.counts["accepted"] += len(events)
+            depth = self.depth
+        self._track_depth(len(events))
+        self.queue.put((pixel_id, test_event_code, events, time.time()))
+        return depth
+
+    def _track_depth(self, amount: int):
+        with registry.lock:
+            queue_depth.add((), amount)
+
+    def _run(self):
+        # (pixel_id, test_event_code) -> [(event, accepted_at), ...], and when that batch is due
+        pending: Dict[Tuple[str, Optional[str]], list] = {}
+        deadlines: Dict[Tuple[str, Optional[str]], float] = {}
+        futures = set()
+        while True:
+            timeout = max(0.0, min(deadlines.values()) - time.monotonic()) if deadlines else None
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is _STOP or isinstance(item, _Flush):
+                for key in list(pending):
+                    futures.add(self._submit(key, pending.pop(key)))
+                deadlines.clear()
+                wait(futures)
+                futures.clear()
+                if item is _STOP:
+                    return
+                item.done.set()
+                continue
+            if item is not None:
+                pixel_id, test_event_code, events, accepted_at = item
+                key = (pixel_id, test_event_code)
+                batch = pending.setdefault(key, [])
+                deadlines.setdefault(key, time.monotonic() + self.max_latency)
+                batch.extend((event, accepted_at) for event in events)
+                while len(batch) >= self.batch_size:
+                    futures.add(self._submit(key, batch[:self.batch_size]))
+                    del batch[:self.batch_size]
+                if not batch:
+                    del pending[key], deadlines[key]
+            now = time.monotonic()
+            for key in [key for key, deadline in deadlines.items() if deadline <= now]:
+                futures.add(self._submit(key, pending.pop(key)))
+                del deadlines[key]
+            futures = {future for future in futures if not future.done()}
+
+    def _submit(self, key, entries):
+        with registry.lock:
+            batches_in_flight.add((), 1)
+        return self.pool.submit(self._send, key[0], key[1], entries)
+
+    def _retry_delay(self, attempt: int) -> float:
+        # Exponential backoff with jitter, so throttled senders do not all retry at the same moment
+        return min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def _send(self, pixel_id: str, test_event_code: Optional[str], entries: list):
+        events = [event for event, _ in entries]
+        try:
+            built, invalid = build_events(events)
+            dead = [(events[result["index"]], result["error"], None, 0) for result in invalid]
+            start = time.perf_counter()
+            attempt = 0
+            response = {}
+            while built:
+                response = send_batch(pixel_id, [payload for _, payload in built], test_event_code)
+                if "error" not in response or not response["transient"] or attempt >= self.max_retries:
+                    break
+                time.sleep(self._retry_delay(attempt))
+                attempt += 1
+                self._count("retries")
+            elapsed = time.perf_counter() - start
+            sent = 0
+            if built and "error" in response:
+                logger.error("Conversions API rejected %d events for pixel %s after %d attempts: %s",
+                             len(built), pixel_id, attempt + 1, response["error"])
+                dead.extend((events[i], response["error"], response["code"], attempt + 1) for i, _ in built)
+            elif built:
+                sent = len(built)
+                now = time.time()
+                with registry.lock:
+                    for i, _ in built:
+                        event_delay.observe((), now - entries[i][1])
+            if built:
+                with registry.lock:
+                    send_duration.observe((("outcome", "ok" if sent else "error"),), elapsed)
+            if dead:
+                self._dead_letter(pixel_id, test_event_code, dead)
+            with self.lock:
+                self.counts["batches"] += 1
+                self.counts["sent"] += sent
+        except Exception as e:
+            # Never lose a batch to an unexpected error
+            logger.exception("Sending %d events for pixel %s failed", len(events), pixel_id)
+            self._dead_letter(pixel_id, test_event_code, [(event, str(e), None, 0) for event in events])
+        finally:
+            with self.lock:
+                self.depth -= len(entries)
+            self._track_depth(-len(entries))
+            with registry.lock:
+                batches_in_flight.add((), -1)
+
+    def _count(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counts[name] += amount
+
+    def _dead_letter(self, pixel_id: str, test_event_code: Optional[str], dead: list):
+        failed_at = datetime.now().isoformat(timespec="seconds")
+        lines = "".join(
+            json.dumps({"pixel_id": pixel_id, "test_event_code": test_event_code, "event": event, "error": error,
+                        "code": code, "attempts": attempts, "failed_at": failed_at}) + "\n"
+            for event, error, code, attempts in dead
+        )
+        with self.dead_letter_lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.dead_letter_path)), exist_ok=True)
+            with open(self.dead_letter_path, "a") as f:
+                f.write(lines)
+        self._count("dead_lettered", len(dead))
+
+    def replay_dead_letters(self, pixel_id: Optional[str] = None) -> int:
+        """
+        Queue the dead-lettered events again (only those of `pixel_id` if
+        given) and remove them from the file. Returns how many were queued;
+        events that do not fit in the queue stay in the file.
+        """
+        with self.dead_letter_lock:
+            if not os.path.exists(self.dead_letter_path):
+                return 0
+            with open(self.dead_letter_path) as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+            groups: Dict[Tuple[str, Optional[str]], list] = {}
+            keep = []
+            for entry in entries:
+                if pixel_id is not None and entry["pixel_id"] != pixel_id:
+                    keep.append(entry)
+                else:
+                    groups.setdefault((entry["pixel_id"], entry["test_event_code"]), []).append(entry)
+            replayed = 0
+            for (pixel, test_event_code), group in groups.items():
+                try:
+                    self.enqueue(pixel, [entry["event"] for entry in group], test_event_code)
+                    replayed += len(group)
+                except QueueFull:
+                    keep.extend(group)
+            # Rewritten in place of the old file, so a crash cannot leave it half written
+            temporary = self.dead_letter_path + ".tmp"
+            with open(temporary, "w") as f:
+                f.write("".join(json.dumps(entry) + "\n" for entry in keep))
+            os.replace(temporary, self.dead_letter_path)
+        logger.info("Replaying %d dead-lettered events", replayed)
+        return replayed
+
+    def dead_letter_count(self) -> int:
+        with self.dead_letter_lock:
+            if not os.path.exists(self.dead_letter_path):
+                return 0
+            with open(self.dead_letter_path) as f:
+                return sum(1 for line in f if line.strip())
+
+    def stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.counts, depth=self.depth)
+        stats["dead_letters_in_file"] = self.dead_letter_count()
+        return stats
+
+    def flush(self, timeout: float = None) -> bool:
+        """Send everything queued so far and wait for it. Returns False on timeout."""
+        if self.closed:
+            return True
+        marker = _Flush()
+        self.queue.put(marker)
+        return marker.done.wait(timeout)
+
+    def close(self, timeout: float = None):
+        """Send the queued events and stop; later enqueues raise RuntimeError."""
+        if self.closed:
+            return
+        self.closed = True
+        atexit.unregister(self.close)
+        self.queue.put(_STOP)
+        self.thread.join(timeout)
+        self.pool.shutdown(wait=timeout is None)
+
+_conversions_queue = None
+_conversions_queue_lock = threading.Lock()
+
+def get_conversions_queue() -> ConversionsQueue:
+    global _conversions_queue
+    with _conversions_queue_lock:
+        if _conversions_queue is None:
+            _conversions_queue = ConversionsQueue(
+                max_queue=int(os.getenv("CAPI_QUEUE_SIZE", "100000")),
+                workers=int(os.getenv("CAPI_QUEUE_WORKERS", "4")),
+            )
+        return _conversions_queue
@@ -0,0 +1,43 @@
+import os
+import json
+from typing import List
+
+import gspread
+from dotenv import load_dotenv
+from google.oauth2.service_account import Credentials
+from observability import upstream_call
+
+load_dotenv()
+
+def get_gspread_client() -> gspread.Client:
+    # Define the scope
+    scope = [
+        'https://www.googleapis.com/auth/spreadsheets',
+        'https://www.googleapis.com/auth/drive'
+    ]
+
+    # Get credentials from environment variable
+    creds_json = os.getenv('GOOGLE_SHEETS_CREDENTIALS')
+
+    if not creds_json:
+        raise ValueError("GOOGLE_SHEETS_CREDENTIALS environment variable NOT found.")
+
+    # If the env var is a path to a file, load it directly
+    if os.path.isfile(creds_json):
+        creds = Credentials.from_service_account_file(creds_json, scopes=scope)
+    else:
+        # Otherwise, assume it's the JSON content itself
+        info = json.loads(creds_json)
+        creds = Credentials.from_service_account_info(info, scopes=scope)
+
+    client = gspread.authorize(creds)
+    return client
+
+def open_worksheet(gc: gspread.Client, google_sheet_id: str, work_sheet_id: str) -> gspread.Worksheet:
+    with upstream_call("google_sheets", "open_worksheet"):
+        spreadsheet = gc.open_by_key(google_sheet_id)
+        return spreadsheet.get_worksheet_by_id(work_sheet_id)
+
+def append_rows(worksheet: gspread.Worksheet, rows: List[List[str]]):
+    with upstream_call("google_sheets", "append_rows"):
+        worksheet.append_rows(values=rows)
@@ -0,0 +1,186 @@
+"""
+Incremental lead sync: hands the leads of a form created since the last sync
+to a sink (e.g. a Google Sheet), each lead exactly once.
+
+Per form and sink, a small SQLite store keeps the high-water mark: the
+`created_time` of the newest lead delivered and the ids delivered in that
+second. A sync only asks the Graph API for leads from that second on.
+
+Leads are delivered oldest first, in batches. Before a batch goes to the sink
+it is written to the store as pending; once the sink accepted it, the pending
+batch is removed and the mark advanced in one transaction. If the process dies
+in between, the next sync asks the sink whether the pending batch arrived
+(`was_delivered`) and only sends it again if it did not.
+"""
+import os
+import json
+import sqlite3
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from services.leads import lead_params, lead_pages, clean_lead, RateLimiter, NDJSONFileSink
+from services.google_sheet import get_gspread_client, open_worksheet, append_rows
+from observability import upstream_call
+
+logger = logging.getLogger(__name__)
+
+LEAD_SYNC_DB = os.getenv("LEAD_SYNC_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "lead_sync.sqlite3"))
+
+def lead_timestamp(lead) -> int:
+    return int(datetime.strptime(lead['created_time'], "%Y-%m-%dT%H:%M:%S%z").timestamp())
+
+def lead_row(lead: dict) -> List[str]:
+    # Lead id first, so the sheet can be searched for delivered leads; then one column per answer
+    answers = ["; ".join(item.get('values') or []) for item in lead.get('field_data') or []]
+    return [lead['id'], lead['created_time'], lead.get('ad_id') or "", lead.get('form_id') or ""] + answers
+
+class LeadSyncStore:
+    """High-water marks and pending batches, per (form id, sink key)."""
+
+    def __init__(self, path: str = LEAD_SYNC_DB):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS marks (
+                form_id TEXT, sink TEXT, created INTEGER, ids TEXT, synced_at TEXT,
+                PRIMARY KEY (form_id, sink))""")
+            db.execute("""CREATE TABLE IF NOT EXISTS pending (
+                form_id TEXT, sink TEXT, leads TEXT,
+                PRIMARY KEY (form_id, sink))""")
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection per call, so the store can be used from any thread
+        return sqlite3.connect(self.path, timeout=30)
+
+    def mark(self, form_id: str, sink: str) -> Tuple[Optional[int], List[str]]:
+        with self._connect() as db:
+            row = db.execute("SELECT created, ids FROM marks WHERE form_id = ? AND sink = ?", (form_id, sink)).fetchone()
+        return (row[0], json.loads(row[1])) if row else (None, [])
+
+    def pending(self, form_id: str, sink: str) -> Optional[List[dict]]:
+        with self._connect() as db:
+            row = db.execute("SELECT leads FROM pending WHERE form_id = ? AND sink = ?", (form_id, sink)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def begin(self, form_id: str, sink: str, leads: List[dict]):
+        with self._connect() as db:
+            db.execute("INSERT INTO pending (form_id, sink, leads) VALUES (?, ?, ?)", (form_id, sink, json.dumps(leads)))
+
+    def commit(self, form_id: str, sink: str, leads: List[dict]):
+        # Drops the pending batch and moves the mark past it, both or neither
+        with self._connect() as db:
+            row = db.execute("SELECT created, ids FROM marks WHERE form_id = ? AND sink = ?", (form_id, sink)).fetchone()
+            created, ids = (row[0], json.loads(row[1])) if row else (None, [])
+            for lead in leads:
+                if created is None or lead['created_unix'] > created:
+                    created, ids = lead['created_unix'], []
+                if lead['created_unix'] == created:
+                    ids.append(lead['id'])
+            db.execute("DELETE FROM pending WHERE form_id = ? AND sink = ?", (form_id, sink))
+            db.execute("INSERT OR REPLACE INTO marks (form_id, sink, created, ids, synced_at) VALUES (?, ?, ?, ?, ?)",
+                       (form_id, sink, created, json.dumps(ids), datetime.now().isoformat(timespec="seconds")))
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_lead_sync_store() -> LeadSyncStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = LeadSyncStore()
+        return _store
+
+class GoogleSheetSink:
+    """Appends leads to a worksheet, one row per lead (see lead_row)."""
+
+    def __init__(self, google_sheet_id: str, work_sheet_id: str):
+        self.key = f"google_sheet:{google_sheet_id}/{work_sheet_id}"
+        self.worksheet = open_worksheet(get_gspread_client(), google_sheet_id, work_sheet_id)
+
+    def deliver(self, leads: List[dict]):
+        append_rows(self.worksheet, [lead_row(lead) for lead in leads])
+
+    def was_delivered(self, leads: List[dict]) -> bool:
+        # A batch is appended in one request, so if its last lead is in the sheet the whole batch is
+        with upstream_call("google_sheets", "col_values"):
+            ids = self.worksheet.col_values(1)
+        return leads[-1]['id'] in ids
+
+class NDJSONSyncSink(NDJSONFileSink):
+    """The backfill's NDJSON file, as a sync sink."""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self.key = f"file:{os.path.abspath(path)}"
+
+    def deliver(self, leads: List[dict]):
+        self(leads)
+
+    def was_delivered(self, leads: List[dict]) -> bool:
+        return leads[-1]['id'] in self.existing_ids()
+
+class SyncInProgress(RuntimeError):
+    pass
+
+# Two syncs of the same form into the same sink must not run at once
+_sync_locks: Dict[Tuple[str, str], threading.Lock] = {}
+_sync_locks_lock = threading.Lock()
+
+def _sync_lock(form_id: str, sink: str) -> threading.Lock:
+    with _sync_locks_lock:
+        return _sync_locks.setdefault((form_id, sink), threading.Lock())
+
+def sync_leads(form_id: str, sink, store: Optional[LeadSyncStore] = None, start_time: Optional[int] = None,
+               limit: int = 100, batch_size: int = 500, limiter: Optional[RateLimiter] = None) -> dict:
+    """
+    Deliver the leads of `form_id` created since the last sync into `sink`
+    (an object with `key`, `deliver(leads)` and `was_delivered(leads)`).
+    `start_time` (Unix seconds) is where the first sync of a form starts;
+    without it the first sync delivers every lead of the form.
+    """
+    store = store or get_lead_sync_store()
+    limiter = limiter or RateLimiter()
+    lock = _sync_lock(form_id, sink.key)
+    if not lock.acquire(blocking=False):
+        raise SyncInProgress(f"A sync of form {form_id} into {sink.key} is already running")
+    try:
+        recovered = 0
+        pending = store.pending(form_id, sink.key)
+        if pending:
+            # The last sync stopped between delivering a batch and recording it
+            if not sink.was_delivered(pending):
+                sink.deliver(pending)
+            store.commit(form_id, sink.key, pending)
+            recovered = len(pending)
+
+        since, delivered_ids = store.mark(form_id, sink.key)
+        if since is None:
+            since = start_time
+        delivered_ids = set(delivered_ids)
+        # The filter is exclusive, start a second earlier to see leads in the same second as the mark
+        params = lead_params(since - 1 if since is not None else None, None, limit)
+        leads = []
+        for page, _ in lead_pages(form_id, params, limiter):
+            for lead in page:
+                if lead['id'] in delivered_ids:
+                    continue
+                leads.append(dict(id=lead['id'], created_unix=lead_timestamp(lead), **clean_lead(lead)))
+        # Oldest first, so the mark only ever moves past leads that were delivered
+        leads.sort(key=lambda lead: (lead['created_unix'], lead['id']))
+
+        batches = 0
+        for start in range(0, len(leads), batch_size):
+            batch = leads[start:start + batch_size]
+            store.begin(form_id, sink.key, batch)
+            sink.deliver(batch)
+            store.commit(form_id, sink.key, batch)
+            batches += 1
+
+        created, _ = store.mark(form_id, sink.key)
+        logger.info("Synced %d leads of form %s into %s", len(leads), form_id, sink.key)
+        return {"form_id": form_id, "sink": sink.key, "delivered": len(leads), "batches": batches,
+                "recovered": recovered, "mark": created}
+    finally:
+        lock.release()
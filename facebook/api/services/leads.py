@@ -0,0 +1,284 @@
+"""
+Reading leads of a Facebook lead form through the Graph API: page iteration,
+rate-limit handling and a parallel, time-sliced backfill.
+
+The backfill can also be run from the command line, writing NDJSON to a file:
+
+    python services/leads.py <form_id> --start "2025-01-01 00:00:00" --end "2025-06-30 23:59:59" \
+        --window-hours 24 --workers 4 --output leads.ndjson
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+from facebook_business.api import FacebookAdsApi
+from facebook_business.adobjects.leadgenform import LeadgenForm
+from facebook_business.exceptions import FacebookRequestError
+
+# The repository root holds the observability package shared by all apps
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+
+from observability import upstream_call
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+access_token = os.environ.get("FB_TOKEN")
+
+LEAD_FIELDS = ['created_time', 'field_data', 'ad_id', 'form_id']
+
+# Graph API error codes meaning "too many calls, slow down"
+THROTTLE_CODES = {4, 17, 32, 613} | set(range(80000, 80015))
+
+# One FacebookAdsApi per process, created on first use. Its session keeps the
+# connection to the Graph API alive between requests.
+_facebook_api = None
+_facebook_api_lock = threading.Lock()
+
+def get_facebook_api() -> FacebookAdsApi:
+    global _facebook_api
+    if _facebook_api is None:
+        with _facebook_api_lock:
+            if _facebook_api is None:
+                if not access_token:
+                    raise RuntimeError("FB_TOKEN is not set")
+                api = FacebookAdsApi.init(access_token=access_token)
+                # FB_GRAPH_URL points the client at a local stand-in of the Graph API
+                if os.getenv("FB_GRAPH_URL"):
+                    api._session.GRAPH = os.getenv("FB_GRAPH_URL")
+                _facebook_api = api
+                logger.info("Facebook API Initialized.")
+    return _facebook_api
+
+def to_timestamp(value: str) -> int:
+    return int(time.mktime(time.strptime(value, "%Y-%m-%d %H:%M:%S")))
+
+def lead_params(start_time: Optional[int], end_time: Optional[int], limit: int, after: Optional[str] = None) -> dict:
+    # Both bounds are exclusive, like the Graph API filter operators
+    filtering = []
+    if start_time is not None:
+        filtering.append({'field': 'time_created', 'operator': 'GREATER_THAN', 'value': start_time})
+    if end_time is not None:
+        filtering.append({'field': 'time_created', 'operator': 'LESS_THAN', 'value': end_time})
+    params = {'limit': limit, 'filtering': filtering}
+    if after:
+        params['after'] = after
+    return params
+
+def clean_lead(lead) -> dict:
+    dt_utc = datetime.strptime(lead['created_time'], "%Y-%m-%dT%H:%M:%S%z")
+    bangkok_time = dt_utc.astimezone(timezone(timedelta(hours=7))).strftime("%Y-%m-%d %H:%M:%S")
+    return {
+        'created_time': bangkok_time,
+        'ad_id': lead.get('ad_id', None),
+        'form_id': lead.get('form_id', None),
+        'field_data': lead.get('field_data', None)
+    }
+
+class RateLimiter:
+    """
+    Shared by all threads calling the Graph API. After every response it reads
+    the usage headers (X-App-Usage, X-Business-Use-Case-Usage,
+    X-Ad-Account-Usage); once any usage reaches `threshold` percent, or a call
+    is throttled, every caller waits until the pause is over.
+    """
+
+    def __init__(self, threshold: float = 90.0, base_delay: float = 2.0, max_delay: float = 300.0):
+        self.threshold = threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.resume_at = 0.0
+        self.pauses = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        while True:
+            with self.lock:
+                delay = self.resume_at - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def _pause(self, seconds: float):
+        with self.lock:
+            resume_at = time.monotonic() + min(seconds, self.max_delay)
+            if resume_at > self.resume_at:
+                self.resume_at = resume_at
+                self.pauses += 1
+        logger.warning("Graph API rate limit, pausing %.1f seconds", min(seconds, self.max_delay))
+
+    def observe(self, headers):
+        usage, regain = usage_from_headers(headers)
+        if usage >= self.threshold:
+            self._pause(max(regain, self.base_delay))
+
+    def throttled(self, headers, attempt: int):
+        # Wait as long as the headers ask for, at least an exponential backoff
+        _, regain = usage_from_headers(headers)
+        self._pause(max(regain, self.base_delay * 2 ** attempt))
+
+def usage_from_headers(headers) -> Tuple[float, float]:
+    # Highest usage percentage and the longest wait (seconds) announced by the usage headers
+    usage, regain = 0.0, 0.0
+    headers = {key.lower(): value for key, value in (headers or {}).items()}
+    try:
+        if 'x-app-usage' in headers:
+            usage = max([usage] + [float(v) for v in json.loads(headers['x-app-usage']).values()])
+        if 'x-ad-account-usage' in headers:
+            usage = max(usage, float(json.loads(headers['x-ad-account-usage']).get('acc_id_util_pct', 0)))
+        if 'x-business-use-case-usage' in headers:
+            for entries in json.loads(headers['x-business-use-case-usage']).values():
+                for entry in entries:
+                    usage = max([usage] + [float(entry.get(key, 0)) for key in ('call_count', 'total_cputime', 'total_time')])
+                    regain = max(regain, float(entry.get('estimated_time_to_regain_access', 0)) * 60)
+    except (ValueError, TypeError, AttributeError):
+        logger.debug("Unreadable rate limit headers: %s", headers)
+    return usage, regain
+
+def lead_pages(form_id: str, params: dict, limiter: Optional[RateLimiter] = None) -> Iterator[Tuple[list, Optional[str]]]:
+    """
+    Yields the leads of one Graph API page at a time, with the paging cursor
+    that continues after that page (None after the last page).
+    """
+    api = get_facebook_api()
+    requested_after = params.get('after')
+    if limiter:
+        limiter.wait()
+    # get_leads already fetches the first page
+    with upstream_call("facebook", "get_leads"):
+        cursor = LeadgenForm(form_id, api=api).get_leads(fields=LEAD_FIELDS, params=params)
+    while True:
+        if limiter:
+            limiter.observe(cursor.headers())
+        page = [cursor[i] for i in range(len(cursor))]
+        # The cursor only moves its 'after' parameter on when there is another page
+        after = cursor.params.get('after')
+        has_next = after is not None and after != requested_after
+        yield page, after if has_next else None
+        if not has_next:
+            return
+        requested_after = after
+        if limiter:
+            limiter.wait()
+        with upstream_call("facebook", "get_leads"):
+            loaded = cursor.load_next_page()
+        if not loaded:
+            return
+
+def time_windows(start_time: int, end_time: int, window: int) -> List[Tuple[int, int]]:
+    # Consecutive [since, until] windows covering [start_time, end_time], sharing their edge second
+    windows = []
+    since = start_time
+    while since < end_time:
+        until = min(since + window, end_time)
+        windows.append((since, until))
+        since = until
+    return windows
+
+def retryable(error: FacebookRequestError) -> bool:
+    return error.api_error_code() in THROTTLE_CODES or (error.http_status() or 0) >= 500 or \
+        bool(error.api_transient_error())
+
+def fetch_window(form_id: str, since: int, until: int, limit: int, limiter: RateLimiter,
+                 emit: Callable[[list], None], max_retries: int = 5):
+    # Every lead created in [since, until]; the filter bounds are exclusive, so widen them by a second
+    params = lead_params(since - 1, until + 1, limit)
+    attempt = 0
+    while True:
+        try:
+            for page, after in lead_pages(form_id, params, limiter):
+                emit(page)
+                # A retry continues after the last page that was emitted
+                params['after'] = after
+            return
+        except FacebookRequestError as e:
+            if not retryable(e) or attempt >= max_retries:
+                raise
+            limiter.throttled(e.http_headers(), attempt)
+            attempt += 1
+
+def backfill_leads(form_id: str, start_time: int, end_time: int, sink: Callable[[List[dict]], None],
+                   window: int = 86400, workers: int = 4, limit: int = 100,
+                   seen: Optional[Set[str]] = None, limiter: Optional[RateLimiter] = None) -> Dict[str, int]:
+    """
+    Fetch every lead of a form created between start_time and end_time (Unix
+    seconds). The range is split into windows of `window` seconds that are
+    fetched by up to `workers` threads at once. Pages are handed to `sink` as
+    they arrive (one call at a time), each lead once: leads on the shared edge
+    of two windows, or ids already in `seen`, are skipped.
+    """
+    limiter = limiter or RateLimiter()
+    seen = set() if seen is None else seen
+    stats = {"windows": 0, "pages": 0, "leads": 0, "duplicates": 0}
+    lock = threading.Lock()
+
+    def emit(page):
+        with lock:
+            fresh = []
+            for lead in page:
+                if lead['id'] in seen:
+                    stats["duplicates"] += 1
+                    continue
+                seen.add(lead['id'])
+                fresh.append(dict(id=lead['id'], **clean_lead(lead)))
+            stats["pages"] += 1
+            stats["leads"] += len(fresh)
+            if fresh:
+                sink(fresh)
+
+    windows = time_windows(start_time, end_time, window)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(windows)))) as pool:
+        futures = [pool.submit(fetch_window, form_id, since, until, limit, limiter, emit) for since, until in windows]
+        for future in futures:
+            # Re-raises the error of a window that failed even after retries
+            future.result()
+            stats["windows"] += 1
+    stats["rate_limit_pauses"] = limiter.pauses
+    return stats
+
+class NDJSONFileSink:
+    """Appends leads to an NDJSON file, flushed after every page."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def existing_ids(self) -> Set[str]:
+        # Ids already in the file, so a rerun after a crash does not write them twice
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path) as f:
+            return {json.loads(line)['id'] for line in f if line.strip()}
+
+    def __call__(self, leads: List[dict]):
+        with open(self.path, "a") as f:
+            f.write("".join(json.dumps(lead) + "\n" for lead in leads))
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill the leads of a lead form into an NDJSON file")
+    parser.add_argument("form_id")
+    parser.add_argument("--start", required=True, help='e.g. "2025-01-01 00:00:00"')
+    parser.add_argument("--end", required=True, help='e.g. "2025-06-30 23:59:59"')
+    parser.add_argument("--window-hours", type=float, default=24)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--limit", type=int, default=100, help="Leads per Graph API page")
+    parser.add_argument("--output", default="leads.ndjson")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    sink = NDJSONFileSink(args.output)
+    stats = backfill_leads(args.form_id, to_timestamp(args.start), to_timestamp(args.end), sink,
+                           window=int(args.window_hours * 3600), workers=args.workers, limit=args.limit,
+                           seen=sink.existing_ids())
+    print(json.dumps(stats))
+
+if __name__ == "__main__":
+    main()
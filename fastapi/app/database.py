@@ -1,74 +1,1011 @@
 import pandas as pd
+import numpy as np
 import os
-from typing import List, Dict, Any, Optional
+import bisect
+import base64
+import hashlib
+import json
+import math
+from functools import lru_cache
+from json.encoder import encode_basestring_ascii
+import shutil
+import logging
+from typing import List, Dict, Any, Optional, Iterator
+import threading
+from storage import (load_columns, load_snapshot, snapshots, snapshot_dir, sync_directory, write_columns,
+                     compact_frame, source_fingerprint, memory_footprint, format_footprint, booking_schema)
+from wal import WriteAheadLog
+
+logger = logging.getLogger(__name__)
+
+# Columns that get a value -> row positions index for equality and IN filters
+INDEXED_COLUMNS = ["hotel", "is_canceled", "country"]
+
+# Numeric columns kept as sorted arrays, so range filters are answered by binary search
+RANGE_COLUMNS = ["lead_time", "adr", "arrival_date_year", "arrival_date_week_number"]
+
+EMPTY_POSITIONS = np.empty(0, dtype=np.int64)
+EMPTY_VALUES = np.empty(0, dtype=object)
+
+# New rows are staged in the append buffer and merged into the main frame in
+# batches of at least this many rows (or 1/8 of the table, whichever is larger)
+MERGE_MIN_ROWS = 1024
+
+# Updated cells are kept in a per-column overlay and folded into the columns
+# once a column has this many of them (or 1/64 of the table, whichever is larger)
+PATCH_MAX_CELLS = 1024
+
+# Columns /bookings/aggregate can group by: the text columns plus a few low-cardinality numbers
+GROUP_BY_COLUMNS = [name for name, kind in booking_schema().items() if kind is str] + \
+    ["is_canceled", "arrival_date_year", "is_repeated_guest"]
+
+# Aggregation metrics as pandas named aggregations: name -> (column, function)
+AGGREGATE_METRICS = {
+    "count": ("is_canceled", "size"),
+    "adr_sum": ("adr", "sum"),
+    "adr_mean": ("adr", "mean"),
+    "cancellation_rate": ("is_canceled", "mean"),
+    "total_nights": ("nights", "sum"),
+    "canceled": ("is_canceled", "sum"),
+    "adr_count": ("adr", "count"),
+}
+
+# Rows serialized per chunk by /bookings/export
+EXPORT_CHUNK_ROWS = 5000
+
+# Number of aggregation results kept, each is only valid for one table version
+AGGREGATE_CACHE_SIZE = 128
+
+class AppendBuffer:
+    """Growable columnar staging area for newly inserted bookings."""
+
+    def __init__(self, dtypes: Dict[str, Any], capacity: int = MERGE_MIN_ROWS):
+        self.dtypes = dict(dtypes)
+        self.length = 0
+        self.capacity = capacity
+        self.data: Dict[str, np.ndarray] = {
+            column: np.empty(capacity, dtype=self._storage_dtype(dtype))
+            for column, dtype in self.dtypes.items()
+        }
+
+    @staticmethod
+    def _storage_dtype(dtype: Any) -> Any:
+        # Numeric columns are staged at full width so any valid value fits,
+        # everything else (text, categories) is stored as objects
+        if isinstance(dtype, np.dtype) and dtype.kind in "iu":
+            return np.int64
+        if isinstance(dtype, np.dtype) and dtype.kind in "bf":
+            return dtype
+        return object
+
+    def _grow(self, needed: int):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        for column, values in self.data.items():
+            grown = np.empty(capacity, dtype=values.dtype)
+            grown[:self.length] = values[:self.length]
+            self.data[column] = grown
+        self.capacity = capacity
+
+    def _set(self, column: str, row: int, value: Any):
+        values = self.data[column]
+        try:
+            values[row] = np.nan if value is None and values.dtype.kind == "f" else value
+        except (TypeError, ValueError, OverflowError):
+            # e.g. a None in an integer column: fall back to object storage
+            self.data[column] = values.astype(object)
+            self.data[column][row] = value
+
+    def append(self, row: Dict[str, Any]) -> int:
+        if self.length == self.capacity:
+            self._grow(self.length + 1)
+        position = self.length
+        for column in self.data:
+            self._set(column, position, row.get(column))
+        self.length += 1
+        return position
+
+    def frame(self, rows: np.ndarray, columns: List[str]) -> pd.DataFrame:
+        return staged_frame(self.data, self.dtypes, rows, columns)
+
+
+def staged_frame(data: Dict[str, np.ndarray], dtypes: Dict[str, Any],
+                 rows: np.ndarray, columns: List[str]) -> pd.DataFrame:
+    # Build a frame of buffered rows, cast back to the main table's dtypes where possible
+    staged = pd.DataFrame({column: data[column][rows] for column in columns})
+    for column in columns:
+        target = dtypes[column]
+        values = staged[column]
+        # Categories are reconciled when the buffer is merged
+        if values.dtype == target or isinstance(target, pd.CategoricalDtype):
+            continue
+        # Keep the wide integers if they do not fit the compact column
+        if isinstance(target, np.dtype) and target.kind in "iu" and values.dtype.kind in "iu":
+            info = np.iinfo(target)
+            if len(values) and (values.min() < info.min or values.max() > info.max):
+                continue
+        try:
+            staged[column] = values.astype(target)
+        except (TypeError, ValueError):
+            pass
+    return staged
+
+def with_categories(column: pd.Series, values) -> pd.Series:
+    categories = column.cat.categories
+    missing = [value for value in pd.unique(np.asarray(values, dtype=object))
+               if not pd.isna(value) and value not in categories]
+    return column.cat.add_categories(missing) if missing else column
+
+def set_cells(column: pd.Series, rows: np.ndarray, values: np.ndarray) -> pd.Series:
+    # Copy of `column` with `values` at the row positions `rows`. Missing categories
+    # are added and a compact integer column is widened if the values do not fit.
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        column = with_categories(column, values)
+    elif isinstance(column.dtype, np.dtype) and column.dtype.kind in "iuf" and len(values):
+        values = np.asarray(values.tolist(), dtype=float if column.dtype.kind == "f" else None)
+        if column.dtype.kind in "iu" and values.dtype.kind in "iu":
+            info = np.iinfo(column.dtype)
+            if values.min() < info.min or values.max() > info.max:
+                column = column.astype(np.int64)
+            values = values.astype(column.dtype)
+    # The copy is private and writable, even if the old column was memory-mapped
+    column = column.copy()
+    column.iloc[rows] = values
+    return column
+
+def remove_sorted(positions: np.ndarray, removed: np.ndarray) -> np.ndarray:
+    # `positions` without the entries in `removed` (both sorted)
+    if not len(positions) or not len(removed):
+        return positions
+    at = np.searchsorted(positions, removed)
+    hit = at < len(positions)
+    hit[hit] = positions[at[hit]] == removed[hit]
+    return np.delete(positions, at[hit]) if hit.any() else positions
+
+def insert_sorted(positions: np.ndarray, added: np.ndarray) -> np.ndarray:
+    # `positions` with the entries of `added` (both sorted, disjoint) in their place
+    if not len(added):
+        return positions
+    return np.insert(positions, np.searchsorted(positions, added), added)
+
+def condition_mask(values: Any, condition: Any) -> np.ndarray:
+    """
+    Boolean mask of `values` matching a filter condition: a {"min": .., "max": ..}
+    dict (inclusive, either side optional), a list of allowed values, or a single value.
+    """
+    if isinstance(condition, dict):
+        values = np.asarray(values, dtype=float)
+        mask = np.ones(len(values), dtype=bool)
+        if condition.get("min") is not None:
+            mask &= values >= condition["min"]
+        if condition.get("max") is not None:
+            mask &= values <= condition["max"]
+        return mask
+    if isinstance(condition, list):
+        return pd.Series(values, copy=False).isin(condition).to_numpy()
+    return np.asarray(values == condition)
+
+def sorted_column(column: pd.Series):
+    # (values in ascending order, row position of each value); NaN sorts last
+    values = column.to_numpy()
+    order = np.argsort(values, kind="stable").astype(np.int64)
+    return values[order], order
+
+def filters_fingerprint(filters: Dict[str, Any]) -> str:
+    active = sorted((key, value) for key, value in (filters or {}).items() if value is not None)
+    return hashlib.sha256(json.dumps(active, default=str).encode()).hexdigest()[:16]
+
+def encode_cursor(last_id: int, filters: Dict[str, Any]) -> str:
+    payload = json.dumps({"after": int(last_id), "filters": filters_fingerprint(filters)})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def read_cursor(cursor: str, filters: Dict[str, Any]) -> int:
+    # Returns the booking id a page token resumes after
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        last_id = int(payload["after"])
+        fingerprint = payload["filters"]
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid page token")
+    if fingerprint != filters_fingerprint(filters):
+        raise ValueError("Page token does not match the requested filters")
+    return last_id
+
+def json_values(column: pd.Series) -> List[str]:
+    # The JSON text of every value of `column`: floats in their shortest form
+    # that reads back as the same number (repr), NaN and other missing values as null
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return category_texts(column.dtype)[column.array.codes].tolist()
+    values = column.to_numpy()
+    if values.dtype.kind in "iuf":
+        # Each distinct number is written once
+        distinct, inverse = np.unique(values, return_inverse=True)
+        if values.dtype.kind == "f":
+            texts = [repr(value) if math.isfinite(value) else "null" for value in distinct.tolist()]
+        else:
+            texts = list(map(str, distinct.tolist()))
+        return np.array(texts, dtype=object)[inverse].tolist()
+    return [json_text(value) for value in values]
+
+@lru_cache(maxsize=64)
+def category_texts(dtype: pd.CategoricalDtype) -> np.ndarray:
+    # The JSON text of each category, with null last for code -1 (missing). Pages
+    # taken from one frame share its dtypes, so this runs once per column.
+    texts = [json_text(value) for value in dtype.categories.to_numpy().tolist()]
+    return np.array(texts + ["null"], dtype=object)
+
+def json_text(value: Any) -> str:
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or value is pd.NA or isinstance(value, float) and not math.isfinite(value):
+        return "null"
+    return json.dumps(value)
+
+def json_records(frame: pd.DataFrame) -> List[str]:
+    """One JSON object per row of `frame`, built a column at a time."""
+    if frame.empty:
+        return []
+    template = "{" + ",".join(json.dumps(str(column)).replace("%", "%%") + ":%s" for column in frame.columns) + "}"
+    columns = [json_values(frame[column]) for column in frame.columns]
+    return [template % row for row in zip(*columns)]
+
+def encode_rows(frame: pd.DataFrame, format: str) -> bytes:
+    # One export chunk: CSV rows without header, or one JSON object per line
+    if format == "csv":
+        return frame.to_csv(index=False, header=False).encode()
+    if frame.empty:
+        return b""
+    # Same encoding as the raw JSON pages: NaN as null, floats in their shortest form
+    return "".join(row + "\n" for row in json_records(frame)).encode()
+
+def aggregate_arguments(group_by: Optional[List[str]], metrics: Optional[List[str]]):
+    # Defaults and validation of Database.aggregate's arguments
+    group_by = list(group_by or [])
+    metrics = list(metrics or AGGREGATE_METRICS)
+    unknown = [column for column in group_by if column not in GROUP_BY_COLUMNS]
+    if unknown:
+        raise ValueError(f"Cannot group by: {', '.join(unknown)}")
+    unknown = [metric for metric in metrics if metric not in AGGREGATE_METRICS]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {', '.join(unknown)}")
+    return group_by, metrics
+
+class TableVersion:
+    """
+    Immutable view of the booking table that readers work on.
+
+    Writers never change anything a published version can see: rows they
+    append lie beyond `row_count`, and everything else they modify is copied
+    first and published as a new version. Updated cells are not written into
+    the columns but kept in `patches`, {column: (sorted row positions, new
+    values)}, which every read applies on top of the columns, the indexes and
+    the sorted range arrays.
+    """
+
+    def __init__(self, df: pd.DataFrame, buffer: AppendBuffer,
+                 indexes: Dict[str, Dict[Any, np.ndarray]],
+                 index_tails: Dict[str, Dict[Any, List[int]]],
+                 id_positions: Dict[int, int],
+                 ranges: Dict[str, tuple],
+                 patches: Dict[str, tuple]):
+        self.df = df
+        self.main_len = len(df)
+        self.buffer_data = dict(buffer.data)
+        self.buffer_dtypes = buffer.dtypes
+        self.row_count = self.main_len + buffer.length
+        self.indexes = indexes
+        self.index_tails = index_tails
+        self.id_positions = id_positions
+        # Sorted arrays cover the main frame only, buffered rows are scanned
+        self.ranges = ranges
+        self.patches = patches
+
+    def position(self, booking_id: int) -> Optional[int]:
+        position = self.id_positions.get(booking_id)
+        # Bookings inserted after this version was published are not visible
+        if position is None or position >= self.row_count:
+            return None
+        return position
+
+    def staged(self, column: str) -> np.ndarray:
+        return self.buffer_data[column][:self.row_count - self.main_len]
+
+    def postings(self, column: str, value: Any) -> np.ndarray:
+        if isinstance(value, list):
+            # IN filter: union of the posting lists of every value
+            lists = [self.postings(column, item) for item in value]
+            return np.sort(np.concatenate(lists)) if lists else EMPTY_POSITIONS
+        postings = self.indexes[column].get(value, EMPTY_POSITIONS)
+        tail = self.index_tails[column].get(value)
+        if tail:
+            # Tails only grow at the end, so cut off rows appended after publishing
+            tail = tail[:bisect.bisect_left(tail, self.row_count)]
+        if tail:
+            return np.concatenate([postings, np.asarray(tail, dtype=np.int64)])
+        return postings
+
+    def range_positions(self, column: str, condition: Dict[str, Any]) -> np.ndarray:
+        # Binary search for the bounds, only the matching positions are touched
+        values, order = self.ranges[column]
+        low, high = condition.get("min"), condition.get("max")
+        start = 0 if low is None else np.searchsorted(values, low, side='left')
+        if high is not None:
+            end = np.searchsorted(values, high, side='right')
+        else:
+            end = np.searchsorted(values, np.inf, side='right') if values.dtype.kind == "f" else len(values)
+        in_main = np.sort(order[start:end])
+        in_buffer = np.flatnonzero(condition_mask(self.staged(column), condition)) + self.main_len
+        return np.concatenate([in_main, in_buffer]) if len(in_buffer) else in_main
+
+    def patched(self, column: str, condition: Any, found: np.ndarray,
+                within: Optional[np.ndarray] = None) -> np.ndarray:
+        # `found`, the sorted positions (among `within`, if given) whose stored value
+        # matches the condition, corrected for the cells of `column` updated since
+        if column not in self.patches:
+            return found
+        positions, values = self.patches[column]
+        if within is not None:
+            at = np.minimum(np.searchsorted(within, positions), max(len(within) - 1, 0))
+            keep = within[at] == positions if len(within) else np.zeros(len(positions), dtype=bool)
+            positions, values = positions[keep], values[keep]
+        found = remove_sorted(found, positions)
+        return insert_sorted(found, positions[condition_mask(values, condition)])
+
+    def intersect(self, left: np.ndarray, right: np.ndarray) -> np.ndarray:
+        small, large = (left, right) if len(left) <= len(right) else (right, left)
+        if len(small) * 32 < len(large):
+            # Few candidates: binary-search them in the larger sorted list
+            at = np.minimum(np.searchsorted(large, small), len(large) - 1)
+            return small[large[at] == small]
+        # Mark candidates in a bitmap instead of sorting both lists
+        mask = np.zeros(self.row_count, dtype=bool)
+        mask[small] = True
+        return large[mask[large]]
+
+    def filter_positions(self,
+                          filters: Dict[str, Any],
+                          after: int = -1,
+                          limit: Optional[int] = None) -> Optional[np.ndarray]:
+        # Returns the sorted positions after `after` matching all filters, or None for
+        # "every row". With a limit, scanning stops once `limit` matches were found.
+        active = {
+            key: value for key, value in (filters or {}).items()
+            if key in self.df.columns and value is not None
+        }
+        candidates = []
+        served = {'id'}
+        for key, value in active.items():
+            if key in self.indexes:
+                candidates.append(self.patched(key, value, self.postings(key, value)))
+            elif key in self.ranges and not isinstance(value, list):
+                # An exact value on a range column is the range [value, value]
+                condition = value if isinstance(value, dict) else {"min": value, "max": value}
+                candidates.append(self.patched(key, condition, self.range_positions(key, condition)))
+            else:
+                continue
+            served.add(key)
+        if 'id' in active:
+            position = self.position(active['id'])
+            candidates.append(EMPTY_POSITIONS if position is None else np.array([position], dtype=np.int64))
+
+        positions = None
+        # Intersect the smallest posting lists first
+        for postings in sorted(candidates, key=len):
+            positions = postings if positions is None else self.intersect(positions, postings)
+        if positions is not None and after >= 0:
+            positions = positions[np.searchsorted(positions, after, side='right'):]
+
+        # Columns without an index are only compared on the remaining candidates
+        scans = [(key, value) for key, value in active.items() if key not in served]
+        if not scans:
+            if limit is None:
+                return positions if positions is not None or after < 0 else np.arange(after + 1, self.row_count)
+            if positions is None:
+                return np.arange(after + 1, min(after + 1 + limit, self.row_count), dtype=np.int64)
+            return positions[:limit]
+
+        if limit is None:
+            if positions is None and after >= 0:
+                positions = np.arange(after + 1, self.row_count)
+            for key, value in scans:
+                positions = self.scan(key, value, positions)
+            return positions
+
+        # Scan in growing chunks until the requested number of rows matched
+        matched = []
+        found = 0
+        start = after + 1 if positions is None else 0
+        end = self.row_count if positions is None else len(positions)
+        chunk = max(limit * 4, 1024)
+        while found < limit and start < end:
+            if positions is None:
+                block = np.arange(start, min(start + chunk, end), dtype=np.int64)
+            else:
+                block = positions[start:start + chunk]
+            for key, value in scans:
+                block = self.scan(key, value, block)
+            matched.append(block)
+            found += len(block)
+            start += chunk
+            chunk *= 2
+        return np.concatenate(matched)[:limit] if matched else EMPTY_POSITIONS
+
+    def matches(self, key: str, value: Any, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        # Boolean mask of main-frame rows (all of them, or just `rows`) matching the condition
+        column = self.df[key]
+        if isinstance(column.dtype, pd.CategoricalDtype) and not isinstance(value, dict):
+            # Compare the small integer codes instead of the values themselves
+            codes = column.array.codes if rows is None else column.array.codes[rows]
+            wanted = column.cat.categories.get_indexer(value if isinstance(value, list) else [value])
+            return np.isin(codes, wanted[wanted >= 0])
+        return condition_mask(column if rows is None else column.take(rows), value)
+
+    def scan(self, key: str, value: Any, positions: Optional[np.ndarray]) -> np.ndarray:
+        main_len = self.main_len
+        staged = self.staged(key)
+        if positions is None:
+            in_main = np.flatnonzero(self.matches(key, value))
+            in_buffer = np.flatnonzero(condition_mask(staged, value)) + main_len
+        else:
+            split = np.searchsorted(positions, main_len)
+            in_main = positions[:split][self.matches(key, value, positions[:split])]
+            in_buffer = positions[split:][condition_mask(staged[positions[split:] - main_len], value)]
+        found = np.concatenate([in_main, in_buffer]) if len(in_buffer) else in_main
+        return self.patched(key, value, found, within=positions)
+
+    def take(self, positions: np.ndarray, columns: List[str]) -> pd.DataFrame:
+        # Rows below main_len come from the main frame, the rest from the buffer
+        main_len = self.main_len
+        split = np.searchsorted(positions, main_len)
+        frame = self.df.iloc[positions[:split], self.df.columns.get_indexer(columns)]
+        if split < len(positions):
+            staged = staged_frame(self.buffer_data, self.buffer_dtypes, positions[split:] - main_len, columns)
+            frame = staged if split == 0 else pd.concat([frame, staged], ignore_index=True)
+        for column in columns:
+            if column not in self.patches:
+                continue
+            patched, values = self.patches[column]
+            at = np.minimum(np.searchsorted(patched, positions), len(patched) - 1)
+            hit = patched[at] == positions
+            if hit.any():
+                frame[column] = set_cells(frame[column], np.flatnonzero(hit), values[at[hit]])
+        return frame
+
+    def ids(self, positions: np.ndarray) -> np.ndarray:
+        # Booking ids at sorted positions, without building a frame
+        split = np.searchsorted(positions, self.main_len)
+        in_main = self.df['id'].to_numpy()[positions[:split]]
+        in_buffer = self.buffer_data['id'][positions[split:] - self.main_len]
+        return np.concatenate([in_main, in_buffer]).astype(np.int64)
+
+    def patch(self, position: int, column: str) -> Optional[tuple]:
+        # (new value,) if the cell was updated since the last merge, else None
+        if column not in self.patches:
+            return None
+        positions, values = self.patches[column]
+        at = np.searchsorted(positions, position)
+        if at < len(positions) and positions[at] == position:
+            return (values[at],)
+        return None
+
+    def value(self, position: int, column: str) -> Any:
+        patch = self.patch(position, column)
+        if patch is not None:
+            return patch[0]
+        if position >= self.main_len:
+            return self.buffer_data[column][position - self.main_len]
+        return self.df[column].iat[position]
+
+    def row(self, position: int) -> Dict[str, Any]:
+        if position >= self.main_len:
+            row = position - self.main_len
+            values = {column: values[row:row + 1].tolist()[0] for column, values in self.buffer_data.items()}
+        else:
+            values = self.df.iloc[position].to_dict()
+        for column in self.patches:
+            patch = self.patch(position, column)
+            if patch is not None:
+                values[column] = patch[0]
+        return values
+
+# Background compaction only rewrites the snapshot once this many writes were logged
+COMPACT_MIN_RECORDS = 1000
 
 class Database:
-    def __init__(self, csv_path: str):
+    def __init__(self, csv_path: str, wal_dir: Optional[str] = None, compact_interval: float = 300.0):
         self.csv_path = csv_path
-        if os.path.exists(csv_path):
+        # Writers are serialized; each write is logged before it is acknowledged.
+        # Opened first, so no other process uses the log while the table loads.
+        self.lock = threading.RLock()
+        self.wal = WriteAheadLog(wal_dir) if wal_dir else None
+        # Prefer the newest compaction snapshot, then the memory-mapped columnar
+        # cache built with `python app/storage.py`, then the CSV
+        cached = load_snapshot(wal_dir) if wal_dir else None
+        if cached is None:
+            cached = load_columns(csv_path)
+        self.memory_usage: Dict[str, Optional[int]] = {"csv_bytes": None, "compact_bytes": 0}
+        # Last write-ahead log record already contained in the loaded table
+        self.snapshot_seq = 0
+        self.source = source_fingerprint(csv_path) if os.path.exists(csv_path) else None
+        if cached is not None:
+            # The cache is already stored with the compact schema
+            self.df, meta = cached
+            self.snapshot_seq = meta.get("wal_seq", 0)
+            self.source = meta.get("source")
+        elif os.path.exists(csv_path):
             self.df = pd.read_csv(csv_path)
+            self.memory_usage["csv_bytes"] = memory_footprint(self.df)
+            self.df = compact_frame(self.df)
+        else:
+            self.df = pd.DataFrame()
+        if not self.df.columns.empty and 'id' not in self.df.columns:
             # Add an internal index if not present
             self.df['id'] = range(len(self.df))
+        self.memory_usage["compact_bytes"] = memory_footprint(self.df)
+        logger.info("Booking table: %d rows, %s", len(self.df), format_footprint(self.memory_usage))
+        self._build_indexes()
+        self._build_ranges()
+        self._build_id_positions()
+        self.buffer = AppendBuffer(self.df.dtypes)
+        # {column: (sorted row positions, new values)} of the cells updated since the last merge
+        self.patches: Dict[str, tuple] = {}
+        # {(group_by, metrics, filters fingerprint): (table version, result)}
+        self.aggregate_cache: Dict[tuple, tuple] = {}
+        self.cache_lock = threading.Lock()
+        self._publish()
+        # Monotonic id counter, so inserts never have to scan the id column
+        self.next_id = int(self.df['id'].max()) + 1 if not self.df.empty else 0
+
+        self._stop = threading.Event()
+        if self.wal is not None:
+            self._replay()
+            self._compactor = threading.Thread(target=self._compact_periodically, args=(compact_interval,),
+                                               name="booking-compactor", daemon=True)
+            self._compactor.start()
+
+    def _replay(self):
+        # Re-apply the writes logged after the loaded snapshot
+        segments = self.wal.segments()
+        if segments and segments[0][0] > self.snapshot_seq + 1:
+            # The records in between were dropped after a snapshot that did not load
+            raise RuntimeError(f"Write-ahead log {self.wal.directory} starts at record {segments[0][0]}, "
+                               f"but the loaded table only contains records up to {self.snapshot_seq}")
+        replayed = 0
+        for _, record in self.wal.records(after_seq=self.snapshot_seq):
+            if record["op"] == "insert":
+                self._apply_insert(record["rows"])
+            elif record["op"] == "update":
+                self._apply_update(record["id"], record["data"])
+            replayed += 1
+        if replayed:
+            logger.info("Replayed %d write-ahead log records", replayed)
+
+    def _log(self, record: Dict[str, Any]) -> Optional[int]:
+        return self.wal.submit(record) if self.wal else None
+
+    def _wait_durable(self, seq: Optional[int]):
+        # Called without holding the lock, so concurrent writes share one fsync
+        if seq is not None:
+            self.wal.wait(seq)
+
+    @property
+    def row_count(self) -> int:
+        # Rows in the main frame followed by the rows still in the append buffer
+        return self.version.row_count
+
+    def _publish(self):
+        # Swapping the attribute is atomic: readers see either the old or the new version
+        self.version = TableVersion(self.df, self.buffer, self.indexes, self.index_tails, self.id_positions,
+                                    self.ranges, self.patches)
+        # Every write publishes a version, so cached aggregations are stale now
+        with self.cache_lock:
+            self.aggregate_cache.clear()
+
+    def _build_indexes(self):
+        # For each indexed column keep {value: sorted array of row positions}
+        self.indexes: Dict[str, Dict[Any, np.ndarray]] = {
+            column: self._column_index(column) for column in INDEXED_COLUMNS if column in self.df.columns
+        }
+        # {column: {value: sorted list of positions in the append buffer}}
+        self.index_tails: Dict[str, Dict[Any, List[int]]] = {column: {} for column in self.indexes}
+
+    def _column_index(self, column: str) -> Dict[Any, np.ndarray]:
+        groups = self.df.groupby(column, sort=False, observed=True).indices
+        return {value: np.asarray(positions, dtype=np.int64) for value, positions in groups.items()}
+
+    def _build_ranges(self, columns: Optional[set] = None):
+        # {column: (sorted values, row positions)} over the main frame; with `columns`
+        # only those are sorted again and the other arrays are kept
+        self.ranges: Dict[str, tuple] = {
+            column: sorted_column(self.df[column]) if columns is None or column in columns else self.ranges[column]
+            for column in RANGE_COLUMNS
+            if column in self.df.columns and self.df[column].dtype.kind in "iuf"
+        }
+
+    def _build_id_positions(self):
+        # Primary key map: booking id -> row position
+        ids = self.df['id'].tolist() if 'id' in self.df.columns else []
+        self.id_positions: Dict[int, int] = dict(zip(ids, range(len(ids))))
+
+    def _index_append(self, column: str, value: Any, position: int):
+        # New rows always have the highest position, so the tail stays sorted and
+        # published versions simply ignore the entries past their row count
+        if column in self.indexes and not pd.isna(value):
+            self.index_tails[column].setdefault(value, []).append(position)
+
+    def _decode_cursor(self, version: TableVersion, cursor: str, filters: Dict[str, Any]) -> int:
+        # Returns the row position the cursor resumes after
+        position = version.position(read_cursor(cursor, filters))
+        if position is None:
+            raise ValueError("Invalid page token")
+        return position
+
+    def get_bookings(self,
+                     filters: Dict[str, Any] = None,
+                     fields: List[str] = None,
+                     page: int = 1,
+                     size: int = 10,
+                     page_token: Optional[str] = None,
+                     include_total: bool = True) -> Dict[str, Any]:
+        paginated_df, result = self._page(filters, fields, page, size, page_token, include_total)
+        result["data"] = paginated_df.to_dict(orient='records')
+        return result
+
+    def get_bookings_json(self,
+                          filters: Dict[str, Any] = None,
+                          fields: List[str] = None,
+                          page: int = 1,
+                          size: int = 10,
+                          page_token: Optional[str] = None,
+                          include_total: bool = True) -> bytes:
+        """
+        Same page as get_bookings, but already encoded as a JSON response body.
+        The rows go straight from the columns to JSON (NaN becomes null, floats
+        are written as json.dumps would) without building a dict per row.
+        """
+        paginated_df, result = self._page(filters, fields, page, size, page_token, include_total)
+        data = "[" + ",".join(json_records(paginated_df)) + "]"
+        return b'{"data":' + data.encode() + b',' + json.dumps(result)[1:].encode()
+
+    def _page(self,
+              filters: Dict[str, Any],
+              fields: Optional[List[str]],
+              page: int,
+              size: int,
+              page_token: Optional[str],
+              include_total: bool):
+        # Returns the rows of the requested page and the pagination fields of the response,
+        # all read from one version even if concurrent writes publish a new one
+        version = self.version
+
+        # A page token resumes right after the last row of the previous page;
+        # without one we fall back to offset pagination using `page`
+        after = self._decode_cursor(version, page_token, filters) if page_token else -1
+        offset = 0 if page_token else (page - 1) * size
+
+        if include_total:
+            positions = version.filter_positions(filters)
+            total = version.row_count if positions is None else len(positions)
+            if positions is None:
+                start = after + 1 + offset
+                page_positions = np.arange(start, min(start + size, total), dtype=np.int64)
+                has_more = start + size < total
+            else:
+                start = np.searchsorted(positions, after, side='right') + offset
+                page_positions = positions[start:start + size]
+                has_more = start + size < total
         else:
-            self.df = pd.DataFrame()
+            # Skip the count: only look for one row past the end of this page
+            total = None
+            positions = version.filter_positions(filters, after=after, limit=offset + size + 1)
+            page_positions = positions[offset:offset + size]
+            has_more = len(positions) > offset + size
+
+        columns = self._columns(version, fields)
+
+        # Only the rows of the requested page are ever taken from the table
+        paginated_df = version.take(page_positions, columns)
 
-    def get_bookings(self, 
-                     filters: Dict[str, Any] = None, 
-                     fields: List[str] = None, 
-                     page: int = 1, 
-                     size: int = 10) -> Dict[str, Any]:
-        
-        filtered_df = self.df.copy()
-        
-        # Apply filters
-        if filters:
-            for key, value in filters.items():
-                if key in filtered_df.columns and value is not None:
-                    filtered_df = filtered_df[filtered_df[key] == value]
-        
-        total = len(filtered_df)
-        start = (page - 1) * size
-        end = start + size
-        
-        paginated_df = filtered_df.iloc[start:end]
-        
+        next_page_token = None
+        if has_more and len(page_positions):
+            last_id = version.value(int(page_positions[-1]), 'id')
+            next_page_token = encode_cursor(last_id, filters)
+
+        return paginated_df, {
+            "total": total,
+            "page": page,
+            "size": size,
+            "next_page_token": next_page_token
+        }
+
+    def _columns(self, version: TableVersion, fields: Optional[List[str]]) -> List[str]:
         # Select fields
+        columns = list(version.df.columns)
         if fields:
             # Ensure 'id' is always included or at least handle it
-            valid_fields = [f for f in fields if f in paginated_df.columns]
+            valid_fields = [f for f in fields if f in version.df.columns]
             if valid_fields:
-                paginated_df = paginated_df[valid_fields]
-        
-        data = paginated_df.to_dict(orient='records')
-        
-        next_page_token = str(page + 1) if end < total else None
-        
+                columns = valid_fields
+        return columns
+
+    def export(self,
+               filters: Dict[str, Any] = None,
+               fields: List[str] = None,
+               format: str = "ndjson",
+               chunk_size: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+        """
+        Stream every matching booking as NDJSON or CSV, `chunk_size` rows at a time.
+        Only one chunk of rows is materialized at once, and the whole export
+        reads a single table version even if bookings change meanwhile.
+        """
+        if format not in ("ndjson", "csv"):
+            raise ValueError(f"Unknown export format: {format}")
+        version = self.version
+        columns = self._columns(version, fields)
+        positions = version.filter_positions(filters)
+        total = version.row_count if positions is None else len(positions)
+
+        if format == "csv":
+            yield ",".join(columns).encode() + b"\n"
+        for start in range(0, total, chunk_size):
+            if positions is None:
+                chunk = np.arange(start, min(start + chunk_size, total), dtype=np.int64)
+            else:
+                chunk = positions[start:start + chunk_size]
+            yield encode_rows(version.take(chunk, columns), format)
+
+    def get_booking(self, booking_id: int) -> Optional[Dict[str, Any]]:
+        version = self.version
+        position = version.position(booking_id)
+        if position is None:
+            return None
+        return version.row(position)
+
+    def aggregate(self,
+                  group_by: List[str] = None,
+                  metrics: List[str] = None,
+                  filters: Dict[str, Any] = None) -> Dict[str, Any]:
+        group_by, metrics = aggregate_arguments(group_by, metrics)
+
+        version = self.version
+        key = (tuple(group_by), tuple(metrics), filters_fingerprint(filters))
+        with self.cache_lock:
+            cached = self.aggregate_cache.get(key)
+        # A result computed on an older version is never served
+        if cached is not None and cached[0] is version:
+            return cached[1]
+
+        result = self._aggregate(version, group_by, metrics, filters)
+        with self.cache_lock:
+            if len(self.aggregate_cache) >= AGGREGATE_CACHE_SIZE:
+                self.aggregate_cache.pop(next(iter(self.aggregate_cache)))
+            self.aggregate_cache[key] = (version, result)
+        return result
+
+    def _aggregate(self, version: TableVersion, group_by: List[str], metrics: List[str],
+                   filters: Dict[str, Any]) -> Dict[str, Any]:
+        positions = version.filter_positions(filters)
+        if positions is None:
+            positions = np.arange(version.row_count, dtype=np.int64)
+
+        # Only the group keys and the columns the metrics need are taken
+        needed = set(group_by) | {AGGREGATE_METRICS[metric][0] for metric in metrics}
+        if "nights" in needed:
+            needed = (needed - {"nights"}) | {"stays_in_weekend_nights", "stays_in_week_nights"}
+        missing = needed - set(version.df.columns)
+        if missing:
+            raise ValueError(f"Missing columns: {', '.join(sorted(missing))}")
+        frame = version.take(positions, sorted(needed))
+        if "stays_in_week_nights" in needed:
+            frame["nights"] = frame["stays_in_weekend_nights"] + frame["stays_in_week_nights"]
+
+        # Without group_by everything falls into a single group
+        keys = group_by or np.zeros(len(frame), dtype=np.int8)
+        grouped = frame.groupby(keys, observed=True, sort=True)
+        result = grouped.agg(**{metric: AGGREGATE_METRICS[metric] for metric in metrics})
+        if group_by:
+            result = result.reset_index()
+        # NaN (e.g. the mean adr of a group without any adr) is returned as null
+        result = result.astype(object).where(result.notna(), None)
+
         return {
-            "data": data,
-            "total": total,
-            "page": page,
-            "size": size,
-            "next_page_token": next_page_token
+            "group_by": group_by,
+            "total": len(positions),
+            "groups": result.to_dict(orient='records')
         }
 
     def add_booking(self, booking_data: Dict[str, Any]) -> Dict[str, Any]:
-        new_id = self.df['id'].max() + 1 if not self.df.empty else 0
-        booking_data['id'] = new_id
-        new_row = pd.DataFrame([booking_data])
-        self.df = pd.concat([self.df, new_row], ignore_index=True)
-        return booking_data
+        return self.add_bookings([booking_data])[0]
+
+    def add_bookings(self, bookings: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        with self.lock:
+            self._apply_insert(bookings)
+            seq = self._log({"op": "insert", "rows": bookings})
+        self._wait_durable(seq)
+        return bookings
+
+    def _apply_insert(self, bookings: List[Dict[str, Any]]):
+        # Rows replayed from the write-ahead log already carry their id
+        if self.df.columns.empty:
+            self._bootstrap(bookings)
+            return
+
+        for booking_data in bookings:
+            if booking_data.get('id') is None:
+                booking_data['id'] = self.next_id
+            self.next_id = max(self.next_id, booking_data['id'] + 1)
+            position = len(self.df) + self.buffer.append(booking_data)
+            for column in self.indexes:
+                self._index_append(column, booking_data.get(column), position)
+            self.id_positions[booking_data['id']] = position
+
+        if self.buffer.length >= max(MERGE_MIN_ROWS, len(self.df) // 8):
+            self._merge_buffer()
+        self._publish()
+
+    def _bootstrap(self, bookings: List[Dict[str, Any]]):
+        # First rows of an empty database define its columns
+        for booking_data in bookings:
+            if booking_data.get('id') is None:
+                booking_data['id'] = self.next_id
+            self.next_id = max(self.next_id, booking_data['id'] + 1)
+        self.df = pd.DataFrame(bookings)
+        self._build_indexes()
+        self._build_ranges()
+        self._build_id_positions()
+        self.buffer = AppendBuffer(self.df.dtypes)
+        self._publish()
+
+    def _merge_buffer(self):
+        # One concat per batch keeps inserts amortized O(1), and each updated
+        # column is copied once per batch of updates instead of once per update
+        if not self.buffer.length and not self.patches:
+            return
+        sort = set()
+        if self.buffer.length:
+            staged = self.buffer.frame(np.arange(self.buffer.length), list(self.df.columns))
+            df = self.df.copy(deep=False)
+            for column in staged.columns:
+                if isinstance(df[column].dtype, pd.CategoricalDtype):
+                    df[column] = with_categories(df[column], staged[column].dropna().unique())
+                    staged[column] = staged[column].astype(df[column].dtype)
+            self.df = pd.concat([df, staged], ignore_index=True)
+            # Fold the tails into new posting arrays; published versions keep the old ones
+            self.indexes = {
+                column: {
+                    value: np.concatenate([postings.get(value, EMPTY_POSITIONS),
+                                           np.asarray(self.index_tails[column].get(value, []), dtype=np.int64)])
+                    for value in set(postings) | set(self.index_tails[column])
+                }
+                for column, postings in self.indexes.items()
+            }
+            self.index_tails = {column: {} for column in self.indexes}
+            self.buffer = AppendBuffer(self.buffer.dtypes)
+            sort = set(self.ranges)
+        if self.patches:
+            # Every row is in the main frame now, write the updated cells into copies of their columns
+            df = self.df.copy(deep=False)
+            for column, (positions, values) in self.patches.items():
+                df[column] = set_cells(df[column], positions, values)
+            self.df = df
+            self.indexes = {**self.indexes, **{column: self._column_index(column)
+                                               for column in self.patches if column in self.indexes}}
+            sort |= set(self.patches)
+            self.patches = {}
+        self._build_ranges(sort)
 
     def update_booking(self, booking_id: int, booking_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
-        if booking_id not in self.df['id'].values:
-            return None
-        
-        idx = self.df.index[self.df['id'] == booking_id].tolist()[0]
-        for key, value in booking_data.items():
-            if key in self.df.columns and value is not None:
-                self.df.at[idx, key] = value
-        
-        return self.df.iloc[idx].to_dict()
+        with self.lock:
+            if not self._apply_update(booking_id, booking_data):
+                return None
+            changes = {key: value for key, value in booking_data.items() if value is not None}
+            seq = self._log({"op": "update", "id": booking_id, "data": changes})
+            updated = self.get_booking(booking_id)
+        self._wait_durable(seq)
+        return updated
+
+    def _apply_update(self, booking_id: int, booking_data: Dict[str, Any]) -> bool:
+        idx = self.id_positions.get(booking_id)
+        if idx is None:
+            return False
+
+        # The id is the primary key and cannot be changed
+        changes = {
+            key: value for key, value in booking_data.items()
+            if key in self.df.columns and key != 'id' and value is not None
+        }
+        # Only the overlay is copied, its size does not depend on the table's
+        for key, value in changes.items():
+            self._patch(key, idx, value)
+        limit = max(PATCH_MAX_CELLS, len(self.df) // 64)
+        if any(len(self.patches[key][0]) >= limit for key in changes):
+            self._merge_buffer()
+        self._publish()
+        return True
+
+    def _patch(self, column: str, position: int, value: Any):
+        # Copy-on-write: published versions keep the arrays they were given
+        positions, values = self.patches.get(column, (EMPTY_POSITIONS, EMPTY_VALUES))
+        at = int(np.searchsorted(positions, position))
+        if at < len(positions) and positions[at] == position:
+            values = values.copy()
+            values[at] = value
+        else:
+            positions = np.insert(positions, at, position)
+            values = np.insert(values, at, None)
+            values[at] = value
+        self.patches = {**self.patches, column: (positions, values)}
+
+    def compact(self):
+        """
+        Write the current table as a new snapshot (in the columnar cache format)
+        in the write-ahead log directory and drop the log segments it covers.
+        Snapshots are never replaced in place: the new one is complete and
+        fsynced before the older snapshots and the segments are deleted.
+        """
+        if self.wal is None:
+            return
+        with self.lock:
+            self._merge_buffer()
+            self._publish()
+            seq = self.wal.rotate()
+            # Writers never modify a published frame, so no copy is needed
+            frame = self.df
+        existing = snapshots(self.wal.directory)
+        if existing and existing[-1] == snapshot_dir(self.wal.directory, seq):
+            # Nothing was written since the last snapshot
+            return
+        target = snapshot_dir(self.wal.directory, seq)
+        write_columns(frame, target, {
+            "source": self.source,
+            "wal_seq": seq,
+            "memory_usage": {"csv_bytes": None, "compact_bytes": memory_footprint(frame)},
+        })
+        sync_directory(target)
+        for old in existing:
+            shutil.rmtree(old, ignore_errors=True)
+        self.snapshot_seq = seq
+        self.wal.drop_until(seq)
+        logger.info("Compacted %d bookings into %s", len(frame), target)
+
+    def _compact_periodically(self, interval: float):
+        while not self._stop.wait(interval):
+            if self.wal.pending_since(self.snapshot_seq) < COMPACT_MIN_RECORDS:
+                continue
+            try:
+                self.compact()
+            except Exception:
+                logger.exception("Compaction failed")
+
+    def close(self):
+        # Stop compaction and flush the write-ahead log
+        self._stop.set()
+        if self.wal is not None:
+            self._compactor.join()
+            self.wal.close()
 
 # Initialize database
-CSV_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "hotel_bookings.csv")
-db = Database(CSV_PATH)
+# BOOKING_CSV serves another data set, e.g. synthetic bookings in a benchmark
+CSV_PATH = os.getenv("BOOKING_CSV", os.path.join(os.path.dirname(__file__), "..", "data", "hotel_bookings.csv"))
+WAL_DIR = os.path.splitext(CSV_PATH)[0] + ".wal"
+# BOOKING_SHARDS=4 splits the bookings over 4 worker processes (see sharding.py)
+SHARDS = int(os.getenv("BOOKING_SHARDS", "1"))
+PARTITION = os.getenv("BOOKING_PARTITION", "hotel")
+
+def open_database():
+    if SHARDS > 1:
+        from sharding import ShardedDatabase
+        return ShardedDatabase(CSV_PATH, shards=SHARDS, partition=PARTITION)
+    return Database(CSV_PATH, wal_dir=WAL_DIR)
+
+def __getattr__(name: str):
+    # `db` is created on first import, so shard worker processes and scripts can
+    # import this module without loading the default data set
+    if name == "db":
+        global db
+        db = open_database()
+        return db
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -5,21 +5,39 @@ import sys
 
 # Add the current directory to sys.path to allow running from within the 'app' folder or the 'fastapi' folder
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# The repository root holds the observability package shared by all apps
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
 
+from contextlib import asynccontextmanager
 from routers import bookings
+import database
+from observability import instrument
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The database is opened here and not on import: with BOOKING_SHARDS every
+    # shard process imports this module again while it starts
+    db = database.db
+    yield
+    # Flush the write-ahead log before the process exits
+    db.close()
 
 app = FastAPI(
     title="Hotel Booking API Tutorial",
     description="A simple FastAPI using Pydantic models to structure request and response",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Include routers
 app.include_router(bookings.router)
 
+# Latency, in-flight and payload size metrics at /metrics, plus the slow request log
+instrument(app)
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Hotel Booking API Tutorial. Go to /docs for API documentation."}
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "8080")))
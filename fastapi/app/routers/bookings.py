@@ -1,48 +1,141 @@
-from fastapi import APIRouter, Query, HTTPException, Body
+from fastapi import APIRouter, Query, HTTPException, Body, Depends
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, Response
 from typing import List, Optional, Dict, Any
-from schemas.booking import Booking, BookingCreate, BookingUpdate, PaginatedBookingResponse
-from database import db
+from schemas.booking import Booking, BookingCreate, BookingUpdate, PaginatedBookingResponse, BulkBookingResponse, AggregateResponse
+# database.db is looked up on every request, so importing the router never opens the database
+import database
+from observability import annotate
 
 router = APIRouter(
     prefix="/bookings",
     tags=["bookings"],
 )
 
-@router.get("/", response_model=PaginatedBookingResponse)
-async def get_bookings(
-    page: int = Query(1, ge=1),
-    size: int = Query(10, ge=1, le=100),
+RANGE_HELP = "Range as min..max (inclusive, either side may be left out) or a single value"
+
+def parse_range(name: str, text: str) -> Dict[str, float]:
+    # "10..50" -> {"min": 10, "max": 50}, "..50" -> {"max": 50}, "7" -> {"min": 7, "max": 7}
+    low, separator, high = text.partition("..")
+    if not separator:
+        high = low
+    try:
+        return {
+            key: float(value) for key, value in (("min", low), ("max", high)) if value.strip()
+        }
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid range for {name}: {text}")
+
+def booking_filters(
     hotel: Optional[str] = None,
     is_canceled: Optional[int] = None,
-    fields: Optional[str] = Query(None, description="Comma separated list of fields to return")
-):
+    country: Optional[str] = Query(None, description="Comma separated list of country codes, e.g. PRT,GBR"),
+    lead_time: Optional[str] = Query(None, description=RANGE_HELP),
+    adr: Optional[str] = Query(None, description=RANGE_HELP),
+    arrival_date_year: Optional[str] = Query(None, description=RANGE_HELP),
+    arrival_date_week_number: Optional[str] = Query(None, description=RANGE_HELP)
+) -> Dict[str, Any]:
     filters = {}
     if hotel:
         filters["hotel"] = hotel
     if is_canceled is not None:
         filters["is_canceled"] = is_canceled
-        
+    if country:
+        filters["country"] = country.split(",")
+    ranges = {
+        "lead_time": lead_time,
+        "adr": adr,
+        "arrival_date_year": arrival_date_year,
+        "arrival_date_week_number": arrival_date_week_number,
+    }
+    for name, text in ranges.items():
+        if text:
+            filters[name] = parse_range(name, text)
+    return filters
+
+@router.get("/", response_model=PaginatedBookingResponse)
+async def get_bookings(
+    page: int = Query(1, ge=1),
+    size: int = Query(10, ge=1, le=100),
+    filters: Dict[str, Any] = Depends(booking_filters),
+    fields: Optional[str] = Query(None, description="Comma separated list of fields to return"),
+    page_token: Optional[str] = Query(None, description="next_page_token from the previous page, takes precedence over page"),
+    include_total: bool = Query(True, description="Set to false to skip counting all matching bookings"),
+    raw: bool = Query(False, description="Return the JSON encoded by the database directly, without re-validating every row")
+):
     requested_fields = fields.split(",") if fields else None
+    annotate(filters=filters, fields=requested_fields, page=page, size=size, page_token=bool(page_token))
     
-    result = db.get_bookings(filters=filters, fields=requested_fields, page=page, size=size)
+    # Database calls are blocking (pandas work, WAL fsync), keep them off the event loop
+    try:
+        if raw:
+            # Fast path for large pages: the body is already valid JSON in the response shape
+            body = await run_in_threadpool(database.db.get_bookings_json, filters=filters, fields=requested_fields,
+                                           page=page, size=size, page_token=page_token, include_total=include_total)
+            return Response(content=body, media_type="application/json")
+        result = await run_in_threadpool(database.db.get_bookings, filters=filters, fields=requested_fields,
+                                         page=page, size=size, page_token=page_token, include_total=include_total)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return result
 
+@router.get("/aggregate", response_model=AggregateResponse)
+async def aggregate_bookings(
+    group_by: Optional[str] = Query(None, description="Comma separated list of columns to group by, e.g. hotel,market_segment"),
+    metrics: Optional[str] = Query(None, description="Comma separated subset of count, adr_sum, adr_mean, adr_count, canceled, cancellation_rate, total_nights"),
+    filters: Dict[str, Any] = Depends(booking_filters)
+):
+    annotate(filters=filters, group_by=group_by, metrics=metrics)
+    try:
+        result = await run_in_threadpool(database.db.aggregate,
+                                         group_by=group_by.split(",") if group_by else None,
+                                         metrics=metrics.split(",") if metrics else None,
+                                         filters=filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return result
+
+@router.get("/export")
+async def export_bookings(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$", description="ndjson (one JSON object per line) or csv"),
+    fields: Optional[str] = Query(None, description="Comma separated list of fields to export"),
+    filters: Dict[str, Any] = Depends(booking_filters)
+):
+    annotate(filters=filters, fields=fields, format=format)
+    # Rows are streamed in chunks as they are serialized, never collected into one response
+    rows = database.db.export(filters=filters, fields=fields.split(",") if fields else None, format=format)
+    if format == "csv":
+        return StreamingResponse(rows, media_type="text/csv",
+                                 headers={"Content-Disposition": "attachment; filename=bookings.csv"})
+    return StreamingResponse(rows, media_type="application/x-ndjson")
+
 @router.post("/", response_model=Booking)
 async def create_booking(booking: BookingCreate):
-    new_booking = db.add_booking(booking.model_dump())
+    new_booking = await run_in_threadpool(database.db.add_booking, booking.model_dump())
     return new_booking
 
+@router.post("/bulk", response_model=BulkBookingResponse)
+async def create_bookings(bookings: List[BookingCreate] = Body(..., max_length=10000)):
+    # All bookings are validated by FastAPI before any of them is inserted
+    new_bookings = await run_in_threadpool(database.db.add_bookings, [booking.model_dump() for booking in bookings])
+    return {"inserted": len(new_bookings), "ids": [booking["id"] for booking in new_bookings]}
+
 @router.put("/{booking_id}", response_model=Booking)
 async def update_booking(booking_id: int, booking: BookingUpdate):
-    updated_booking = db.update_booking(booking_id, booking.model_dump(exclude_unset=True))
+    try:
+        updated_booking = await run_in_threadpool(database.db.update_booking, booking_id,
+                                                  booking.model_dump(exclude_unset=True))
+    except ValueError as e:
+        # e.g. moving a booking to another hotel while the table is sharded by hotel
+        raise HTTPException(status_code=400, detail=str(e))
     if not updated_booking:
         raise HTTPException(status_code=404, detail="Booking not found")
     return updated_booking
 
 @router.get("/{booking_id}", response_model=Booking)
 async def get_booking(booking_id: int):
-    # This is a bit inefficient with our simple DB but works for the tutorial
-    result = db.get_bookings(filters={"id": booking_id}, size=1)
-    if not result["data"]:
+    # Point lookup through the id -> row position map
+    booking = await run_in_threadpool(database.db.get_booking, booking_id)
+    if booking is None:
         raise HTTPException(status_code=404, detail="Booking not found")
-    return result["data"][0]
+    return booking
@@ -81,7 +81,16 @@ class Booking(BookingBase):
 
 class PaginatedBookingResponse(BaseModel):
     data: List[dict]
-    total: int
+    total: Optional[int] = None
     page: int
     size: int
     next_page_token: Optional[str] = None
+
+class BulkBookingResponse(BaseModel):
+    inserted: int
+    ids: List[int]
+
+class AggregateResponse(BaseModel):
+    group_by: List[str]
+    total: int
+    groups: List[dict]
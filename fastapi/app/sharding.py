@@ -0,0 +1,404 @@
+import os
+import json
+import zlib
+import shutil
+import logging
+import threading
+import multiprocessing
+from typing import List, Dict, Any, Optional, Iterator, Tuple
+
+import numpy as np
+import pandas as pd
+
+from database import (Database, TableVersion, EXPORT_CHUNK_ROWS, aggregate_arguments, encode_cursor,
+                      read_cursor, encode_rows, json_records)
+from storage import load_columns, compact_frame, write_columns, cache_dir_for, source_fingerprint
+
+logger = logging.getLogger(__name__)
+
+PARTITIONS = ("hotel", "id")
+
+# Every shard computes these additive metrics; the public ones are derived from them
+PARTIAL_METRICS = ["count", "adr_sum", "adr_count", "canceled", "total_nights"]
+
+LAYOUT_FILE = "shards.json"
+
+
+def shard_of_hotel(hotel: Any, shards: int) -> int:
+    # crc32 instead of hash(), which differs between processes
+    return zlib.crc32(str(hotel).encode()) % shards
+
+
+def shard_of_id(booking_id: int, shards: int) -> int:
+    return int(booking_id) % shards
+
+
+# --- Worker side: one Database per process, answering requests from a pipe ---
+
+def first_position_after(version: TableVersion, after_id: int) -> int:
+    # Ids grow with the row position inside a shard, so the position is found by binary search
+    main_ids = version.df['id'].to_numpy()
+    position = int(np.searchsorted(main_ids, after_id, side='right'))
+    if position < version.main_len:
+        return position
+    return version.main_len + int(np.searchsorted(version.staged('id'), after_id, side='right'))
+
+
+def shard_ids(db: Database, filters: Dict[str, Any], after_id: Optional[int], limit: Optional[int],
+              include_total: bool) -> Tuple[np.ndarray, Optional[int]]:
+    # Ids of up to `limit` matching bookings after `after_id`, and the number of matches
+    version = db.version
+    start = 0 if after_id is None else first_position_after(version, after_id)
+    if limit is None:
+        limit = version.row_count
+    total = None
+    if include_total:
+        positions = version.filter_positions(filters)
+        total = version.row_count if positions is None else len(positions)
+        if positions is None:
+            selected = np.arange(start, min(start + limit, total), dtype=np.int64)
+        else:
+            at = np.searchsorted(positions, start)
+            selected = positions[at:at + limit]
+    else:
+        selected = version.filter_positions(filters, after=start - 1, limit=limit)
+    return version.ids(selected), total
+
+
+def shard_rows(db: Database, ids: np.ndarray, columns: List[str]) -> pd.DataFrame:
+    version = db.version
+    positions = np.array([version.position(int(booking_id)) for booking_id in ids], dtype=np.int64)
+    return version.take(positions, columns)
+
+
+SHARD_CALLS = {
+    "ids": shard_ids,
+    "rows": shard_rows,
+    "columns": lambda db: list(db.version.df.columns),
+    "next_id": lambda db: db.next_id,
+    "get_booking": Database.get_booking,
+    "add_bookings": Database.add_bookings,
+    "update_booking": Database.update_booking,
+    "aggregate": Database.aggregate,
+}
+
+
+def serve(connection, csv_path: str, wal_dir: Optional[str]):
+    # Entry point of a shard process; requests are (name, args, kwargs), None stops the worker
+    db = Database(csv_path, wal_dir=wal_dir)
+    connection.send(("ok", None))
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        name, args, kwargs = request
+        try:
+            reply = ("ok", SHARD_CALLS[name](db, *args, **kwargs))
+        except Exception as e:
+            reply = ("error", e)
+        connection.send(reply)
+    db.close()
+    connection.close()
+
+
+# --- Coordinator side ---
+
+class ShardedDatabase:
+    """
+    The booking table split over worker processes, each running its own Database
+    on one partition (by hotel or by booking id). It has the same methods as
+    Database: queries are sent to every shard at once and the partial results
+    are merged here, so responses and page tokens look exactly the same.
+
+    Every shard answers from its own table version, so a query running while
+    bookings are written may see the write on one shard and not yet on another.
+    """
+
+    def __init__(self, csv_path: str, shards: int = 4, partition: str = "hotel", durable: bool = True,
+                 shard_dir: Optional[str] = None):
+        if partition not in PARTITIONS:
+            raise ValueError(f"Unknown partition: {partition}, use one of {', '.join(PARTITIONS)}")
+        self.shards = shards
+        self.partition = partition
+        self.shard_dir = shard_dir or os.path.splitext(csv_path)[0] + ".shards"
+        paths = self._prepare(csv_path)
+
+        context = multiprocessing.get_context("spawn")
+        self.connections = []
+        self.processes = []
+        # One request at a time per shard; always taken in shard order, so callers never deadlock
+        self.locks = [threading.Lock() for _ in paths]
+        for i, path in enumerate(paths):
+            wal_dir = os.path.join(os.path.dirname(path), "hotel_bookings.wal") if durable else None
+            parent, child = context.Pipe()
+            process = context.Process(target=serve, args=(child, path, wal_dir),
+                                      name=f"booking-shard-{i}", daemon=True)
+            process.start()
+            child.close()
+            self.connections.append(parent)
+            self.processes.append(process)
+        for connection in self.connections:
+            self._receive(connection)
+
+        self.columns = self._scatter("columns")[0]
+        # Ids are assigned here, so they stay unique and increasing across shards
+        self.lock = threading.Lock()
+        self.next_id = max(self._scatter("next_id"))
+        logger.info("Booking table split into %d shards by %s", shards, partition)
+
+    def _prepare(self, csv_path: str) -> List[str]:
+        """
+        Write each partition in the columnar cache format under shard_dir. The
+        shards are reused (with the writes logged since) as long as the source
+        and the layout did not change.
+        """
+        paths = [os.path.join(self.shard_dir, f"shard-{i}", "hotel_bookings.csv") for i in range(self.shards)]
+        source = source_fingerprint(csv_path) if os.path.exists(csv_path) else None
+        layout = {"source": source, "shards": self.shards, "partition": self.partition}
+        layout_path = os.path.join(self.shard_dir, LAYOUT_FILE)
+        if os.path.exists(layout_path):
+            with open(layout_path) as f:
+                if json.load(f) == layout:
+                    return paths
+            logger.warning("Shard layout changed, rebuilding %s; writes kept in the old shards are dropped",
+                           self.shard_dir)
+            shutil.rmtree(self.shard_dir)
+
+        cached = load_columns(csv_path)
+        if cached is not None:
+            frame = cached[0]
+        elif os.path.exists(csv_path):
+            frame = compact_frame(pd.read_csv(csv_path))
+        else:
+            raise FileNotFoundError(csv_path)
+        if 'id' not in frame.columns:
+            frame['id'] = range(len(frame))
+
+        owners = self._owners(frame)
+        for i, path in enumerate(paths):
+            part = frame[owners == i].reset_index(drop=True)
+            write_columns(part, cache_dir_for(path), {"source": None})
+            logger.info("Shard %d: %d bookings", i, len(part))
+        os.makedirs(self.shard_dir, exist_ok=True)
+        with open(layout_path, "w") as f:
+            json.dump(layout, f)
+        return paths
+
+    def _owners(self, frame: pd.DataFrame) -> np.ndarray:
+        # Shard number of every row
+        if self.partition == "id":
+            return frame['id'].to_numpy() % self.shards
+        hotels = frame['hotel'].astype(object)
+        shard_of = {hotel: shard_of_hotel(hotel, self.shards) for hotel in hotels.dropna().unique()}
+        return hotels.map(shard_of).fillna(0).to_numpy(dtype=np.int64)
+
+    def _shard_for(self, booking: Dict[str, Any]) -> int:
+        if self.partition == "id":
+            return shard_of_id(booking['id'], self.shards)
+        if booking.get('hotel') is None:
+            return 0
+        return shard_of_hotel(booking['hotel'], self.shards)
+
+    @staticmethod
+    def _receive(connection) -> Any:
+        status, value = connection.recv()
+        if status == "error":
+            raise value
+        return value
+
+    def _request(self, requests: Dict[int, tuple]) -> Dict[int, Any]:
+        # {shard: (name, args)} -> {shard: reply}. All requests are sent before
+        # any reply is read, so the shards work on them in parallel.
+        order = sorted(requests)
+        for i in order:
+            self.locks[i].acquire()
+        try:
+            for i in order:
+                name, args = requests[i]
+                self.connections[i].send((name, args, {}))
+            replies = {i: self.connections[i].recv() for i in order}
+        finally:
+            for i in order:
+                self.locks[i].release()
+        for status, value in replies.values():
+            if status == "error":
+                raise value
+        return {i: value for i, (_, value) in replies.items()}
+
+    def _scatter(self, name: str, *args) -> List[Any]:
+        replies = self._request({i: (name, args) for i in range(self.shards)})
+        return [replies[i] for i in range(self.shards)]
+
+    def _columns(self, fields: Optional[List[str]]) -> List[str]:
+        # Same field selection as Database._columns
+        columns = list(self.columns)
+        if fields:
+            valid_fields = [f for f in fields if f in self.columns]
+            if valid_fields:
+                columns = valid_fields
+        return columns
+
+    def _matching_ids(self, filters: Dict[str, Any], after_id: Optional[int], limit: Optional[int],
+                      include_total: bool):
+        # Merge the ids each shard found into one ascending list, remembering their shard
+        replies = self._scatter("ids", filters, after_id, limit, include_total)
+        ids = np.concatenate([found for found, _ in replies])
+        owners = np.concatenate([np.full(len(found), i, dtype=np.int64)
+                                 for i, (found, _) in enumerate(replies)])
+        order = np.argsort(ids, kind="stable")
+        total = sum(count for _, count in replies) if include_total else None
+        return ids[order], owners[order], total
+
+    def _rows(self, ids: np.ndarray, owners: np.ndarray, columns: List[str]) -> pd.DataFrame:
+        # Fetch the rows from their shards and put them back in id order
+        requests = {int(i): ("rows", (ids[owners == i], columns)) for i in np.unique(owners)}
+        if not requests:
+            return pd.DataFrame(columns=columns)
+        frames = self._request(requests)
+        frame = pd.concat([frames[i] for i in sorted(frames)], ignore_index=True)
+        arrived = np.argsort(owners, kind="stable")
+        return frame.iloc[np.argsort(arrived)].reset_index(drop=True)
+
+    def get_bookings(self,
+                     filters: Dict[str, Any] = None,
+                     fields: List[str] = None,
+                     page: int = 1,
+                     size: int = 10,
+                     page_token: Optional[str] = None,
+                     include_total: bool = True) -> Dict[str, Any]:
+        paginated_df, result = self._page(filters, fields, page, size, page_token, include_total)
+        result["data"] = paginated_df.to_dict(orient='records')
+        return result
+
+    def get_bookings_json(self,
+                          filters: Dict[str, Any] = None,
+                          fields: List[str] = None,
+                          page: int = 1,
+                          size: int = 10,
+                          page_token: Optional[str] = None,
+                          include_total: bool = True) -> bytes:
+        paginated_df, result = self._page(filters, fields, page, size, page_token, include_total)
+        data = "[" + ",".join(json_records(paginated_df)) + "]"
+        return b'{"data":' + data.encode() + b',' + json.dumps(result)[1:].encode()
+
+    def _page(self,
+              filters: Dict[str, Any],
+              fields: Optional[List[str]],
+              page: int,
+              size: int,
+              page_token: Optional[str],
+              include_total: bool):
+        # Each shard returns the first offset + size + 1 matching ids, enough to
+        # cut the page out of the merged list and to know if another one follows
+        after_id = read_cursor(page_token, filters) if page_token else None
+        offset = 0 if page_token else (page - 1) * size
+        ids, owners, total = self._matching_ids(filters, after_id, offset + size + 1, include_total)
+        page_ids, page_owners = ids[offset:offset + size], owners[offset:offset + size]
+        has_more = len(ids) > offset + size
+
+        paginated_df = self._rows(page_ids, page_owners, self._columns(fields))
+
+        next_page_token = None
+        if has_more and len(page_ids):
+            next_page_token = encode_cursor(page_ids[-1], filters)
+
+        return paginated_df, {
+            "total": total,
+            "page": page,
+            "size": size,
+            "next_page_token": next_page_token
+        }
+
+    def export(self,
+               filters: Dict[str, Any] = None,
+               fields: List[str] = None,
+               format: str = "ndjson",
+               chunk_size: int = EXPORT_CHUNK_ROWS) -> Iterator[bytes]:
+        # Like Database.export; the matching ids are collected first, rows are fetched per chunk
+        if format not in ("ndjson", "csv"):
+            raise ValueError(f"Unknown export format: {format}")
+        columns = self._columns(fields)
+        ids, owners, _ = self._matching_ids(filters, None, None, False)
+
+        if format == "csv":
+            yield ",".join(columns).encode() + b"\n"
+        for start in range(0, len(ids), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            yield encode_rows(self._rows(ids[chunk], owners[chunk], columns), format)
+
+    def _owner(self, booking_id: int) -> Optional[Tuple[int, Dict[str, Any]]]:
+        # (shard, row) of a booking
+        if self.partition == "id":
+            shard = shard_of_id(booking_id, self.shards)
+            row = self._request({shard: ("get_booking", (booking_id,))})[shard]
+            return None if row is None else (shard, row)
+        # By hotel, the booking id does not tell which shard has it
+        for shard, row in enumerate(self._scatter("get_booking", booking_id)):
+            if row is not None:
+                return shard, row
+        return None
+
+    def get_booking(self, booking_id: int) -> Optional[Dict[str, Any]]:
+        found = self._owner(booking_id)
+        return None if found is None else found[1]
+
+    def aggregate(self,
+                  group_by: List[str] = None,
+                  metrics: List[str] = None,
+                  filters: Dict[str, Any] = None) -> Dict[str, Any]:
+        group_by, metrics = aggregate_arguments(group_by, metrics)
+        replies = self._scatter("aggregate", group_by, PARTIAL_METRICS, filters)
+        rows = [group for reply in replies for group in reply["groups"]]
+
+        groups = []
+        if rows:
+            # Sum the shards' partial results per group, then derive the averages
+            frame = pd.DataFrame(rows, columns=group_by + PARTIAL_METRICS)
+            if group_by:
+                frame = frame.groupby(group_by, sort=True).sum().reset_index()
+            else:
+                frame = frame.sum().to_frame().T
+            frame["adr_mean"] = frame["adr_sum"] / frame["adr_count"].where(frame["adr_count"] > 0)
+            frame["cancellation_rate"] = frame["canceled"] / frame["count"]
+            frame = frame[group_by + metrics]
+            groups = frame.astype(object).where(frame.notna(), None).to_dict(orient='records')
+
+        return {
+            "group_by": group_by,
+            "total": sum(reply["total"] for reply in replies),
+            "groups": groups
+        }
+
+    def add_booking(self, booking_data: Dict[str, Any]) -> Dict[str, Any]:
+        return self.add_bookings([booking_data])[0]
+
+    def add_bookings(self, bookings: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        batches: Dict[int, List[Dict[str, Any]]] = {}
+        # Held until the shards got the rows, so every shard receives ids in increasing order
+        with self.lock:
+            for booking_data in bookings:
+                if booking_data.get('id') is None:
+                    booking_data['id'] = self.next_id
+                self.next_id = max(self.next_id, booking_data['id'] + 1)
+                batches.setdefault(self._shard_for(booking_data), []).append(booking_data)
+            self._request({shard: ("add_bookings", (rows,)) for shard, rows in batches.items()})
+        return bookings
+
+    def update_booking(self, booking_id: int, booking_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        found = self._owner(booking_id)
+        if found is None:
+            return None
+        shard, row = found
+        hotel = booking_data.get('hotel')
+        if self.partition == "hotel" and hotel is not None and hotel != row['hotel']:
+            raise ValueError("The hotel of a booking cannot be changed while bookings are sharded by hotel")
+        return self._request({shard: ("update_booking", (booking_id, booking_data))})[shard]
+
+    def close(self):
+        # Workers flush their write-ahead logs before they exit
+        for lock, connection in zip(self.locks, self.connections):
+            with lock:
+                connection.send(None)
+                connection.close()
+        for process in self.processes:
+            process.join()
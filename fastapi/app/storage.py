@@ -0,0 +1,208 @@
+import pandas as pd
+import numpy as np
+import os
+import sys
+import json
+import shutil
+import logging
+import typing
+from typing import Dict, List, Optional, Tuple
+from schemas.booking import BookingBase
+
+logger = logging.getLogger(__name__)
+
+# Bump when the on-disk layout changes so old caches are rebuilt
+FORMAT_VERSION = 2
+META_FILE = "meta.json"
+
+
+def booking_schema() -> Dict[str, type]:
+    # Column -> python type declared on BookingBase (Optional[...] unwrapped)
+    schema = {}
+    for name, field in BookingBase.model_fields.items():
+        args = [arg for arg in typing.get_args(field.annotation) if arg is not type(None)]
+        schema[name] = args[0] if args else field.annotation
+    return schema
+
+
+def compact_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Shrink the booking table: text fields become categoricals (they only have a
+    handful of distinct values) and integer fields use the narrowest int type.
+    """
+    for name, kind in booking_schema().items():
+        if name not in df.columns:
+            continue
+        if kind is str:
+            df[name] = df[name].astype("category")
+        elif kind is int and df[name].notna().all():
+            df[name] = pd.to_numeric(df[name], downcast="integer")
+    return df
+
+
+def memory_footprint(df: pd.DataFrame) -> int:
+    return int(df.memory_usage(deep=True).sum())
+
+
+def format_footprint(usage: Dict[str, Optional[int]]) -> str:
+    compact = f"{usage['compact_bytes'] / 2**20:.1f} MiB in memory"
+    if usage.get("csv_bytes"):
+        return f"{compact} ({usage['csv_bytes'] / 2**20:.1f} MiB with plain CSV dtypes)"
+    return compact
+
+
+def cache_dir_for(csv_path: str) -> str:
+    # data/hotel_bookings.csv -> data/hotel_bookings.columns/
+    return os.path.splitext(csv_path)[0] + ".columns"
+
+
+def source_fingerprint(csv_path: str) -> dict:
+    stat = os.stat(csv_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def write_columns(df: pd.DataFrame, cache_dir: str, meta: dict):
+    """
+    Write a frame as one .npy file per column. Numeric columns are stored
+    as-is, categorical and text columns as integer codes plus a dictionary of
+    distinct values kept in meta.json next to `meta`.
+    """
+    tmp_dir = cache_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    columns = []
+    for position, (name, series) in enumerate(df.items()):
+        file_name = f"{position:03d}.npy"
+        if isinstance(series.dtype, np.dtype) and series.dtype.kind in "biuf":
+            np.save(os.path.join(tmp_dir, file_name), series.to_numpy())
+            columns.append({"name": name, "file": file_name, "kind": "numeric"})
+        elif isinstance(series.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(tmp_dir, file_name), series.array.codes)
+            columns.append({"name": name, "file": file_name, "kind": "category",
+                            "values": series.cat.categories.tolist()})
+        else:
+            codes, uniques = pd.factorize(series)
+            np.save(os.path.join(tmp_dir, file_name), codes.astype(np.int32))
+            columns.append({"name": name, "file": file_name, "kind": "dictionary",
+                            "values": [str(value) for value in uniques]})
+
+    meta = dict(meta, version=FORMAT_VERSION, rows=len(df), columns=columns)
+    with open(os.path.join(tmp_dir, META_FILE), "w") as f:
+        json.dump(meta, f)
+        f.flush()
+        os.fsync(f.fileno())
+
+    # Swap the finished cache in so readers never see a half written one
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+
+
+def convert_csv(csv_path: str, cache_dir: Optional[str] = None) -> str:
+    # One-time conversion of the CSV into the compact columnar cache
+    cache_dir = cache_dir or cache_dir_for(csv_path)
+    df = pd.read_csv(csv_path)
+    csv_bytes = memory_footprint(df)
+    df = compact_frame(df)
+    write_columns(df, cache_dir, {
+        "source": source_fingerprint(csv_path),
+        "memory_usage": {"csv_bytes": csv_bytes, "compact_bytes": memory_footprint(df)},
+    })
+    return cache_dir
+
+
+def load_columns(csv_path: str, cache_dir: Optional[str] = None) -> Optional[Tuple[pd.DataFrame, dict]]:
+    """
+    Load the columnar cache with numeric columns and category codes
+    memory-mapped read-only, so every worker process shares the same pages.
+    Returns (frame, meta), or None when there is no cache or the CSV changed
+    since it was built.
+    """
+    cache_dir = cache_dir or cache_dir_for(csv_path)
+    meta_path = os.path.join(cache_dir, META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+
+    if meta.get("version") != FORMAT_VERSION:
+        logger.warning("Columnar cache %s has an old format, reading the CSV instead", cache_dir)
+        return None
+    # Without the CSV the cache is the only copy of the data, so trust it
+    if os.path.exists(csv_path) and meta["source"] != source_fingerprint(csv_path):
+        logger.warning("Columnar cache %s is stale, reading the CSV instead", cache_dir)
+        return None
+
+    return read_columns(cache_dir, meta)
+
+
+def read_columns(cache_dir: str, meta: dict) -> Tuple[pd.DataFrame, dict]:
+    data = {}
+    for column in meta["columns"]:
+        values = np.load(os.path.join(cache_dir, column["file"]), mmap_mode="r")
+        if column["kind"] == "category":
+            # The codes stay memory-mapped, only the distinct values are loaded
+            values = pd.Series(pd.Categorical.from_codes(values, categories=column["values"], validate=False))
+        elif column["kind"] == "dictionary":
+            # Text columns are decoded into process memory; code -1 is a missing value
+            lookup = np.array(column["values"] + [None], dtype=object)
+            values = pd.Series(lookup[values])
+        data[column["name"]] = values
+    # copy=False keeps the numeric columns backed by the memory map
+    return pd.DataFrame(data, copy=False), meta
+
+
+def sync_directory(directory: str):
+    # fsync every file of a written directory, the directory and its parent (for
+    # the rename), before anything it replaces (e.g. write-ahead log segments) is deleted
+    for name in os.listdir(directory):
+        with open(os.path.join(directory, name), "rb") as f:
+            os.fsync(f.fileno())
+    for path in (directory, os.path.dirname(os.path.abspath(directory))):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+SNAPSHOT_PREFIX = "snapshot-"
+
+
+def snapshot_dir(directory: str, wal_seq: int) -> str:
+    return os.path.join(directory, f"{SNAPSHOT_PREFIX}{wal_seq:020d}")
+
+
+def snapshots(directory: str) -> List[str]:
+    # Finished snapshot directories, oldest first; ".tmp" ones were interrupted
+    if not os.path.isdir(directory):
+        return []
+    names = sorted(name for name in os.listdir(directory)
+                   if name.startswith(SNAPSHOT_PREFIX) and not name.endswith(".tmp"))
+    return [os.path.join(directory, name) for name in names]
+
+
+def load_snapshot(directory: str) -> Optional[Tuple[pd.DataFrame, dict]]:
+    """
+    Load the newest snapshot written by compaction into `directory` (the
+    write-ahead log directory). Unlike the columnar cache a snapshot is never
+    stale: it is the only copy of the writes whose log segments were dropped.
+    """
+    found = snapshots(directory)
+    if not found:
+        return None
+    with open(os.path.join(found[-1], META_FILE)) as f:
+        meta = json.load(f)
+    if meta.get("version") != FORMAT_VERSION:
+        raise RuntimeError(f"Snapshot {found[-1]} has an unsupported format version {meta.get('version')}")
+    return read_columns(found[-1], meta)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    default_csv = os.path.join(os.path.dirname(__file__), "..", "data", "hotel_bookings.csv")
+    source = sys.argv[1] if len(sys.argv) > 1 else default_csv
+    cache = convert_csv(source)
+    with open(os.path.join(cache, META_FILE)) as f:
+        usage = json.load(f)["memory_usage"]
+    logger.info("Columnar cache written to %s: %s", cache, format_footprint(usage))
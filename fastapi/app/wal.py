@@ -0,0 +1,173 @@
+import os
+import json
+import fcntl
+import time
+import logging
+import threading
+from typing import Any, Dict, Iterator, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = ".log"
+LOCK_FILE = "LOCK"
+
+
+class WriteAheadLog:
+    """
+    Append-only log of booking writes, stored as JSON lines in numbered segment files.
+
+    Writers `submit` a record and then `wait` for it: a background thread writes
+    everything submitted in the meantime and fsyncs once for the whole batch
+    (group commit), so concurrent writers share the cost of a single fsync.
+
+    Only one process may use a directory at a time: opening one that another
+    process holds raises RuntimeError. So with the log on, the server runs as a
+    single process (`uvicorn --workers N` fails from the second worker on);
+    BOOKING_SHARDS spreads the table over several processes, each shard with its own log.
+    """
+
+    def __init__(self, directory: str, commit_delay: float = 0.002):
+        self.directory = directory
+        self.commit_delay = commit_delay
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = self._lock(directory)
+
+        # An empty newest segment (right after compaction) still marks where the numbering continues
+        segments = self.segments()
+        last_seq = segments[-1][0] - 1 if segments else 0
+        for _, record in self.records():
+            last_seq = max(last_seq, record["seq"])
+        self._next_seq = last_seq + 1
+        self._durable_seq = last_seq
+        self._pending: List[Tuple[int, bytes]] = []
+        self._error = None
+        self._closed = False
+        self._cond = threading.Condition()
+        # Never append to an old segment, its tail may be a torn write
+        self._segment = self._open_segment(self._next_seq)
+
+        self._thread = threading.Thread(target=self._run, name="booking-wal", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _lock(directory: str):
+        # Released by the OS when the process exits, so a crash never leaves a stale lock
+        lock_file = open(os.path.join(directory, LOCK_FILE), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            raise RuntimeError(f"Write-ahead log {directory} is in use by another process. The booking server "
+                               f"runs as one process per data folder, use BOOKING_SHARDS to run several")
+        return lock_file
+
+    def _segment_path(self, start_seq: int) -> str:
+        return os.path.join(self.directory, f"{start_seq:020d}{SEGMENT_SUFFIX}")
+
+    def _open_segment(self, start_seq: int):
+        return open(self._segment_path(start_seq), "ab")
+
+    def segments(self) -> List[Tuple[int, str]]:
+        # (first seq, path) of every segment, oldest first
+        found = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SEGMENT_SUFFIX):
+                found.append((int(name[:-len(SEGMENT_SUFFIX)]), os.path.join(self.directory, name)))
+        return sorted(found)
+
+    def records(self, after_seq: int = 0) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        for _, path in self.segments():
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A crash in the middle of a write leaves a partial last line
+                        logger.warning("Ignoring torn record at the end of %s", path)
+                        break
+                    if record["seq"] > after_seq:
+                        yield record["seq"], record
+
+    def submit(self, record: Dict[str, Any]) -> int:
+        # Queue a record and return its sequence number, without waiting for the disk
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Write-ahead log is closed")
+            seq = self._next_seq
+            self._next_seq += 1
+            line = json.dumps(dict(record, seq=seq), default=str) + "\n"
+            self._pending.append((seq, line.encode()))
+            self._cond.notify_all()
+        return seq
+
+    def wait(self, seq: int):
+        # Block until the record `seq` has been fsynced
+        with self._cond:
+            while self._durable_seq < seq and self._error is None:
+                self._cond.wait()
+            if self._error is not None:
+                raise RuntimeError("Write-ahead log failed") from self._error
+
+    def append(self, record: Dict[str, Any]) -> int:
+        seq = self.submit(record)
+        self.wait(seq)
+        return seq
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+            # Give concurrent writers a moment to join this batch
+            time.sleep(self.commit_delay)
+            with self._cond:
+                batch, self._pending = self._pending, []
+                segment = self._segment
+            try:
+                segment.write(b"".join(line for _, line in batch))
+                segment.flush()
+                os.fsync(segment.fileno())
+            except OSError as e:
+                logger.error("Write-ahead log write failed: %s", e)
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                self._durable_seq = batch[-1][0]
+                self._cond.notify_all()
+
+    def rotate(self) -> int:
+        """
+        Start a new segment and return the last sequence number of the old ones.
+        The caller must stop submitting while this runs.
+        """
+        with self._cond:
+            while self._durable_seq < self._next_seq - 1 and self._error is None:
+                self._cond.wait()
+            last_seq = self._next_seq - 1
+            self._segment.close()
+            self._segment = self._open_segment(self._next_seq)
+        return last_seq
+
+    def drop_until(self, seq: int):
+        # Delete segments whose records are all covered by a snapshot up to `seq`
+        segments = self.segments()
+        for (start, path), (next_start, _) in zip(segments, segments[1:]):
+            if next_start <= seq + 1:
+                os.remove(path)
+
+    def pending_since(self, seq: int) -> int:
+        # Number of records submitted after `seq`
+        with self._cond:
+            return self._next_seq - 1 - seq
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self._segment.close()
+        self._lock_file.close()
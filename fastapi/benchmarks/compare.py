@@ -0,0 +1,58 @@
+"""
+Compare two result files written by benchmarks/suite.py.
+
+Usage: python benchmarks/compare.py baseline.json candidate.json [--threshold 10]
+
+Prints p50/p99 latency and throughput changes per workload and marks changes
+beyond the threshold (in percent). Exits with status 1 if any workload got slower.
+"""
+import argparse
+import json
+import sys
+from typing import Any, Dict, Tuple
+
+
+def load(path: str) -> Tuple[Dict[str, Any], Dict[tuple, Dict[str, Any]]]:
+    with open(path) as f:
+        report = json.load(f)
+    results = {(result["rows"], result["mode"], result["workload"]): result for result in report["results"]}
+    return report.get("environment", {}), results
+
+
+def change(before: float, after: float) -> float:
+    # Relative change in percent
+    return (after - before) / before * 100 if before else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Percent change reported as a regression")
+    args = parser.parse_args()
+
+    baseline_env, baseline = load(args.baseline)
+    candidate_env, candidate = load(args.candidate)
+    print(f"baseline {baseline_env.get('commit')}  candidate {candidate_env.get('commit')}")
+    print(f"{'rows':>9} {'mode':>10} {'workload':>16} {'p50':>9} {'p99':>9} {'ops/s':>9}")
+
+    regressions = 0
+    for key in sorted(set(baseline) & set(candidate)):
+        before, after = baseline[key], candidate[key]
+        p50 = change(before["p50_ms"], after["p50_ms"])
+        p99 = change(before["p99_ms"], after["p99_ms"])
+        throughput = change(before["throughput_ops_s"], after["throughput_ops_s"])
+        slower = p50 > args.threshold or throughput < -args.threshold
+        regressions += slower
+        rows, mode, workload = key
+        print(f"{rows:>9} {mode:>10} {workload:>16} {p50:>+8.1f}% {p99:>+8.1f}% {throughput:>+8.1f}%"
+              f"{'  <- slower' if slower else ''}")
+
+    missing = set(baseline) ^ set(candidate)
+    if missing:
+        print(f"{len(missing)} workloads only appear in one of the files")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
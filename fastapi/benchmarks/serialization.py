@@ -0,0 +1,74 @@
+"""
+Compare the two ways GET /bookings/ can serialize a page:
+
+- default: Database.get_bookings builds a dict per row, FastAPI validates the
+  page with PaginatedBookingResponse and encodes it
+- raw: Database.get_bookings_json encodes the columns straight to JSON bytes
+
+Both pages must decode to the same bookings; the script stops if they do not.
+
+Usage: python benchmarks/serialization.py [--rows 100000] [--sizes 10,100,1000,10000]
+"""
+import argparse
+import json
+import statistics
+import tempfile
+import time
+
+from synthetic import write_csv
+
+import database
+from database import Database
+from schemas.booking import PaginatedBookingResponse
+
+
+def timed(function, repeat: int) -> float:
+    # Median wall time of `function` in milliseconds
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--sizes", default="10,100,1000,10000")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(write_csv(args.rows, directory))
+
+        print(f"In process, {args.rows} bookings (median ms per page)")
+        print(f"{'size':>8} {'default':>10} {'raw':>10} {'speedup':>8}")
+        for size in [int(size) for size in args.sizes.split(",")]:
+            def default():
+                page = PaginatedBookingResponse.model_validate(db.get_bookings(size=size, page=2))
+                return page.model_dump_json()
+
+            def raw():
+                return db.get_bookings_json(size=size, page=2)
+
+            # Same values, floats included, before anything is timed
+            if json.loads(default()) != json.loads(raw()):
+                raise SystemExit(f"size {size}: the raw page does not decode to the default page")
+            default_ms, raw_ms = timed(default, args.repeat), timed(raw, args.repeat)
+            print(f"{size:>8} {default_ms:>10.2f} {raw_ms:>10.2f} {default_ms / raw_ms:>7.1f}x")
+
+        # Through the app (routing, response model, HTTP encoding), where size is capped at 100
+        database.db = db
+        from fastapi.testclient import TestClient
+        import main as app_main
+        client = TestClient(app_main.app)
+        default_ms = timed(lambda: client.get("/bookings/?size=100&page=2"), args.repeat)
+        raw_ms = timed(lambda: client.get("/bookings/?size=100&page=2&raw=true"), args.repeat)
+        print(f"\nGET /bookings/?size=100 through the app (median ms per request)")
+        print(f"{'default':>10} {'raw':>10} {'speedup':>8}")
+        print(f"{default_ms:>10.2f} {raw_ms:>10.2f} {default_ms / raw_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Check that the sharded booking store answers exactly like the single Database.
+
+Both stores are opened on the same synthetic bookings; the sharded one runs
+its shards as local worker processes. Every query (filters, offset and cursor
+pagination, exports, aggregations, point lookups) is sent to both and the
+responses are compared, then the same inserts and updates are applied to both
+and the queries are compared again. Prints the latency of each store per query
+type and exits with status 1 on any mismatch.
+
+Finally the server is started the way the tutorial does it,
+`BOOKING_SHARDS=<shards> python app/main.py`, on the synthetic bookings, and
+must answer a page, an insert and an update before it is stopped again.
+
+Usage: python benchmarks/sharding.py [--rows 100000] [--shards 4] [--partitions hotel,id] [--queries 100]
+"""
+import argparse
+import json
+import math
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+from synthetic import APP_DIR, CHOICES, booking_records, write_columns_cache
+
+from database import Database, AGGREGATE_METRICS
+from sharding import ShardedDatabase
+
+
+class Harness:
+    def __init__(self, single: Database, sharded: ShardedDatabase, seed: int = 0):
+        self.single = single
+        self.sharded = sharded
+        self.rng = np.random.default_rng(seed)
+        self.timings: Dict[str, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(list))
+        self.checks = 0
+        self.mismatches: List[str] = []
+
+    def compare(self, name: str, call: Callable[[Any], Any], same: Callable[[Any, Any], bool] = None):
+        results = []
+        for label, db in (("single", self.single), ("sharded", self.sharded)):
+            start = time.perf_counter()
+            results.append(call(db))
+            self.timings[name][label].append(time.perf_counter() - start)
+        expected, actual = results
+        self.checks += 1
+        if not (same or same_json)(expected, actual):
+            self.mismatches.append(f"{name}: expected {str(expected)[:300]} got {str(actual)[:300]}")
+        return expected
+
+    def filters(self) -> Dict[str, Any]:
+        # A random mix of equality, IN, range and scanned filters (or none at all)
+        options = [
+            ("hotel", lambda: str(self.rng.choice(CHOICES["hotel"]))),
+            ("is_canceled", lambda: int(self.rng.integers(0, 2))),
+            ("country", lambda: [str(c) for c in self.rng.choice(CHOICES["country"], 3, replace=False)]),
+            ("lead_time", lambda: {"min": int(self.rng.integers(0, 600)), "max": int(self.rng.integers(600, 700))}),
+            ("adr", lambda: {"min": float(self.rng.uniform(0, 100))}),
+            ("meal", lambda: str(self.rng.choice(CHOICES["meal"]))),
+        ]
+        chosen = self.rng.choice(len(options), int(self.rng.integers(0, 3)), replace=False)
+        return {options[i][0]: options[i][1]() for i in chosen}
+
+    def queries(self, count: int):
+        for _ in range(count):
+            filters = self.filters()
+            size = int(self.rng.choice([1, 10, 100]))
+            page = int(self.rng.integers(1, 20))
+            include_total = bool(self.rng.integers(0, 2))
+            fields = ["id", "hotel", "adr", "children"] if self.rng.random() < 0.3 else None
+            self.compare("offset_page", lambda db: db.get_bookings(filters=filters, fields=fields, page=page,
+                                                                   size=size, include_total=include_total))
+            self.compare("raw_page", lambda db: db.get_bookings_json(filters=filters, page=page, size=size),
+                         same=lambda a, b: a == b)
+
+            # Follow the page tokens of both stores for a few pages
+            token = None
+            for _ in range(3):
+                result = self.compare("cursor_page", lambda db: db.get_bookings(
+                    filters=filters, size=size, page_token=token, include_total=include_total))
+                token = result["next_page_token"]
+                if token is None:
+                    break
+
+            group_by = [str(c) for c in self.rng.choice(["hotel", "meal", "is_canceled", "arrival_date_year"],
+                                                       int(self.rng.integers(0, 3)), replace=False)]
+            self.compare("aggregate", lambda db: db.aggregate(group_by=group_by, metrics=list(AGGREGATE_METRICS),
+                                                              filters=filters), same=same_aggregate)
+
+            booking_id = int(self.rng.integers(0, self.single.next_id + 10))
+            self.compare("point_lookup", lambda db: db.get_booking(booking_id))
+
+        for filters in ({}, {"hotel": "Resort Hotel", "adr": {"min": 150.0}}):
+            self.compare("export", lambda db: b"".join(db.export(filters=filters, format="ndjson", chunk_size=7000)),
+                         same=lambda a, b: a == b)
+
+    def writes(self, count: int):
+        # The same writes go to both stores, the responses must match as well
+        for booking in booking_records(count, seed=7):
+            self.compare("insert", lambda db: db.add_booking(dict(booking)))
+        for _ in range(count):
+            booking_id = int(self.rng.integers(0, self.single.next_id))
+            changes = {"adr": round(float(self.rng.uniform(20, 300)), 2), "lead_time": int(self.rng.integers(0, 700)),
+                       "meal": str(self.rng.choice(CHOICES["meal"]))}
+            self.compare("update", lambda db: db.update_booking(booking_id, changes))
+
+
+def same_json(expected: Any, actual: Any) -> bool:
+    # NaN never equals itself, compare the serialized form instead
+    return json.dumps(expected, default=str) == json.dumps(actual, default=str)
+
+
+def same_aggregate(expected: Dict[str, Any], actual: Dict[str, Any]) -> bool:
+    # Floating point sums depend on the order rows are added in
+    if expected["total"] != actual["total"] or len(expected["groups"]) != len(actual["groups"]):
+        return False
+    for left, right in zip(expected["groups"], actual["groups"]):
+        if left.keys() != right.keys():
+            return False
+        for key, value in left.items():
+            other = right[key]
+            if isinstance(value, float) and isinstance(other, float):
+                if not math.isclose(value, other, rel_tol=1e-9, abs_tol=1e-9):
+                    return False
+            elif value != other:
+                return False
+    return True
+
+
+def print_timings(partition: str, timings: Dict[str, Dict[str, List[float]]]):
+    print(f"{'partition':>9} {'query':>12} {'single p50 ms':>14} {'sharded p50 ms':>15}")
+    for name, samples in timings.items():
+        print(f"{partition:>9} {name:>12} {np.percentile(samples['single'], 50) * 1000:>14.3f} "
+              f"{np.percentile(samples['sharded'], 50) * 1000:>15.3f}")
+
+
+def request(url: str, method: str = "GET", body: Any = None) -> Any:
+    data = None if body is None else json.dumps(body).encode()
+    call = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(call, timeout=30) as response:
+        return json.loads(response.read())
+
+
+def check_server(rows: int, shards: int, timeout: float = 120.0) -> List[str]:
+    # Start `python app/main.py` with BOOKING_SHARDS and return what went wrong
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    base = f"http://127.0.0.1:{port}/bookings"
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, BOOKING_SHARDS=str(shards), BOOKING_CSV=write_columns_cache(rows, directory),
+                   PORT=str(port))
+        server = subprocess.Popen([sys.executable, os.path.join(APP_DIR, "main.py")], env=env,
+                                  stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        problems = []
+        try:
+            deadline = time.monotonic() + timeout
+            page = None
+            while page is None and server.poll() is None and time.monotonic() < deadline:
+                try:
+                    page = request(f"{base}/?size=5")
+                except (urllib.error.URLError, ConnectionError):
+                    time.sleep(0.2)
+            if page is None:
+                problems.append(f"server did not answer (exit code {server.poll()})")
+            else:
+                if page["total"] != rows or len(page["data"]) != 5:
+                    problems.append(f"first page: total {page['total']}, {len(page['data'])} rows")
+                booking = {key: value for key, value in booking_records(1, seed=11)[0].items() if key != "id"}
+                created = request(f"{base}/", "POST", booking)
+                updated = request(f"{base}/{created['id']}", "PUT", {"adr": 123.45})
+                if request(f"{base}/{created['id']}") != updated or updated["adr"] != 123.45:
+                    problems.append(f"insert and update: got {updated}")
+        except (urllib.error.URLError, ConnectionError, KeyError) as e:
+            problems.append(f"request failed: {e}")
+        finally:
+            # Stopped like Ctrl+C, so the shards flush their logs and exit
+            server.send_signal(signal.SIGINT)
+            try:
+                output, _ = server.communicate(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                output, _ = server.communicate()
+        if problems or "Traceback" in output:
+            problems.append("server output:\n" + output[-3000:])
+        return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--partitions", default="hotel,id")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--writes", type=int, default=200)
+    args = parser.parse_args()
+
+    failed = False
+    for partition in args.partitions.split(","):
+        with tempfile.TemporaryDirectory() as directory:
+            path = write_columns_cache(args.rows, directory)
+            single = Database(path)
+            sharded = ShardedDatabase(path, shards=args.shards, partition=partition, durable=False,
+                                      shard_dir=os.path.join(directory, "shards"))
+            harness = Harness(single, sharded)
+            harness.queries(args.queries)
+            harness.writes(args.writes)
+            harness.queries(args.queries)
+            sharded.close()
+            single.close()
+
+        print_timings(partition, harness.timings)
+        print(f"{partition}: {harness.checks} checks, {len(harness.mismatches)} mismatches")
+        for mismatch in harness.mismatches[:10]:
+            print("  " + mismatch)
+        failed = failed or bool(harness.mismatches)
+
+    problems = check_server(min(args.rows, 10_000), args.shards)
+    print(f"BOOKING_SHARDS={args.shards} python app/main.py: {'OK' if not problems else 'FAILED'}")
+    for problem in problems:
+        print("  " + problem)
+    failed = failed or bool(problems)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
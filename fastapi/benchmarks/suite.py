@@ -0,0 +1,244 @@
+"""
+Benchmark suite for the booking database and API.
+
+For every table size it loads synthetic bookings and runs each workload
+(filter, paginate, point lookup, insert, update) both in process, by calling
+Database directly, and through the app with an in-process ASGI client. It
+prints a summary and writes the latency percentiles and throughput as JSON,
+which benchmarks/compare.py can diff between two commits.
+
+Usage: python benchmarks/suite.py [--rows 10000,100000,1000000] [--ops 500] [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+
+from synthetic import CHOICES, booking_records, write_columns_cache
+
+from database import Database
+
+WORKLOADS = ["filter_equality", "filter_range", "paginate_offset", "paginate_cursor",
+             "point_lookup", "insert", "update"]
+
+
+class Workloads:
+    """Builds the parameters of each operation, the same ones for both modes."""
+
+    def __init__(self, rows: int, ops: int, seed: int = 0):
+        self.rows = rows
+        self.rng = np.random.default_rng(seed)
+        self.new_bookings = booking_records(ops, seed + 1)
+        self.cursor = None
+
+    def equality(self) -> Dict[str, Any]:
+        return {"hotel": str(self.rng.choice(CHOICES["hotel"])), "is_canceled": int(self.rng.integers(0, 2))}
+
+    def range(self) -> Dict[str, Any]:
+        low = int(self.rng.integers(0, 650))
+        countries = [str(country) for country in self.rng.choice(CHOICES["country"], 3, replace=False)]
+        return {"lead_time": {"min": low, "max": low + 20}, "country": countries}
+
+    def page(self) -> int:
+        return int(self.rng.integers(1, max(2, min(self.rows // 100, 1000))))
+
+    def booking_id(self) -> int:
+        return int(self.rng.integers(0, self.rows))
+
+    def changes(self) -> Dict[str, Any]:
+        return {"adr": round(float(self.rng.uniform(20, 300)), 2), "lead_time": int(self.rng.integers(0, 700))}
+
+
+def in_process_operations(db: Database, work: Workloads) -> Dict[str, Callable[[], Any]]:
+    def cursor_page():
+        result = db.get_bookings(size=100, page_token=work.cursor, include_total=False)
+        work.cursor = result["next_page_token"]
+
+    return {
+        "filter_equality": lambda: db.get_bookings(filters=work.equality(), size=10),
+        "filter_range": lambda: db.get_bookings(filters=work.range(), size=10),
+        "paginate_offset": lambda: db.get_bookings(page=work.page(), size=100),
+        "paginate_cursor": cursor_page,
+        "point_lookup": lambda: db.get_booking(work.booking_id()),
+        "insert": lambda: db.add_booking(dict(work.new_bookings.pop())),
+        "update": lambda: db.update_booking(work.booking_id(), work.changes()),
+    }
+
+
+def asgi_operations(client, work: Workloads) -> Dict[str, Callable[[], Any]]:
+    def query(filters: Dict[str, Any]) -> Dict[str, Any]:
+        # Filters in the query string grammar of GET /bookings/
+        params = {}
+        for key, value in filters.items():
+            if isinstance(value, dict):
+                params[key] = f"{value['min']}..{value['max']}"
+            elif isinstance(value, list):
+                params[key] = ",".join(value)
+            else:
+                params[key] = value
+        return params
+
+    async def check(response):
+        response = await response
+        if response.status_code != 200:
+            raise RuntimeError(f"{response.request.url} returned {response.status_code}: {response.text[:200]}")
+        return response
+
+    async def cursor_page():
+        params = {"size": 100, "include_total": "false"}
+        if work.cursor:
+            params["page_token"] = work.cursor
+        response = await check(client.get("/bookings/", params=params))
+        work.cursor = response.json()["next_page_token"]
+
+    return {
+        "filter_equality": lambda: check(client.get("/bookings/", params=dict(query(work.equality()), size=10))),
+        "filter_range": lambda: check(client.get("/bookings/", params=dict(query(work.range()), size=10))),
+        "paginate_offset": lambda: check(client.get("/bookings/", params={"page": work.page(), "size": 100})),
+        "paginate_cursor": cursor_page,
+        "point_lookup": lambda: check(client.get(f"/bookings/{work.booking_id()}")),
+        "insert": lambda: check(client.post("/bookings/", json=work.new_bookings.pop())),
+        "update": lambda: check(client.put(f"/bookings/{work.booking_id()}", json=work.changes())),
+    }
+
+
+def summarize(samples: List[float], elapsed: float) -> Dict[str, float]:
+    latencies = np.array(samples) * 1000
+    return {
+        "ops": len(samples),
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p90_ms": float(np.percentile(latencies, 90)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "max_ms": float(latencies.max()),
+        "throughput_ops_s": len(samples) / elapsed,
+    }
+
+
+def run_in_process(operation: Callable[[], Any], ops: int, warmup: int) -> Dict[str, float]:
+    for _ in range(warmup):
+        operation()
+    samples = []
+    started = time.perf_counter()
+    for _ in range(ops):
+        start = time.perf_counter()
+        operation()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples, time.perf_counter() - started)
+
+
+async def run_asgi(operation: Callable[[], Any], ops: int, warmup: int, concurrency: int) -> Dict[str, float]:
+    for _ in range(warmup):
+        await operation()
+    samples = []
+    remaining = iter(range(ops))
+
+    async def worker():
+        # Each worker sends one request at a time until all operations were sent
+        for _ in remaining:
+            start = time.perf_counter()
+            await operation()
+            samples.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(samples, time.perf_counter() - started)
+
+
+def open_database(rows: int, directory: str, wal: bool) -> Database:
+    path = write_columns_cache(rows, directory)
+    wal_dir = os.path.join(directory, "hotel_bookings.wal") if wal else None
+    return Database(path, wal_dir=wal_dir)
+
+
+async def benchmark_asgi(db: Database, rows: int, args) -> List[Dict[str, Any]]:
+    import httpx
+    import database
+    # Set before main is imported, so the app serves the benchmark table and never opens the default data set
+    database.db = db
+    import main as app_main
+
+    transport = httpx.ASGITransport(app=app_main.app)
+    results = []
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        work = Workloads(rows, args.ops + args.warmup, seed=2)
+        operations = asgi_operations(client, work)
+        for name in args.workloads:
+            stats = await run_asgi(operations[name], args.ops, args.warmup, args.concurrency)
+            results.append(dict(rows=rows, mode="asgi", workload=name, **stats))
+    return results
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit or None,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def print_summary(results: List[Dict[str, Any]]):
+    print(f"{'rows':>9} {'mode':>10} {'workload':>16} {'p50 ms':>9} {'p99 ms':>9} {'ops/s':>10}")
+    for result in results:
+        print(f"{result['rows']:>9} {result['mode']:>10} {result['workload']:>16} "
+              f"{result['p50_ms']:>9.3f} {result['p99_ms']:>9.3f} {result['throughput_ops_s']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="10000,100000", help="Comma separated table sizes, e.g. 10000,1000000,10000000")
+    parser.add_argument("--ops", type=int, default=500, help="Timed operations per workload")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--workloads", default=",".join(WORKLOADS))
+    parser.add_argument("--modes", default="in_process,asgi")
+    parser.add_argument("--concurrency", type=int, default=1, help="Concurrent requests in asgi mode")
+    parser.add_argument("--wal", action="store_true", help="Log writes to a write-ahead log like the server does")
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+    args.workloads = args.workloads.split(",")
+    modes = args.modes.split(",")
+
+    results = []
+    for rows in [int(rows) for rows in args.rows.split(",")]:
+        # A fresh table per mode, so the writes of one mode do not affect the other
+        if "in_process" in modes:
+            with tempfile.TemporaryDirectory() as directory:
+                db = open_database(rows, directory, args.wal)
+                work = Workloads(rows, args.ops + args.warmup, seed=1)
+                operations = in_process_operations(db, work)
+                for name in args.workloads:
+                    stats = run_in_process(operations[name], args.ops, args.warmup)
+                    results.append(dict(rows=rows, mode="in_process", workload=name, **stats))
+                db.close()
+        if "asgi" in modes:
+            with tempfile.TemporaryDirectory() as directory:
+                db = open_database(rows, directory, args.wal)
+                results.extend(asyncio.run(benchmark_asgi(db, rows, args)))
+                db.close()
+
+    print_summary(results)
+    with open(args.output, "w") as f:
+        json.dump({"environment": environment(), "settings": vars(args), "results": results}, f, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List
+
+# Make the app modules (database, schemas, ...) importable from the benchmarks folder
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+sys.path.insert(0, APP_DIR)
+
+from schemas.booking import BookingBase
+from storage import compact_frame, write_columns, cache_dir_for
+
+MONTHS = ["January", "February", "March", "April", "May", "June", "July",
+          "August", "September", "October", "November", "December"]
+
+# Values for the text columns, roughly like the real hotel bookings dataset
+CHOICES = {
+    "hotel": ["City Hotel", "Resort Hotel"],
+    "arrival_date_month": MONTHS,
+    "meal": ["BB", "HB", "FB", "SC", "Undefined"],
+    "country": ["PRT", "GBR", "FRA", "ESP", "DEU", "ITA", "IRL", "BEL", "BRA", "NLD",
+                "USA", "CHE", "CN", "AUT", "SWE", "CHN", "POL", "ISR", "RUS", "NOR"],
+    "market_segment": ["Online TA", "Offline TA/TO", "Groups", "Direct", "Corporate",
+                       "Complementary", "Aviation"],
+    "distribution_channel": ["TA/TO", "Direct", "Corporate", "GDS"],
+    "reserved_room_type": list("ABCDEFGH"),
+    "assigned_room_type": list("ABCDEFGHIK"),
+    "deposit_type": ["No Deposit", "Non Refund", "Refundable"],
+    "customer_type": ["Transient", "Transient-Party", "Contract", "Group"],
+    "reservation_status": ["Check-Out", "Canceled", "No-Show"],
+}
+
+# Upper bounds (exclusive) for the integer columns
+INT_RANGES = {
+    "is_canceled": 2,
+    "lead_time": 700,
+    "arrival_date_week_number": 54,
+    "arrival_date_day_of_month": 32,
+    "stays_in_weekend_nights": 8,
+    "stays_in_week_nights": 20,
+    "adults": 5,
+    "babies": 3,
+    "is_repeated_guest": 2,
+    "previous_cancellations": 5,
+    "previous_bookings_not_canceled": 10,
+    "booking_changes": 6,
+    "days_in_waiting_list": 100,
+    "required_car_parking_spaces": 3,
+    "total_of_special_requests": 6,
+}
+
+
+def make_bookings(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Random bookings with every BookingBase column, in the CSV's column order."""
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for name in BookingBase.model_fields:
+        if name in CHOICES:
+            columns[name] = rng.choice(CHOICES[name], rows)
+        elif name in INT_RANGES:
+            columns[name] = rng.integers(0, INT_RANGES[name], rows)
+        elif name == "arrival_date_year":
+            columns[name] = rng.integers(2015, 2018, rows)
+        elif name == "children":
+            children = rng.integers(0, 3, rows).astype(float)
+            children[rng.random(rows) < 0.001] = np.nan
+            columns[name] = children
+        elif name in ("agent", "company"):
+            ids = rng.integers(1, 500, rows).astype(str).astype(object)
+            ids[rng.random(rows) < 0.5] = "NULL"
+            columns[name] = ids
+        elif name == "adr":
+            columns[name] = np.round(rng.gamma(4.0, 25.0, rows), 2)
+        elif name == "reservation_status_date":
+            days = rng.integers(0, 1000, rows)
+            columns[name] = (np.datetime64("2015-01-01") + days).astype(str)
+    return pd.DataFrame(columns)
+
+
+def booking_records(rows: int, seed: int = 0) -> List[Dict[str, Any]]:
+    # JSON-safe booking dicts (NaN -> None), e.g. for POST /bookings/
+    frame = make_bookings(rows, seed)
+    return frame.astype(object).where(frame.notna(), None).to_dict(orient="records")
+
+
+def write_columns_cache(rows: int, directory: str, seed: int = 0) -> str:
+    """
+    Write synthetic bookings straight into the columnar cache format and
+    return the CSV path the Database should be opened with. No CSV is written,
+    so millions of rows load without parsing text.
+    """
+    path = os.path.join(directory, "hotel_bookings.csv")
+    frame = compact_frame(make_bookings(rows, seed))
+    write_columns(frame, cache_dir_for(path), {"source": None})
+    return path
+
+
+def write_csv(rows: int, directory: str, seed: int = 0) -> str:
+    # Write a synthetic hotel_bookings.csv into `directory` and return its path
+    path = os.path.join(directory, "hotel_bookings.csv")
+    make_bookings(rows, seed).to_csv(path, index=False)
+    return path
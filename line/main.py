@@ -1,6 +1,12 @@
 from fastapi import FastAPI
 from dotenv import load_dotenv
 import os
+import sys
+
+# The repository root holds the observability package shared by all apps
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from observability import instrument
 from routers import webhook, messaging
 
 # Load environment variables
@@ -24,6 +30,9 @@ app = FastAPI(
 app.include_router(webhook.router, prefix="/webhook", tags=["Webhook"])
 app.include_router(messaging.router, prefix="/messaging", tags=["Messaging Actions"])
 
+# Latency, in-flight and payload size metrics at /metrics, plus the slow request log
+instrument(app)
+
 @app.get("/", tags=["System"])
 async def root():
     """
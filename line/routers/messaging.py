@@ -9,6 +9,7 @@ from linebot.v3.messaging import (
 )
 import os
 from dotenv import load_dotenv
+from observability import upstream_call
 
 load_dotenv()
 
@@ -32,12 +33,13 @@ async def push_message(payload: PushMessage):
     with ApiClient(configuration) as api_client:
         line_bot_api = MessagingApi(api_client)
         try:
-            line_bot_api.push_message(
-                PushMessageRequest(
-                    to=payload.user_id,
-                    messages=[TextMessage(text=payload.text)]
+            with upstream_call("line", "push_message"):
+                line_bot_api.push_message(
+                    PushMessageRequest(
+                        to=payload.user_id,
+                        messages=[TextMessage(text=payload.text)]
+                    )
                 )
-            )
             return {"status": "success", "message": "Push message sent"}
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
@@ -52,7 +54,8 @@ async def get_profile(user_id: str):
     with ApiClient(configuration) as api_client:
         line_bot_api = MessagingApi(api_client)
         try:
-            profile = line_bot_api.get_profile(user_id)
+            with upstream_call("line", "get_profile"):
+                profile = line_bot_api.get_profile(user_id)
             return {
                 "display_name": profile.display_name,
                 "user_id": profile.user_id,
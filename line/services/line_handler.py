@@ -10,6 +10,7 @@ from linebot.v3.messaging import (
 import os
 import google.generativeai as genai
 from dotenv import load_dotenv
+from observability import upstream_call
 
 load_dotenv()
 
@@ -30,7 +31,8 @@ class LineService:
     def get_user_profile(self, user_id):
         with ApiClient(self.configuration) as api_client:
             line_bot_api = MessagingApi(api_client)
-            return line_bot_api.get_profile(user_id)
+            with upstream_call("line", "get_profile"):
+                return line_bot_api.get_profile(user_id)
 
     def handle_text_message(self, event):
         """
@@ -45,16 +47,18 @@ class LineService:
             
             # 1. Show loading animation
             try:
-                line_bot_api.show_loading_animation(
-                    ShowLoadingAnimationRequest(chatId=event.source.user_id, loadingSeconds=20)
-                )
+                with upstream_call("line", "show_loading_animation"):
+                    line_bot_api.show_loading_animation(
+                        ShowLoadingAnimationRequest(chatId=event.source.user_id, loadingSeconds=20)
+                    )
             except Exception as e:
                 print(f"Error showing loading animation: {e}")
 
             # 2. Get response from Gemini
             if self.model:
                 try:
-                    response = self.model.generate_content(user_message)
+                    with upstream_call("gemini", "generate_content"):
+                        response = self.model.generate_content(user_message)
                     reply_text = response.text
                 except Exception as e:
                     reply_text = f"Gemini Error: {str(e)}"
@@ -66,12 +70,13 @@ class LineService:
                     reply_text = f"Service processed: {user_message} {user_profile.display_name}"
 
             # 3. Reply to user
-            line_bot_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text=reply_text)]
+            with upstream_call("line", "reply_message"):
+                line_bot_api.reply_message(
+                    ReplyMessageRequest(
+                        reply_token=event.reply_token,
+                        messages=[TextMessage(text=reply_text)]
+                    )
                 )
-            )
         
     def handle_beacon(self, event):
         """
@@ -82,12 +87,13 @@ class LineService:
         
         with ApiClient(self.configuration) as api_client:
             line_bot_api = MessagingApi(api_client)
-            line_bot_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=event.reply_token,
-                    messages=[TextMessage(text=reply_text)]
+            with upstream_call("line", "reply_message"):
+                line_bot_api.reply_message(
+                    ReplyMessageRequest(
+                        reply_token=event.reply_token,
+                        messages=[TextMessage(text=reply_text)]
+                    )
                 )
-            )
 
 # Create a singleton instance
 line_service = LineService()
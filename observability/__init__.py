@@ -0,0 +1,12 @@
+from .metrics import LATENCY_BUCKETS, Gauge, Histogram, MetricsMiddleware, annotate, instrument, registry, upstream_call
+
+__all__ = [
+    "LATENCY_BUCKETS",
+    "Gauge",
+    "Histogram",
+    "MetricsMiddleware",
+    "annotate",
+    "instrument",
+    "registry",
+    "upstream_call"
+]
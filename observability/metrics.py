@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import APIRouter, FastAPI
+from fastapi.responses import PlainTextResponse
+
+slow_logger = logging.getLogger("observability.slow_requests")
+
+# Requests slower than this (in seconds) are written to the slow request log
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "1.0"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Cumulative histogram per label set, in the Prometheus layout."""
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...]):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # labels -> [count per bucket..., +Inf count, sum]
+        self.series: Dict[Labels, List[float]] = {}
+
+    def observe(self, labels: Labels, value: float):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[len(self.buckets)] += 1
+        series[-1] += value
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in sorted(self.series.items()):
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                yield f"{self.name}_bucket{format_labels(labels + (('le', str(bound)),))} {count}"
+            yield f"{self.name}_sum{format_labels(labels)} {series[-1]}"
+            yield f"{self.name}_count{format_labels(labels)} {series[len(self.buckets)]}"
+
+
+class Gauge:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.series: Dict[Labels, float] = {}
+
+    def add(self, labels: Labels, amount: float):
+        self.series[labels] = self.series.get(labels, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        for labels, value in sorted(self.series.items()):
+            yield f"{self.name}{format_labels(labels)} {value}"
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+class MetricsRegistry:
+    """In-process metrics of one app, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.request_duration = Histogram("http_request_duration_seconds",
+                                          "Time to handle a request, including streaming the response.",
+                                          LATENCY_BUCKETS)
+        self.requests_in_flight = Gauge("http_requests_in_flight", "Requests currently being handled.")
+        self.request_size = Histogram("http_request_size_bytes", "Size of request bodies.", SIZE_BUCKETS)
+        self.response_size = Histogram("http_response_size_bytes", "Size of response bodies.", SIZE_BUCKETS)
+        self.upstream_duration = Histogram("upstream_request_duration_seconds",
+                                           "Time spent calling external services.", LATENCY_BUCKETS)
+        self.metrics = [self.request_duration, self.requests_in_flight, self.request_size,
+                        self.response_size, self.upstream_duration]
+
+    def register(self, metric):
+        """Add an app-specific metric (e.g. the depth of a work queue); update it under `lock`."""
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        with self.lock:
+            lines = []
+            for metric in self.metrics:
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# Details of the request being handled, for the slow request log
+request_details: ContextVar[Optional[Dict[str, Any]]] = ContextVar("request_details", default=None)
+
+
+def annotate(**details: Any):
+    """Attach details (e.g. the filters of a query) to the current request's slow log entry."""
+    current = request_details.get()
+    if current is not None:
+        current.update(details)
+
+
+@contextmanager
+def upstream_call(service: str, operation: str):
+    """
+    Time a call to an external service. The duration is recorded in the
+    upstream histogram and in the slow log entry of the current request.
+    """
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - start
+        with registry.lock:
+            registry.upstream_duration.observe(
+                (("service", service), ("operation", operation), ("outcome", outcome)), elapsed)
+        current = request_details.get()
+        if current is not None:
+            current.setdefault("upstream", []).append(
+                {"service": service, "operation": operation, "outcome": outcome, "seconds": round(elapsed, 4)})
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency and payload sizes per route template
+    (e.g. /bookings/{booking_id}), in-flight requests per method, and logging
+    slow requests.
+    """
+
+    def __init__(self, app, slow_request_seconds: float = SLOW_REQUEST_SECONDS):
+        self.app = app
+        self.slow_request_seconds = slow_request_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        sizes = {"request": 0, "response": 0}
+        status = {"code": 500}
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes["request"] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes["response"] += len(message.get("body", b""))
+            await send(message)
+
+        details = {}
+        token = request_details.set(details)
+        with registry.lock:
+            registry.requests_in_flight.add((("method", method),), 1)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            elapsed = time.perf_counter() - start
+            request_details.reset(token)
+            # The router stores the matched route in the scope; label by its template
+            # so path parameters do not create new series
+            route = getattr(scope.get("route"), "path", "unmatched")
+            labels = (("method", method), ("route", route))
+            with registry.lock:
+                registry.requests_in_flight.add((("method", method),), -1)
+                registry.request_duration.observe(labels + (("status", str(status["code"])),), elapsed)
+                registry.request_size.observe(labels, sizes["request"])
+                registry.response_size.observe(labels, sizes["response"])
+            if elapsed >= self.slow_request_seconds:
+                entry = {
+                    "method": method,
+                    "path": scope["path"],
+                    "query": scope.get("query_string", b"").decode("latin-1"),
+                    "route": route,
+                    "status": status["code"],
+                    "seconds": round(elapsed, 4),
+                    "response_bytes": sizes["response"],
+                    **details,
+                }
+                slow_logger.warning("Slow request %s", json.dumps(entry, default=str))
+
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+def instrument(app: FastAPI, slow_request_seconds: float = SLOW_REQUEST_SECONDS):
+    """Add the metrics middleware and the /metrics endpoint to an app."""
+    app.include_router(metrics_router)
+    app.add_middleware(MetricsMiddleware, slow_request_seconds=slow_request_seconds)